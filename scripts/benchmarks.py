@@ -0,0 +1,497 @@
+"""Time selected stewi functions against synthetic data via command line
+
+e.g. python scripts/benchmarks.py validate --rows 100000
+     python scripts/benchmarks.py aggregate --rows 1000000
+     python scripts/benchmarks.py overlap --rows 500000
+     python scripts/benchmarks.py rcrainfo --rows 1000000
+     python scripts/benchmarks.py ghgrp --rows 5000
+"""
+
+import ast
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import stewi.GHGRP as GHGRP
+from stewi.DMR import preferred_flow_mask, remove_nutrient_overlap_TRI
+from stewi.globals import aggregate, aggregate_rollup, log
+from stewi.RCRAInfo import join_fields, read_br_reporting,\
+    read_required_fields
+from stewi.validate import validate_inventory
+
+
+def timeit(label, func, *args, repeat=3, **kwargs):
+    """Return the result of func and print the best time of several runs."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    print(f'{label}: {min(times):.4f} s (best of {repeat})')
+    return result
+
+
+def peak_memory(label, func, *args, **kwargs):
+    """Return the result of func and print the peak memory it allocated."""
+    tracemalloc.start()
+    result = func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{label}: {peak / 1e6:.1f} MB peak')
+    return result
+
+
+def _validate_inventory_baseline(inventory_df, reference_df, group_by=None,
+                       tolerance=5.0, filepath=''):
+    """validate_inventory as previously applied, copied verbatim.
+
+    Compare inventory output with a reference DataFrame from another source.
+
+    :param inventory_df: DataFrame of inventory resulting from script output
+    :param reference_df: Reference DataFrame to compare emission quantities against.
+        Must have same keys as inventory_df
+    :param group_by: list of columns to compare across
+    :param tolerance: Maximum acceptable percent difference between inventory
+        and reference values. Default is 5%
+    :return: DataFrame containing 'Conclusion' of statistical comparison and
+        'Percent_Difference'
+    """
+    if not group_by:
+        group_by_columns = ['FlowName']
+    else:
+        group_by_columns = [group_by] if isinstance(group_by, str) else group_by
+    if 'Compartment' in group_by_columns:
+        reference_df['PrimaryCompartment'] = reference_df['Compartment']
+        inventory_df['PrimaryCompartment'] = (inventory_df['Compartment']
+                                              .str.split('/').str[0])
+        group_by_columns.append('PrimaryCompartment')
+        group_by_columns.remove('Compartment')
+    inventory_df['FlowAmount'] = inventory_df['FlowAmount'].fillna(0.0)
+    reference_df['FlowAmount'] = reference_df['FlowAmount'].fillna(0.0)
+    inventory_sums = inventory_df[group_by_columns + ['FlowAmount']].groupby(
+        group_by_columns).sum().reset_index()
+    reference_sums = reference_df[group_by_columns + ['FlowAmount']].groupby(
+        group_by_columns).sum().reset_index()
+    if filepath:
+        reference_sums.to_csv(filepath, index=False)
+    validation_df = inventory_sums.merge(reference_sums, how='outer',
+                                         on=group_by_columns).reset_index(drop=True)
+    validation_df = validation_df.fillna(0.0)
+    amount_x_list = []
+    amount_y_list = []
+    pct_diff_list = []
+    conclusion = []
+    error_count = 0
+    for index, row in validation_df.iterrows():
+        amount_x = float(row['FlowAmount_x'])
+        amount_y = float(row['FlowAmount_y'])
+        if amount_x == 0.0:
+            amount_x_list.append(amount_x)
+            if amount_y == 0.0:
+                pct_diff_list.append(0.0)
+                amount_y_list.append(amount_y)
+                conclusion.append('Both inventory and reference are zero or null')
+            elif amount_y == np.inf:
+                amount_y_list.append(np.nan)
+                pct_diff_list.append(100.0)
+                conclusion.append('Reference contains infinity values. '
+                                  'Check prior calculations.')
+            else:
+                amount_y_list.append(amount_y)
+                pct_diff_list.append(100.0)
+                conclusion.append('Inventory value is zero or null')
+                error_count += 1
+        elif amount_y == 0.0:
+            amount_x_list.append(amount_x)
+            amount_y_list.append(amount_y)
+            pct_diff_list.append(100.0)
+            conclusion.append('Reference value is zero or null')
+            continue
+        elif amount_y == np.inf:
+            amount_x_list.append(amount_x)
+            amount_y_list.append(np.nan)
+            pct_diff_list.append(100.0)
+            conclusion.append('Reference contains infinity values. '
+                              'Check prior calculations.')
+        else:
+            pct_diff = 100.0 * abs(amount_y - amount_x) / amount_y
+            pct_diff_list.append(pct_diff)
+            amount_x_list.append(amount_x)
+            amount_y_list.append(amount_y)
+            if pct_diff == 0.0:
+                conclusion.append('Identical')
+            elif pct_diff <= tolerance:
+                conclusion.append('Statistically similar')
+            elif pct_diff > tolerance:
+                conclusion.append('Percent difference exceeds tolerance')
+                error_count += 1
+    validation_df['Inventory_Amount'] = amount_x_list
+    validation_df['Reference_Amount'] = amount_y_list
+    validation_df['Percent_Difference'] = pct_diff_list
+    validation_df['Conclusion'] = conclusion
+    validation_df = validation_df.drop(['FlowAmount_x', 'FlowAmount_y'], axis=1)
+    if error_count > 0:
+        log.warning(f'{str(error_count)} potential issues in validation '
+                    'exceeding tolerance')
+
+    return validation_df
+
+
+def benchmark_validate(rows=100000, flows=5000, seed=0):
+    """Compare validate_inventory with the former row by row comparison."""
+    rng = np.random.default_rng(seed)
+    names = [f'flow {i}' for i in range(flows)]
+    amounts = [0.0, np.nan, 1.0, 2.5, 10.0, np.inf]
+    inventory_df = pd.DataFrame(
+        {'FlowName': rng.choice(names, rows),
+         'Compartment': rng.choice(['air', 'air/urban', 'water'], rows),
+         'FlowAmount': rng.choice(amounts, rows) * rng.choice([1, 1.01, 1.2], rows)})
+    reference_df = pd.DataFrame(
+        {'FlowName': rng.choice(names, rows // 10),
+         'Compartment': rng.choice(['air', 'water'], rows // 10),
+         'FlowAmount': rng.choice(amounts, rows // 10)})
+    result = timeit('validate_inventory', validate_inventory,
+                    inventory_df, reference_df,
+                    group_by=['FlowName', 'Compartment'])
+    # the former implementation modifies its arguments
+    baseline = timeit('former validate_inventory', lambda:
+                      _validate_inventory_baseline(
+                          inventory_df.copy(), reference_df.copy(),
+                          group_by=['FlowName', 'Compartment']),
+                      repeat=1)
+    pd.testing.assert_frame_equal(result, baseline)
+    print(f'{len(result)} comparisons, results identical')
+
+
+def _aggregate_separately(df, process_vars, facility_vars):
+    """Aggregate each output from the full records as previously in NEI."""
+    return [aggregate(df, process_vars), aggregate(df, facility_vars)]
+
+
+def benchmark_aggregate(rows=1000000, facilities=20000, seed=0):
+    """Compare aggregate_rollup with separate aggregation of NEI outputs."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {'FacilityID': rng.integers(0, facilities, rows).astype(str),
+         'FlowName': rng.choice([f'flow {i}' for i in range(300)], rows),
+         'Compartment': rng.choice(['air', 'air/urban', 'air/rural'], rows),
+         'Process': rng.choice([f'{i:08d}' for i in range(2000)], rows),
+         'FlowAmount': rng.exponential(10, rows),
+         'DataReliability': rng.choice([1, 2, 3, 4, 5, np.nan], rows)})
+    process_vars = ['FacilityID', 'Compartment', 'FlowName', 'Process']
+    facility_vars = ['FacilityID', 'FlowName', 'Compartment']
+    old = timeit('aggregate', _aggregate_separately, df, process_vars,
+                 facility_vars)
+    new = timeit('aggregate_rollup', aggregate_rollup, df, process_vars,
+                 [facility_vars])
+    peak_memory('aggregate', _aggregate_separately, df, process_vars,
+                facility_vars)
+    peak_memory('aggregate_rollup', aggregate_rollup, df, process_vars,
+                [facility_vars])
+    for o, n in zip(old, new):
+        pd.testing.assert_frame_equal(o.reset_index(drop=True),
+                                      n.reset_index(drop=True),
+                                      check_exact=False, rtol=1e-12)
+    print(f'{len(new[0])} process and {len(new[1])} facility records, '
+          'results equivalent')
+
+
+def _organic_enrichment_loop(df, org_flow_list, keep_list):
+    """Organic enrichment removal by facility as previously applied in DMR
+    remove_duplicate_organic_enrichment."""
+    df_org = df.loc[df['FlowName'].isin(org_flow_list)]
+    df_duplicates = df_org[df_org.duplicated(subset='FacilityID', keep=False)]
+    if len(df_duplicates) == 0:
+        return df
+
+    df = df.loc[~df['FlowName'].isin(org_flow_list)]
+    df_org = df_org[~df_org.duplicated(subset='FacilityID', keep=False)]
+    to_be_concat = []
+    to_be_concat.append(df)
+    to_be_concat.append(df_org)
+
+    df_duplicates['PrefList'] = df_duplicates[
+        'FlowName'].apply(lambda x: x in keep_list)
+    df_duplicates['NonPrefList'] = df_duplicates[
+        'FlowName'].apply(lambda x: x not in keep_list)
+    grouped = df_duplicates.groupby(['FacilityID'])
+    for name, frame in grouped:
+        if not frame['NonPrefList'].all():
+            frame = frame[frame['PrefList']]
+        to_be_concat.append(frame)
+    df = (pd.concat(to_be_concat)
+          .sort_index()
+          .drop(columns=['PrefList', 'NonPrefList'])
+          .reset_index(drop=True))
+    return df
+
+
+def _nutrient_overlap_loop(df, combined_list, keep_list):
+    """Nutrient overlap removal by facility as previously applied in DMR."""
+    df_nutrients = df.loc[((df['FlowName'].isin(combined_list)) &
+                           (df['Compartment'] == 'water'))]
+    df_duplicates = df_nutrients[df_nutrients.duplicated(subset='FRS_ID',
+                                                         keep=False)]
+    if len(df_duplicates) == 0:
+        return df
+    df = df.loc[~((df['FlowName'].isin(combined_list)) &
+                  (df['Compartment'] == 'water'))]
+    df_nutrients = df_nutrients[~df_nutrients.duplicated(subset='FRS_ID',
+                                                         keep=False)]
+    to_be_concat = [df, df_nutrients]
+    df_duplicates = df_duplicates.assign(
+        PrefList=df_duplicates['FlowName'].apply(lambda x: x in keep_list),
+        NonPrefList=df_duplicates['FlowName'].apply(lambda x: x not in keep_list))
+    for name, frame in df_duplicates.groupby(['FRS_ID']):
+        if not frame['NonPrefList'].all():
+            frame = frame[frame['PrefList']]
+        to_be_concat.append(frame)
+    return (pd.concat(to_be_concat)
+            .sort_index()
+            .drop(columns=['PrefList', 'NonPrefList'])
+            .reset_index(drop=True))
+
+
+def benchmark_overlap(rows=500000, facilities=100000, seed=0):
+    """Compare vectorized overlap resolution of DMR organic enrichment and
+    TRI/DMR nutrient flows with the former loops by facility."""
+    rng = np.random.default_rng(seed)
+    org_flow_list = ['BOD, 5-day', 'BOD, carbonaceous', 'COD', 'TOC']
+    cod_list = ['COD']
+    nutrient_list = ['Ammonia', 'Nitrate Compounds', 'Nitrogen']
+    tri_list = ['Ammonia', 'Nitrate Compounds']
+    flows = org_flow_list + nutrient_list + [f'flow {i}' for i in range(100)]
+    ids = rng.integers(0, facilities, rows).astype(str)
+    df = pd.DataFrame({'FacilityID': ids,
+                       'FRS_ID': ids,
+                       'FlowName': rng.choice(flows, rows,
+                                              p=np.r_[np.full(7, 0.1),
+                                                      np.full(100, 0.003)]),
+                       'Compartment': rng.choice(['water', 'air'], rows)})
+    new = timeit('preferred_flow_mask', lambda: df[preferred_flow_mask(
+        df, df['FlowName'].isin(org_flow_list), 'FacilityID', cod_list)]
+        .reset_index(drop=True))
+    old = timeit('organic enrichment loop', _organic_enrichment_loop, df,
+                 org_flow_list, cod_list, repeat=1)
+    pd.testing.assert_frame_equal(new, old)
+    print(f'{len(df) - len(new)} organic enrichment records removed, '
+          'results identical')
+    new = timeit('remove_nutrient_overlap_TRI', remove_nutrient_overlap_TRI,
+                 df, 'TRI')
+    old = timeit('nutrient overlap loop', _nutrient_overlap_loop, df,
+                 nutrient_list, tri_list, repeat=1)
+    pd.testing.assert_frame_equal(new, old)
+    print(f'{len(df) - len(new)} nutrient records removed, results identical')
+
+
+def _read_br_reporting_pandas(filepath, fields):
+    """Read BR_REPORTING records as previously in RCRAInfo."""
+    return pd.read_csv(filepath, header=0, usecols=fields,
+                       low_memory=False, on_bad_lines='skip',
+                       encoding='ISO-8859-1')
+
+
+def benchmark_rcrainfo(rows=1000000, facilities=200000, seed=0):
+    """Compare reading, facility addresses and code merges of RCRAInfo
+    inventory generation with the former pandas approach, for a synthetic
+    Biennial Report cycle."""
+    rng = np.random.default_rng(seed)
+    fields = read_required_fields()
+    df = pd.DataFrame({f: rng.choice(['Y', 'N', 'text field', None], rows)
+                       for f in fields})
+    df['Handler ID'] = rng.integers(0, facilities, rows).astype(str)
+    df['Location Street Number'] = rng.choice(['12', '1-A', None], rows)
+    df['Location Street 1'] = rng.choice(['Main St', 'Elm St', None], rows)
+    df['Generation Tons'] = rng.exponential(10, rows).astype(str)
+    waste_codes = pd.DataFrame({'Waste Code Group': [f'D{i:03d}'
+                                                     for i in range(1000)],
+                                'Waste Code Description': 'description'})
+    form_codes = pd.DataFrame({'Form Code': [f'W{i:03d}' for i in range(500)],
+                               'FORM_CODE_NAME': 'form'})
+    df['Waste Code Group'] = rng.choice(
+        np.r_[waste_codes['Waste Code Group'], ['X', None]], rows)
+    df['Form Code'] = rng.choice(np.r_[form_codes['Form Code'], [None]], rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = Path(tmp) / 'br_reporting.csv'
+        parquet_file = Path(tmp) / 'br_reporting.parquet'
+        df.to_csv(csv_file, index=False, encoding='ISO-8859-1')
+        df.to_parquet(parquet_file, index=False)
+        timeit('pandas csv', _read_br_reporting_pandas, csv_file, fields,
+               repeat=1)
+        timeit('arrow csv', read_br_reporting, csv_file, fields, repeat=1)
+        df = timeit('parquet', read_br_reporting, parquet_file, fields)
+
+    address_fields = ['Location Street Number', 'Location Street 1',
+                      'Location Street 2']
+    fac = df[['Handler ID'] + address_fields].drop_duplicates()
+    old = timeit('address apply', fac[address_fields].apply,
+                 lambda x: ' '.join(x.dropna()), axis=1, repeat=1)
+    new = timeit('join_fields', join_fields, fac, address_fields)
+    assert (old == new).all()
+
+    keys = ['Waste Code Group', 'Form Code']
+    df_str = df.astype({k: object for k in keys})
+    old = timeit('merge', lambda: df_str.merge(waste_codes, how='left')
+                 .merge(form_codes, how='left'))
+    waste_codes, form_codes = (
+        codes.astype({k: df[k].dtype}).dropna(subset=[k])
+        for codes, k in zip([waste_codes, form_codes], keys))
+    new = timeit('categorical merge', lambda: df.merge(
+        waste_codes, how='left', on=keys[0]).merge(
+        form_codes, how='left', on=keys[1]))
+    pd.testing.assert_frame_equal(old, new.astype({k: object for k in keys}))
+    print(f'{len(fac)} facility addresses and {len(new)} records, '
+          'results identical')
+
+
+def _subpart_tables(year, rows, facilities, seed):
+    """Yield synthetic subpart emissions tables with the columns of the
+    GHGRP tables of primary emissions for year."""
+    rng = np.random.default_rng(seed)
+    tables = pd.read_csv(GHGRP.GHGRP_DATA_PATH
+                         .joinpath('all_ghgrp_tables_years.csv')).fillna('')
+    tables = tables[tables['REPORTING_YEAR'].str.contains(year) &
+                    (tables['PrimaryEmissions'] == 1)]
+    numeric = (GHGRP.quantity_cols + GHGRP.group_cols +
+               GHGRP.subpart_c_cols)
+    for subpart, columns in zip(tables['SUBPART'], tables['COLUMN_NAMES']):
+        columns = ast.literal_eval(columns)
+        df = pd.DataFrame({c: rng.choice(['text field', None], rows)
+                           for c in columns})
+        for c in df:
+            if c in numeric:
+                df[c] = np.where(rng.random(rows) < 0.5, np.nan,
+                                 rng.exponential(100, rows))
+            elif c in GHGRP.name_cols:
+                df[c] = rng.choice(['Carbon Dioxide', 'Methane', 'Other',
+                                    None], rows)
+            elif c in GHGRP.method_cols:
+                df[c] = rng.choice(['Equation C-2a', 'Equation C-8',
+                                    None], rows)
+            elif c in ['UNIT_NAME', 'FUEL_TYPE']:
+                df[c] = rng.choice([f'{c} {i}' for i in range(20)], rows)
+        df['FACILITY_ID'] = rng.integers(0, facilities, rows)
+        df['REPORTING_YEAR'] = int(year)
+        yield (df.assign(SUBPART_NAME=subpart)
+               .dropna(axis=1, how='all'))
+
+
+def _parse_subpart_tables_wide(tables):
+    """Concatenate subpart tables before reshaping them, as previously
+    applied in GHGRP."""
+    ghgrp1 = pd.concat(list(tables), ignore_index=True)
+    if 'C' in ghgrp1.SUBPART_NAME.unique():
+        ghgrp1 = GHGRP.calculate_combustion_emissions(ghgrp1)
+        expanded_group_cols = GHGRP.group_cols + ['c_co2', 'c_co2_b',
+                                                  'c_ch4', 'c_n2o']
+    else:
+        expanded_group_cols = GHGRP.group_cols
+    ghgrp1['Flow Description'] = (ghgrp1[GHGRP.name_cols].fillna('')
+                                  .sum(axis=1))
+    for col in [c for c in ghgrp1.columns if c in GHGRP.alias_cols]:
+        mask = ((ghgrp1['Flow Description'] == 'Other') &
+                ~(ghgrp1[col].isna()))
+        ghgrp1.loc[mask, 'Flow Description'] = ghgrp1[col]
+    ghgrp1['FlowAmount'] = (ghgrp1[GHGRP.quantity_cols].astype('float')
+                            .fillna(0).sum(axis=1))
+    ghgrp1['METHOD'] = ghgrp1[GHGRP.method_cols].fillna('').sum(axis=1)
+    ghgrp1a = ghgrp1.loc[ghgrp1['Flow Description'] != '']
+    ghgrp1a = ghgrp1a.drop(columns=ghgrp1a.columns.difference(
+        GHGRP.base_cols + ['Flow Description', 'FlowAmount', 'METHOD',
+                           'SUBPART_NAME']))
+    id_cols = GHGRP.base_cols + ['METHOD', 'SUBPART_NAME', 'UNIT_NAME',
+                                 'FUEL_TYPE']
+    ghgrp1b = ghgrp1.loc[ghgrp1['Flow Description'] == '']
+    ghgrp1b = (ghgrp1b.drop(columns=ghgrp1b.columns.difference(
+                   id_cols + expanded_group_cols))
+               .melt(id_vars=id_cols, var_name='Flow Description',
+                     value_name='FlowAmount'))
+    return GHGRP.combine_subpart_tables([ghgrp1a], [ghgrp1b])
+
+
+def _parse_subpart_tables_long(tables):
+    """Reshape each subpart table as it is read, as applied in GHGRP."""
+    described = []
+    by_group = []
+    for table_df in tables:
+        table_a, table_b = GHGRP.reshape_subpart_table(table_df)
+        described.append(table_a)
+        by_group.append(table_b)
+    return GHGRP.combine_subpart_tables(described, by_group)
+
+
+def benchmark_ghgrp(rows=5000, facilities=5000, year='2019', seed=0):
+    """Compare the parsing of GHGRP subpart tables into long format with
+    the former approach of reshaping the union of all tables."""
+    args = (year, rows, facilities, seed)
+    old = peak_memory('wide union', _parse_subpart_tables_wide,
+                      _subpart_tables(*args))
+    new = peak_memory('tables reshaped separately',
+                      _parse_subpart_tables_long, _subpart_tables(*args))
+    timeit('wide union', lambda: _parse_subpart_tables_wide(
+        _subpart_tables(*args)), repeat=1)
+    timeit('tables reshaped separately', lambda: _parse_subpart_tables_long(
+        _subpart_tables(*args)), repeat=1)
+    # the union assigns zero amounts for the group columns of other tables
+    old = old[old['FlowAmount'] != 0].reset_index(drop=True)
+    new = new[new['FlowAmount'] != 0].reset_index(drop=True)
+    pd.testing.assert_frame_equal(old, new[old.columns])
+    print(f'{len(new)} nonzero records, results identical')
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    validate = subparsers.add_parser('validate', help='validate_inventory')
+    validate.add_argument('--rows', type=int, default=100000,
+                          help='number of inventory records')
+    validate.add_argument('--flows', type=int, default=5000,
+                          help='number of unique flows')
+
+    agg = subparsers.add_parser('aggregate', help='aggregate_rollup')
+    agg.add_argument('--rows', type=int, default=1000000,
+                     help='number of inventory records')
+    agg.add_argument('--facilities', type=int, default=20000,
+                     help='number of unique facilities')
+
+    overlap = subparsers.add_parser('overlap',
+                                    help='DMR overlap resolution')
+    overlap.add_argument('--rows', type=int, default=500000,
+                         help='number of inventory records')
+    overlap.add_argument('--facilities', type=int, default=100000,
+                         help='number of unique facilities')
+
+    rcrainfo = subparsers.add_parser('rcrainfo',
+                                     help='RCRAInfo inventory generation')
+    rcrainfo.add_argument('--rows', type=int, default=1000000,
+                          help='number of Biennial Report records')
+    rcrainfo.add_argument('--facilities', type=int, default=200000,
+                          help='number of unique facilities')
+
+    ghgrp = subparsers.add_parser('ghgrp', help='GHGRP subpart tables')
+    ghgrp.add_argument('--rows', type=int, default=5000,
+                       help='number of records per subpart table')
+    ghgrp.add_argument('--facilities', type=int, default=5000,
+                       help='number of unique facilities')
+    ghgrp.add_argument('--year', default='2019',
+                       help='year of the subpart tables')
+
+    args = vars(parser.parse_args())
+    benchmark = args.pop('benchmark')
+    if benchmark == 'validate':
+        benchmark_validate(**args)
+    elif benchmark == 'aggregate':
+        benchmark_aggregate(**args)
+    elif benchmark == 'overlap':
+        benchmark_overlap(**args)
+    elif benchmark == 'rcrainfo':
+        benchmark_rcrainfo(**args)
+    elif benchmark == 'ghgrp':
+        benchmark_ghgrp(**args)
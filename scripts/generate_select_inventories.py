@@ -1,9 +1,10 @@
 """Generate inventory files via command line"""
 
 import stewi
+from stewi.filter import store_filtered_inventory
 
 
-def main(inventory, years):
+def main(inventory, years, filters=None):
     if '-' in years:
         years_list = years.split('-')
         year_iter = list(range(int(years_list[0]), int(years_list[1]) + 1))
@@ -16,6 +17,8 @@ def main(inventory, years):
     for i_year in year_iter:
         try:
             stewi.globals.generate_inventory(inventory, i_year)
+            if filters:
+                store_filtered_inventory(inventory, i_year, filters)
         except stewi.exceptions.InventoryNotAvailableError as err:
             print(err)
             continue
@@ -29,7 +32,12 @@ if __name__=="__main__":
     parser.add_argument('--years', help='single year or years separated'
                         'by dash')
     parser.add_argument('--inventory', help='inventory acroynym')
+    parser.add_argument('--filters', help='optional filters or filter sets '
+                        'separated by comma, e.g. filter_for_LCI, to store '
+                        'as filtered inventories')
 
     args = vars(parser.parse_args())
+    filters = ([f.strip() for f in args['filters'].split(',')]
+               if args['filters'] else None)
 
-    main(args['inventory'], args['years'])
+    main(args['inventory'], args['years'], filters)
@@ -22,7 +22,11 @@ setup(
         'PyYAML>=5.1',
         'openpyxl>=3.0.7',
         'xlrd>=2.0.0',
+        'pyarrow>=14.0',
         ],
+    entry_points={
+        'console_scripts': ['stewi = stewi.__main__:main'],
+        },
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Environment :: Console",
@@ -2,7 +2,8 @@
 # !/usr/bin/env python3
 # coding=utf-8
 """
-Queries DMR data by state, temporarily saves them,
+Queries DMR data by state, temporarily saves them as a parquet dataset
+partitioned by year, nutrient and state,
 Web service documentation found at
 https://echo.epa.gov/system/files/ECHO%20All%20Data%20Search%20Services_v3.pdf
 
@@ -13,6 +14,9 @@ Option:
 A - for downloading DMR data by state
 B - for generating StEWI output files and validation from downloaded data
 C - for downloading and generating state totals file
+D - for downloading DMR data again for states passed with -S and updating
+    stored StEWI output files and validation for those states
+    D -Y 2016 -S TX CA
 
 Year:
     2014-2023
@@ -21,20 +25,31 @@ Year:
 import pandas as pd
 import numpy as np
 import argparse
+import json
+import os
+import threading
 import urllib
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from functools import lru_cache
 from pathlib import Path
 from io import BytesIO
 
-from esupy.processed_data_mgmt import read_source_metadata
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from esupy.processed_data_mgmt import read_source_metadata,\
+    load_preprocessed_output
 from esupy.remote import make_url_request
 from stewi.globals import unit_convert,\
     DATA_PATH, lb_kg, write_metadata, get_reliability_table_for_source,\
     log, compile_source_metadata, config, store_inventory, set_stewi_meta,\
-    paths, aggregate
+    paths, aggregate, retry_with_backoff, STEWI_VERSION
 from stewi.validate import update_validationsets_sources, validate_inventory,\
     write_validation_result
-from stewi.filter import filter_states, filter_config
+from stewi.filter import filter_states, filter_config,\
+    remove_filtered_inventories
 import stewi.exceptions
 
 
@@ -42,12 +57,16 @@ _config = config()['databases']['DMR']
 DMR_DATA_PATH = DATA_PATH / 'DMR'
 EXT_DIR = 'DMR Data Files'
 OUTPUT_PATH = paths.local_path / EXT_DIR
+POLLUTANT_LIST_FILE = OUTPUT_PATH / 'pollutant_parameter_list.csv'
 
 states_df = pd.read_csv(DATA_PATH.joinpath('state_codes.csv'))
 STATES = list(states_df['states']) + list(states_df['dc']) +\
     list(states_df['territories'])
 STATES = tuple(x for x in STATES if str(x) != 'nan')
 
+# limits simultaneous requests to the ECHO web services across threads
+_request_slots = threading.BoundedSemaphore(_config['max_concurrent_requests'])
+
 # Values used for StEWI query
 PARAM_GROUP = True
 DETECTION = 'HALF'
@@ -79,8 +98,6 @@ def generate_url(url_params):
         params['p_param_group'] = 'Y'  # default is N
     if not ESTIMATION:
         params['p_est'] = 'N'  # default is Y
-    # if 'responseset' not in params:
-    #     params['responseset'] = '20000'
 
     url = _config['base_url'] + urllib.parse.urlencode(params)
 
@@ -88,7 +105,7 @@ def generate_url(url_params):
 
 
 def query_dmr(year, state_list=STATES, nutrient=''):
-    """Loop through a set of states to download and pickle DMR data.
+    """Download and store DMR data for a set of states.
 
     :param year: str, year of data
     :param state_list: List of states to include in query
@@ -96,29 +113,55 @@ def query_dmr(year, state_list=STATES, nutrient=''):
         Input 'N' or 'P'
     :return: results dictionary
     """
-    path = OUTPUT_PATH.joinpath(year)
-    path.mkdir(parents=True, exist_ok=True)
-    results = {}
-    filestub = ''
-    url_params = {'p_year': year,
-                  'p_st': '',
-                  'p_poll_cat': nutrient,
-                  'p_nutrient_agg': 'N',
-                  'suppress_headers': 'Y',
-                  # 'responseset': '9000',
-                  # 'pageno': '1',
-                  }
-    if nutrient:
-        filestub = nutrient + "_"
-        url_params['p_nutrient_agg'] = 'Y'
-    for state in state_list:
-        filename = f"{filestub}state_{state}.pickle"
-        filepath = path.joinpath(filename)
-        if check_for_file(filepath, state):
-            results[state] = 'success'
-        else:
-            url_params['p_st'] = state
-            results[state] = download_data(url_params, filepath)
+    return query_dmr_batch(year, state_list, nutrients=[nutrient])[nutrient]
+
+
+def query_dmr_batch(year, state_list=STATES, nutrients=('', 'N', 'P'),
+                    overwrite=False):
+    """Download and store DMR data for a set of states and nutrient
+    categories concurrently.
+
+    Queries are run by a pool of at most 'max_concurrent_requests' threads
+    and each response is parsed and stored as soon as it arrives. States
+    already stored are skipped so that interrupted downloads can be resumed.
+
+    :param year: str, year of data
+    :param state_list: List of states to include in query
+    :param nutrients: list of nutrient categories, '' for no aggregation
+    :param overwrite: bool, True to query states already stored, which are
+        replaced once their query succeeds
+    :return: dictionary of results dictionaries by nutrient
+    """
+    migrate_pickles(year)
+    results = {nutrient: {} for nutrient in nutrients}
+    futures = {}
+    with ThreadPoolExecutor(
+            max_workers=_config['max_concurrent_requests']) as executor:
+        for nutrient in nutrients:
+            url_params = {'p_year': year,
+                          'p_st': '',
+                          'p_poll_cat': nutrient,
+                          'p_nutrient_agg': 'N',
+                          'suppress_headers': 'Y',
+                          }
+            if nutrient:
+                url_params['p_nutrient_agg'] = 'Y'
+            for state in state_list:
+                filepath = state_file(year, state, nutrient)
+                if not overwrite and check_for_file(filepath, state):
+                    results[nutrient][state] = 'success'
+                else:
+                    future = executor.submit(download_data,
+                                             {**url_params, 'p_st': state},
+                                             filepath)
+                    futures[future] = (nutrient, state)
+        for future in as_completed(futures):
+            nutrient, state = futures[future]
+            try:
+                results[nutrient][state] = future.result()
+            except (OSError, ValueError) as err:
+                log.error(f'query failed for {nutrient} {state}: {err}')
+                results[nutrient][state] = 'error'
     return results
 
 
@@ -131,32 +174,144 @@ def check_for_file(filepath: Path, state) -> bool:
         return False
 
 
+def request_url(url):
+    """Request url, retrying with backoff as set in config.yaml. At most
+    'max_concurrent_requests' requests are made at a time across threads."""
+    return retry_with_backoff(make_url_request, url,
+                              attempts=_config['retry_attempts'],
+                              backoff=_config['retry_backoff'],
+                              slots=_request_slots)
+
+
+def record_limit_exceeded(r):
+    """Return True if the response reports too many records for a query."""
+    return ((len(r.content) < 1000) and
+            ('Maximum number of records' in str(r.content)))
+
+
+def read_response(r):
+    """Return a df of the csv content of a response."""
+    if not r.content.strip():
+        return pd.DataFrame()
+    return pd.read_csv(BytesIO(r.content), low_memory=False)
+
+
 def download_data(url_params, filepath: Path) -> str:
-    df = pd.DataFrame()
     url = generate_url(url_params)
     log.debug(url)
-    r = make_url_request(url)
-    # When more than 100,000 records, need to split queries
-    if ((len(r.content) < 1000) and
-        ('Maximum number of records' in str(r.content))):
-        for x in ('NGP', 'GPC', 'NPD'):
-            split_url = f'{url}&p_permit_type={x}'
-            r = make_url_request(split_url)
-            df_sub = pd.read_csv(BytesIO(r.content), low_memory=False)
-            if len(df_sub) < 3: continue
-            df = pd.concat([df, df_sub], ignore_index=True)
+    r = request_url(url)
+    # When more than 100,000 records, need to page through results
+    if record_limit_exceeded(r):
+        df = download_pages(url_params)
     else:
-        df = pd.read_csv(BytesIO(r.content), low_memory=False)
+        df = read_response(r)
     log.debug(f"saving to {filepath}")
-    pd.to_pickle(df, filepath)
+    write_state_file(df, filepath)
     return 'success'
 
 
+def download_pages(url_params, page_size=None):
+    """Download all pages of a query and return them as a single df.
+
+    Pages are requested concurrently, 'max_concurrent_requests' at a time,
+    until a page returns fewer records than the page size. If a page exceeds
+    the record limit of the service, the page size is halved and the query
+    restarted.
+    :param url_params: dictionary of query parameters, see generate_url
+    :param page_size: int, records per page, default 'page_size' in
+        config.yaml
+    """
+    page_size = page_size or _config['page_size']
+    workers = _config['max_concurrent_requests']
+    state = url_params.get('p_st')
+    log.info(f'record limit exceeded for {state}, requesting pages of '
+             f'{page_size} records')
+
+    def request_page(pageno):
+        return request_url(generate_url({**url_params,
+                                         'responseset': page_size,
+                                         'pageno': pageno}))
+
+    df_list = []
+    pageno = 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            responses = list(executor.map(request_page,
+                                          range(pageno, pageno + workers)))
+            if any(record_limit_exceeded(r) for r in responses):
+                if page_size < 2:
+                    raise ValueError(f'unable to page query for {state}')
+                return download_pages(url_params, page_size // 2)
+            for i, r in enumerate(responses):
+                df = read_response(r)
+                if len(df):
+                    df_list.append(df)
+                if len(df) < page_size:
+                    log.debug(f'{pageno + i} pages retrieved for {state}')
+                    return (pd.concat(df_list, ignore_index=True)
+                            if df_list else pd.DataFrame())
+            pageno += workers
+
+
+def state_file(year, state, nutrient=''):
+    """Return the path of a stored DMR query in the dataset partitioned by
+    year, nutrient ('none' for queries without nutrient aggregation) and
+    state."""
+    return (OUTPUT_PATH / f'year={year}' / f'nutrient={nutrient or "none"}'
+            / f'state={state}' / 'data.parquet')
+
+
+def write_state_file(df, filepath: Path):
+    """Write a DMR query result to parquet.
+
+    The file is written to a temporary file first so that an interrupted
+    query is not mistaken for a completed state.
+    """
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    temp = filepath.with_suffix('.tmp')
+    try:
+        df.to_parquet(temp, index=False)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        # object columns of mixed types, e.g. from combined permit type
+        # queries, are stored as strings
+        df = df.copy()
+        for col in df.select_dtypes('object').columns:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        df.to_parquet(temp, index=False)
+    os.replace(temp, filepath)
+
+
+def read_state_file(filepath: Path, columns=None):
+    """Read a stored DMR query, limited to columns present in the file."""
+    if columns is not None:
+        names = pq.read_schema(filepath).names
+        columns = [c for c in columns if c in names]
+    return pd.read_parquet(filepath, columns=columns)
+
+
+def migrate_pickles(year):
+    """Convert DMR queries stored as pickles by state, by earlier versions of
+    stewi, to the partitioned parquet dataset."""
+    path = OUTPUT_PATH.joinpath(str(year))
+    if not path.is_dir():
+        return
+    pickles = list(path.glob('*state_*.pickle'))
+    if pickles:
+        log.info(f'migrating {len(pickles)} stored DMR queries in {path} '
+                 'to parquet')
+    for filepath in pickles:
+        nutrient, _, state = filepath.stem.rpartition('state_')
+        target = state_file(year, state, nutrient.rstrip('_'))
+        if not target.is_file():
+            write_state_file(pd.read_pickle(filepath), target)
+        filepath.unlink()
+    if not any(path.iterdir()):
+        path.rmdir()
+
+
 def standardize_df(input_df):
     """Modify DMR data to meet StEWI specifications."""
-    dmr_required_fields = pd.read_csv(DMR_DATA_PATH / 'DMR_required_fields.txt',
-                                      header=None)[0]
-    output_df = input_df[dmr_required_fields].copy()
+    output_df = input_df[read_required_fields()].copy()
     dmr_reliability_table = (get_reliability_table_for_source('DMR')
                              .drop(columns=['Code']))
     output_df['DataReliability'] = dmr_reliability_table[
@@ -202,39 +357,202 @@ def standardize_df(input_df):
     return output_df
 
 
-def combine_DMR_inventory(year, nutrient=''):
-    """Loop through pickled data and combines into a dataframe."""
-    path = OUTPUT_PATH.joinpath(year)
-    if not path.is_dir():
+def combine_DMR_inventory(year, nutrient='', states=STATES):
+    """Read stored DMR queries by state and combine into a dataframe.
+
+    Only the fields in DMR_required_fields.txt are read. States are read in
+    parallel and combined once. States without a stored query are queried.
+    """
+    migrate_pickles(year)
+    if not OUTPUT_PATH.joinpath(f'year={year}').is_dir():
         raise stewi.exceptions.DataNotFoundError
-    output_df = pd.DataFrame()
-    filestub = ''
     if nutrient:
-        filestub = nutrient + '_'
         log.info(f'reading stored DMR queries by state for {nutrient}...')
     else:
         log.info('reading stored DMR queries by state...')
-    for state in STATES:
-        log.debug(f'accessing data for {state}')
-        filepath = path.joinpath(f'{filestub}state_{state}.pickle')
-        result = unpickle(filepath)
-        if result is None:
-            log.warning(f'No data found for {state}. Retrying query...')
-            if (query_dmr(year=year,
-                         state_list=[state],
-                         nutrient=nutrient).get(state) == 'success'):
-                result = unpickle(filepath)
-        if result is not None:
-            output_df = pd.concat([output_df, result], ignore_index=True)
-    return output_df
-
+    missing = [state for state in states
+               if not state_file(year, state, nutrient).is_file()]
+    if missing:
+        log.warning(f'No data found for {", ".join(missing)}. '
+                    'Retrying query...')
+        query_dmr(year=year, state_list=missing, nutrient=nutrient)
+    files = [state_file(year, state, nutrient) for state in states]
+    files = [f for f in files if f.is_file()]
+    columns = read_required_fields()
+    with ThreadPoolExecutor() as executor:
+        df_list = list(executor.map(lambda f: read_state_file(f, columns),
+                                    files))
+    if not df_list:
+        return pd.DataFrame()
+    return pd.concat(df_list, ignore_index=True)
+
+
+def read_required_fields():
+    """Return the list of DMR fields required to generate inventories."""
+    return list(pd.read_csv(DMR_DATA_PATH / 'DMR_required_fields.txt',
+                            header=None)[0])
+
+
+def compile_DMR_outputs(year, states=STATES):
+    """Generate DMR inventory outputs from stored queries for a set of states.
 
-def unpickle(filepath):
+    :param year: str, year of data
+    :param states: list of states to include
+    :return: dictionary of facility, flow and flowbyfacility dataframes, and
+        the standardized state query df used for validation by state
+    """
+    state_df = combine_DMR_inventory(year, states=states)
+    state_df = filter_states(standardize_df(state_df))
+
+    P_df = combine_DMR_inventory(year, nutrient='P', states=states)
+    N_df = combine_DMR_inventory(year, nutrient='N', states=states)
+
+    nut_drop_list = list(pollutant_list_flows()['nutrient'])
+
+    # Consolidate N and P based flows to reflect nutrient aggregation
+    P_df = consolidate_nutrients(P_df, nut_drop_list, 'P')
+    N_df = consolidate_nutrients(N_df, nut_drop_list, 'N')
+
+    nutrient_agg_df = pd.concat([P_df, N_df])
+    nutrient_agg_df = filter_states(standardize_df(nutrient_agg_df))
+
+    # Filter out nitrogen and phosphorus flows before combining
+    # with aggregated nutrients
+    dmr_nut_filtered = state_df[~state_df['FlowName'].isin(nut_drop_list)]
+    dmr_df = (pd.concat([dmr_nut_filtered, nutrient_agg_df])
+              .reset_index(drop=True))
+
+    # PermitTypeCode needed for state validation but not maintained
+    dmr_df = dmr_df.drop(columns=['Permit Type'])
+
+    # generate output for facility
+    facility_columns = ['FacilityID', 'FacilityName', 'City',
+                        'State', 'Zip', 'Latitude', 'Longitude',
+                        'County', 'NAICS', 'SIC'] # 'Address' not in DMR
+    dmr_facility = dmr_df[facility_columns].drop_duplicates()
+    dmr_facility['Zip'] = dmr_facility['Zip'].astype(str)
+
+    # generate output for flow
+    dmr_flow = (dmr_df.filter(['FlowID', 'FlowName'])
+                .drop_duplicates()
+                .sort_values(by=['FlowName'])
+                .assign(Compartment='water')
+                .assign(Unit='kg'))
+
+    # generate output for flowbyfacility
+    fbf_columns = ['FlowName', 'FlowAmount', 'FacilityID',
+                   'DataReliability']
+    dmr_fbf = dmr_df[fbf_columns].reset_index(drop=True)
+    dmr_fbf = aggregate(dmr_fbf, ['FacilityID', 'FlowName'])
+    dmr_fbf['Compartment'] = 'water'
+    dmr_fbf['Unit'] = 'kg'
+
+    outputs = {'facility': dmr_facility,
+               'flow': dmr_flow,
+               'flowbyfacility': dmr_fbf}
+    return outputs, state_df
+
+
+def refresh(year, states):
+    """Download DMR data again for a set of states and patch the stored
+    inventory outputs and state totals validation for those states.
+
+    Queries for other states are not repeated or reprocessed. Records of
+    facilities in the states are replaced in the stored facility and
+    flowbyfacility outputs, and flows are added to the stored flow output.
+    Stored queries for the states are restored if any query or the
+    compilation of outputs fails, and stored filtered inventories are
+    removed once outputs are patched.
+    :param year: str, year of data
+    :param states: list of two letter state abbreviations
+    """
+    year = str(year)
+    states = list(states)
+    stored = {}
+    for f in ['facility', 'flow', 'flowbyfacility']:
+        stored[f] = load_preprocessed_output(
+            set_stewi_meta(f'DMR_{year}', f), paths)
+        if stored[f] is None:
+            log.error(f'DMR_{year} {f} not found, generate the inventory '
+                      'with Option B before refreshing states')
+            return
+    log.info(f'refreshing DMR {year} for {", ".join(states)}')
+    migrate_pickles(year)
+    backups = set_aside_state_files(year, states)
     try:
-        return pd.read_pickle(filepath)
-    except FileNotFoundError:
-        log.exception(f'error reading {filepath}')
-        return None
+        results = query_dmr_batch(year, states, overwrite=True)
+        failed = [f'{state} {nutrient}'.strip()
+                  for nutrient, result_dict in results.items()
+                  for state, result in result_dict.items()
+                  if result != 'success']
+        if failed:
+            log.error(f'queries failed for {", ".join(failed)}, stored '
+                      'queries and outputs are not updated')
+            restore_state_files(backups)
+            return
+        outputs, state_df = compile_DMR_outputs(year, states)
+    except Exception:
+        restore_state_files(backups)
+        raise
+    for backup in backups.values():
+        if backup is not None:
+            backup.unlink(missing_ok=True)
+
+    facility = stored['facility']
+    replaced = pd.concat([facility.loc[facility['State'].isin(states),
+                                       'FacilityID'],
+                          outputs['facility']['FacilityID']])
+    for f in ['facility', 'flowbyfacility']:
+        df = stored[f]
+        df = pd.concat([df[~df['FacilityID'].isin(replaced)], outputs[f]],
+                       ignore_index=True)
+        store_inventory(df, f'DMR_{year}', f)
+    dmr_flow = (pd.concat([stored['flow'], outputs['flow']])
+                .drop_duplicates(subset=['FlowID', 'FlowName'])
+                .sort_values(by=['FlowName']))
+    store_inventory(dmr_flow, f'DMR_{year}', 'flow')
+    remove_filtered_inventories('DMR', year)
+
+    validation_file = paths.local_path / 'validation' / f'DMR_{year}.csv'
+    validation_df = validate_state_totals(state_df, year, write=False,
+                                          states=states)
+    if validation_file.is_file():
+        stored_validation = pd.read_csv(validation_file)
+        validation_df = (pd.concat([stored_validation[
+            ~stored_validation['State'].isin(states)], validation_df])
+            .sort_values(by='State', ignore_index=True))
+    write_validation_result('DMR', year, validation_df)
+
+    generate_metadata(year, datatype='inventory')
+
+
+def set_aside_state_files(year, states, nutrients=('', 'N', 'P')):
+    """Move stored DMR queries for a set of states to backup files so that
+    they can be restored if a refresh of those states fails.
+
+    :return: dictionary of backup paths by stored query path, None for
+        queries not previously stored
+    """
+    backups = {}
+    for nutrient in nutrients:
+        for state in states:
+            filepath = state_file(year, state, nutrient)
+            if filepath.is_file():
+                backups[filepath] = filepath.with_suffix('.bak')
+                os.replace(filepath, backups[filepath])
+            else:
+                backups[filepath] = None
+    return backups
+
+
+def restore_state_files(backups):
+    """Return stored DMR queries to the state saved by set_aside_state_files,
+    discarding queries written since."""
+    for filepath, backup in backups.items():
+        if backup is not None and backup.is_file():
+            os.replace(backup, filepath)
+        elif backup is None:
+            filepath.unlink(missing_ok=True)
 
 
 def download_state_totals_validation(year):
@@ -274,21 +592,36 @@ def download_state_totals_validation(year):
     update_validationsets_sources(validation_dict)
 
 
-def validate_state_totals(df, year):
-    """Generate validation by state, sums across species.
+def build_validation_totals(year):
+    """Download the state totals for validation if they are not stored.
 
-    Details on results by state can be found in the search results help website
-    https://echo.epa.gov/help/loading-tool/water-pollution-search/search-results-help-dmr
+    :return: path of the state totals file
     """
     filepath = DATA_PATH.joinpath(f"DMR_{year}_StateTotals.csv")
     if not filepath.is_file():
         download_state_totals_validation(year)
+    return filepath
+
+
+def validate_state_totals(df, year, write=True, states=None):
+    """Generate validation by state, sums across species.
+
+    Details on results by state can be found in the search results help website
+    https://echo.epa.gov/help/loading-tool/water-pollution-search/search-results-help-dmr
+
+    :param write: bool, True to write the validation result to local dir
+    :param states: optional list of states to which validation is limited
+    :return: df of validation result
+    """
+    filepath = build_validation_totals(year)
     log.info('validating against state totals')
     reference_df = pd.read_csv(filepath)
     reference_df['FlowAmount'] = 0.0
     reference_df = unit_convert(reference_df, 'FlowAmount',
                                 'Unit', 'lb', lb_kg, 'Amount')
     reference_df = reference_df[['FlowName', 'State', 'FlowAmount']]
+    if states is not None:
+        reference_df = reference_df[reference_df['State'].isin(states)]
 
     # to match the state totals, only compare NPD facilities, and remove some flows
     flow_exclude = pd.read_csv(DMR_DATA_PATH.joinpath('DMR_state_filter_list.csv'))
@@ -303,13 +636,26 @@ def validate_state_totals(df, year):
     dmr_by_state['FlowName'] = 'All'
     validation_df = validate_inventory(dmr_by_state, reference_df,
                                        group_by=["State"])
-    write_validation_result('DMR', year, validation_df)
+    if write:
+        write_validation_result('DMR', year, validation_df)
+    return validation_df
+
+
+def validate_stored_inventory(year):
+    """Validate the stored DMR queries by state against state totals.
+
+    Permit type is not retained in the flowbyfacility output so the
+    validation is generated from the stored state queries.
+    """
+    state_df = combine_DMR_inventory(str(year))
+    state_df = filter_states(standardize_df(state_df))
+    return validate_state_totals(state_df, str(year), write=False)
 
 
 def generate_metadata(year, datatype='inventory'):
     """Generate metadata and write to json for datatypes 'inventory' or 'source'."""
     if datatype == 'source':
-        source_path = str(OUTPUT_PATH.joinpath(year))
+        source_path = str(OUTPUT_PATH.joinpath(f'year={year}'))
         source_meta = compile_source_metadata(source_path, _config, year)
         source_meta['SourceType'] = 'Web Service'
         write_metadata(f"DMR_{year}", source_meta, category=EXT_DIR,
@@ -323,24 +669,109 @@ def generate_metadata(year, datatype='inventory'):
 
 def read_pollutant_parameter_list(parameter_grouping=PARAM_GROUP):
     """Read and parse the DMR pollutant parameter list."""
-    url = _config['pollutant_list_url']
-    flows = pd.read_csv(url, header=1, usecols=['POLLUTANT_CODE',
-                                                'POLLUTANT_DESC',
-                                                'PARAMETER_CODE',
-                                                'PARAMETER_DESC',
-                                                'SRS_ID', 'NITROGEN',
-                                                'PHOSPHORUS',
-                                                'ORGANIC_ENRICHMENT'],
-                        dtype=str)
+    flows = load_pollutant_parameter_list()
     if parameter_grouping:
-        flows.rename(columns={'POLLUTANT_DESC': 'FlowName',
-                              'POLLUTANT_CODE': 'FlowID'}, inplace=True)
+        flows = flows.rename(columns={'POLLUTANT_DESC': 'FlowName',
+                                      'POLLUTANT_CODE': 'FlowID'})
     else:
-        flows.rename(columns={'PARAMETER_DESC': 'FlowName',
-                              'PARAMETER_CODE': 'FlowID'}, inplace=True)
+        flows = flows.rename(columns={'PARAMETER_DESC': 'FlowName',
+                                      'PARAMETER_CODE': 'FlowID'})
     return flows
 
 
+def read_pollutant_list_metadata():
+    """Return metadata of the stored pollutant parameter list, or None."""
+    try:
+        with open(POLLUTANT_LIST_FILE.with_suffix('.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=1)
+def load_pollutant_parameter_list():
+    """Return the DMR pollutant parameter list with source column names.
+
+    The list is stored locally and downloaded again only once it is older
+    than 'pollutant_list_ttl' days or the url in config.yaml changes. The
+    returned dataframe is shared and must not be modified.
+    """
+    meta = read_pollutant_list_metadata()
+    if POLLUTANT_LIST_FILE.is_file() and meta is not None:
+        age = datetime.now() - datetime.fromisoformat(meta['retrieved'])
+        if (meta['url'] == _config['pollutant_list_url'] and
+                age < timedelta(days=_config['pollutant_list_ttl'])):
+            return pd.read_csv(POLLUTANT_LIST_FILE, dtype=str)
+    log.info('downloading DMR pollutant parameter list')
+    try:
+        flows = pd.read_csv(_config['pollutant_list_url'], header=1,
+                            usecols=['POLLUTANT_CODE', 'POLLUTANT_DESC',
+                                     'PARAMETER_CODE', 'PARAMETER_DESC',
+                                     'SRS_ID', 'NITROGEN', 'PHOSPHORUS',
+                                     'ORGANIC_ENRICHMENT'],
+                            dtype=str)
+    except OSError as err:
+        if not POLLUTANT_LIST_FILE.is_file():
+            raise
+        log.warning(f'unable to update DMR pollutant parameter list: {err}')
+        return pd.read_csv(POLLUTANT_LIST_FILE, dtype=str)
+    store_pollutant_parameter_list(flows)
+    return flows
+
+
+def store_pollutant_parameter_list(flows):
+    """Store the pollutant parameter list with metadata, including the flow
+    lists returned by pollutant_list_flows."""
+    meta = {'url': _config['pollutant_list_url'],
+            'retrieved': datetime.now().isoformat(timespec='seconds'),
+            'StEWI_Version': STEWI_VERSION,
+            'flows': {col: derive_flow_lists(flows, col)
+                      for col in ['POLLUTANT_DESC', 'PARAMETER_DESC']}}
+    POLLUTANT_LIST_FILE.parent.mkdir(parents=True, exist_ok=True)
+    meta_file = POLLUTANT_LIST_FILE.with_suffix('.json')
+    # metadata are written last so that they only describe a stored list
+    temp = POLLUTANT_LIST_FILE.with_suffix(f'.{os.getpid()}.tmp')
+    try:
+        flows.to_csv(temp, index=False)
+        os.replace(temp, POLLUTANT_LIST_FILE)
+        temp.write_text(json.dumps(meta, indent=2))
+        os.replace(temp, meta_file)
+    except OSError as err:
+        log.warning(f'unable to store DMR pollutant parameter list: {err}')
+        temp.unlink(missing_ok=True)
+
+
+def derive_flow_lists(flows, col):
+    """Return lists of flow names in column col of the pollutant parameter
+    list for nitrogen or phosphorus flows ('nutrient'), organic enrichment
+    flows ('organic_enrichment') and those including 'COD' and 'BOD'."""
+    nutrient = flows.loc[(flows['NITROGEN'] == 'Y') |
+                         (flows['PHOSPHORUS'] == 'Y'), col].dropna()
+    organic = (flows.loc[flows['ORGANIC_ENRICHMENT'] == 'Y', col]
+               .drop_duplicates().to_list())
+    return {'nutrient': sorted(set(nutrient)),
+            'organic_enrichment': organic,
+            'COD': [flow for flow in organic if 'COD' in flow],
+            'BOD': [flow for flow in organic if 'BOD' in flow]}
+
+
+@lru_cache(maxsize=None)
+def pollutant_list_flows(parameter_grouping=PARAM_GROUP):
+    """Return a dictionary of flow name tuples derived from the pollutant
+    parameter list, see derive_flow_lists.
+
+    The lists are read from the stored metadata when available, so that no
+    download is needed.
+    """
+    col = 'POLLUTANT_DESC' if parameter_grouping else 'PARAMETER_DESC'
+    meta = read_pollutant_list_metadata()
+    if meta is not None and col in meta.get('flows', {}):
+        lists = meta['flows'][col]
+    else:
+        lists = derive_flow_lists(load_pollutant_parameter_list(), col)
+    return {k: tuple(v) for k, v in lists.items()}
+
+
 def consolidate_nutrients(df, drop_list, nutrient):
     """Rename flows following nutrient aggregation to better handle flow overlaps."""
     if nutrient == 'P':
@@ -360,46 +791,60 @@ def remove_duplicate_organic_enrichment(df):
     which represent duplicate accounting of oxygen depletion. See Meyer et al.
     2020
     """
+    mask = organic_enrichment_mask(df)
+    if mask.all():
+        return df
+    return df[mask].reset_index(drop=True)
+
+
+def organic_enrichment_mask(df):
+    """Return a boolean Series of records to keep when removing duplicate
+    organic enrichment parameters, see remove_duplicate_organic_enrichment.
+    """
     flow_preference = filter_config[
         'remove_duplicate_organic_enrichment']['parameters']['flow_preference']
 
-    org_flow_list = read_pollutant_parameter_list()
-    org_flow_list = org_flow_list[org_flow_list['ORGANIC_ENRICHMENT'] == 'Y']
-    org_flow_list = org_flow_list[['FlowName']].drop_duplicates()
-    org_flow_list = org_flow_list['FlowName'].to_list()
-
-    cod_list = [flow for flow in org_flow_list if 'COD' in flow]
-    bod_list = [flow for flow in org_flow_list if 'BOD' in flow]
+    flow_lists = pollutant_list_flows()
+    org_flow_list = flow_lists['organic_enrichment']
     if flow_preference == 'COD':
-        keep_list = cod_list
+        keep_list = flow_lists['COD']
     else:
-        keep_list = bod_list
-
-    df_org = df.loc[df['FlowName'].isin(org_flow_list)]
-    df_duplicates = df_org[df_org.duplicated(subset='FacilityID', keep=False)]
-    if len(df_duplicates) == 0:
-        return df
-
-    df = df.loc[~df['FlowName'].isin(org_flow_list)]
-    df_org = df_org[~df_org.duplicated(subset='FacilityID', keep=False)]
-    to_be_concat = []
-    to_be_concat.append(df)
-    to_be_concat.append(df_org)
-
-    df_duplicates['PrefList'] = df_duplicates[
-        'FlowName'].apply(lambda x: x in keep_list)
-    df_duplicates['NonPrefList'] = df_duplicates[
-        'FlowName'].apply(lambda x: x not in keep_list)
-    grouped = df_duplicates.groupby(['FacilityID'])
-    for name, frame in grouped:
-        if not frame['NonPrefList'].all():
-            frame = frame[frame['PrefList']]
-        to_be_concat.append(frame)
-    df = (pd.concat(to_be_concat)
-          .sort_index()
-          .drop(columns=['PrefList', 'NonPrefList'])
-          .reset_index(drop=True))
-    return df
+        keep_list = flow_lists['BOD']
+
+    keep = preferred_flow_mask(df, df['FlowName'].isin(org_flow_list),
+                               'FacilityID', keep_list)
+    if keep is None:
+        keep = np.ones(len(df), dtype=bool)
+    return pd.Series(keep, index=df.index)
+
+
+def preferred_flow_mask(df, candidates, key, keep_list):
+    """Return a boolean array of records to keep where a facility has
+    multiple candidate records.
+
+    Of the candidate records of each facility (identified by key), those with
+    a FlowName in keep_list are kept if there are any, otherwise all are
+    kept. Multiple candidate records without a key are not kept.
+    :param df: dataframe with FlowName and key columns
+    :param candidates: boolean Series or array of candidate records
+    :param key: str, column identifying facilities
+    :param keep_list: list of preferred flow names
+    :return: boolean array, or None if no facility has multiple candidates
+    """
+    candidates = np.asarray(candidates, dtype=bool)
+    df_candidates = df.loc[candidates, [key, 'FlowName']]
+    duplicates = (df_candidates.duplicated(subset=key, keep=False)
+                  .to_numpy())
+    if not duplicates.any():
+        return None
+    df_duplicates = df_candidates[duplicates]
+    preferred = df_duplicates['FlowName'].isin(keep_list)
+    any_preferred = preferred.groupby(df_duplicates[key],
+                                      dropna=False).transform('any')
+    keep = np.ones(len(df), dtype=bool)
+    keep[np.flatnonzero(candidates)[duplicates]] = (
+        (preferred | ~any_preferred) & df_duplicates[key].notna())
+    return keep
 
 
 def remove_nutrient_overlap_TRI(df, preference):
@@ -421,33 +866,13 @@ def remove_nutrient_overlap_TRI(df, preference):
     else:
         keep_list = tri_list
 
-    df_nutrients = df.loc[((df['FlowName'].isin(combined_list)) &
-                           (df['Compartment'] == 'water'))]
-    df_duplicates = df_nutrients[df_nutrients.duplicated(subset='FRS_ID',
-                                                         keep=False)]
-    if len(df_duplicates) == 0:
+    keep = preferred_flow_mask(df, df['FlowName'].isin(combined_list) &
+                               (df['Compartment'] == 'water'),
+                               'FRS_ID', keep_list)
+    if keep is None:
         return df
-
-    df = df.loc[~((df['FlowName'].isin(combined_list)) &
-                  (df['Compartment'] == 'water'))]
-    df_nutrients = df_nutrients[~df_nutrients.duplicated(subset='FRS_ID',
-                                                         keep=False)]
-    to_be_concat = []
-    to_be_concat.append(df)
-    to_be_concat.append(df_nutrients)
-
-    df_duplicates['PrefList'] = df_duplicates[
-        'FlowName'].apply(lambda x: x in keep_list)
-    df_duplicates['NonPrefList'] = df_duplicates[
-        'FlowName'].apply(lambda x: x not in keep_list)
-    grouped = df_duplicates.groupby(['FRS_ID'])
-    for name, frame in grouped:
-        if not frame['NonPrefList'].all():
-            frame = frame[frame['PrefList']]
-        to_be_concat.append(frame)
-    df = (pd.concat(to_be_concat)
+    df = (df[keep]
           .sort_index()
-          .drop(columns=['PrefList', 'NonPrefList'])
           .reset_index(drop=True))
 
     return df
@@ -461,13 +886,19 @@ def main(**kwargs):
                         [A] Download DMR files from web\
                         [B] Generate StEWI inventory outputs and\
                             validate to state totals\
-                        [C] Download state totals',
+                        [C] Download state totals\
+                        [D] Refresh downloaded data and StEWI inventory\
+                            outputs for states',
                         type = str)
 
     parser.add_argument('-Y', '--Year', nargs = '+',
                         help = 'What DMR year(s) you want to retrieve',
                         type = str)
 
+    parser.add_argument('-S', '--States', nargs = '+',
+                        help = 'Two letter state abbreviations for Option D',
+                        type = str)
+
     if len(kwargs) == 0:
         kwargs = vars(parser.parse_args())
 
@@ -475,88 +906,29 @@ def main(**kwargs):
         year = str(year)
         if kwargs['Option'] == 'A':
             log.info(f"Querying for {year}")
-            # Query by state
-            result_dict = query_dmr(year=year)
-            log.debug('possible errors: ' + ', '.join(
-                [s for s in result_dict.keys()
-                 if result_dict[s] != 'success']))
-            state_no_data_list = [s for s in result_dict.keys()
-                                  if result_dict[s] == 'no_data']
-            if (len(state_no_data_list) == 0):
-                log.info('all states succesfully downloaded')
-
-            log.info(f"Querying nutrients for {year}")
-            # Query aggregated nutrients data
-            for nutrient in ['N', 'P']:
-                result_dict = query_dmr(year=year, nutrient=nutrient)
+            # Query by state and aggregated nutrients data
+            results = query_dmr_batch(year=year)
+            for nutrient, result_dict in results.items():
                 log.debug('possible errors: ' + ', '.join(
                     [s for s in result_dict.keys()
                      if result_dict[s] != 'success']))
-                state_no_data_list = [s for s in result_dict.keys()
-                                      if result_dict[s] == 'no_data']
-                if (len(state_no_data_list) == 0):
-                    log.info(f'all states succesfully downloaded for {nutrient}')
+                if all(r == 'success' for r in result_dict.values()):
+                    log.info('all states succesfully downloaded'
+                             + (f' for {nutrient}' if nutrient else ''))
 
             # write metadata
             generate_metadata(year, datatype='source')
 
         if kwargs['Option'] == 'B':
             log.info(f'generating inventories for DMR {year}')
-            state_df = combine_DMR_inventory(year)
-            state_df = filter_states(standardize_df(state_df))
+            outputs, state_df = compile_DMR_outputs(year)
 
             # Validation against state totals is done prior to combining
             # with aggregated nutrients
             validate_state_totals(state_df, year)
 
-            P_df = combine_DMR_inventory(year, nutrient='P')
-            N_df = combine_DMR_inventory(year, nutrient='N')
-
-            nut_drop_list = read_pollutant_parameter_list()
-            nut_drop_list = nut_drop_list[(nut_drop_list['NITROGEN'] == 'Y') |
-                                          (nut_drop_list['PHOSPHORUS'] == 'Y')]
-            nut_drop_list = list(set(nut_drop_list['FlowName']))
-
-            # Consolidate N and P based flows to reflect nutrient aggregation
-            P_df = consolidate_nutrients(P_df, nut_drop_list, 'P')
-            N_df = consolidate_nutrients(N_df, nut_drop_list, 'N')
-
-            nutrient_agg_df = pd.concat([P_df, N_df])
-            nutrient_agg_df = filter_states(standardize_df(nutrient_agg_df))
-
-            # Filter out nitrogen and phosphorus flows before combining
-            # with aggregated nutrients
-            dmr_nut_filtered = state_df[~state_df['FlowName'].isin(nut_drop_list)]
-            dmr_df = (pd.concat([dmr_nut_filtered, nutrient_agg_df])
-                      .reset_index(drop=True))
-
-            # PermitTypeCode needed for state validation but not maintained
-            dmr_df = dmr_df.drop(columns=['Permit Type'])
-
-            # generate output for facility
-            facility_columns = ['FacilityID', 'FacilityName', 'City',
-                                'State', 'Zip', 'Latitude', 'Longitude',
-                                'County', 'NAICS', 'SIC'] # 'Address' not in DMR
-            dmr_facility = dmr_df[facility_columns].drop_duplicates()
-            dmr_facility['Zip'] = dmr_facility['Zip'].astype(str)
-            store_inventory(dmr_facility, f'DMR_{year}', 'facility')
-
-            # generate output for flow
-            dmr_flow = (dmr_df.filter(['FlowID', 'FlowName'])
-                        .drop_duplicates()
-                        .sort_values(by=['FlowName'])
-                        .assign(Compartment='water')
-                        .assign(Unit='kg'))
-            store_inventory(dmr_flow, f'DMR_{year}', 'flow')
-
-            # generate output for flowbyfacility
-            fbf_columns = ['FlowName', 'FlowAmount', 'FacilityID',
-                           'DataReliability']
-            dmr_fbf = dmr_df[fbf_columns].reset_index(drop=True)
-            dmr_fbf = aggregate(dmr_fbf, ['FacilityID', 'FlowName'])
-            dmr_fbf['Compartment'] = 'water'
-            dmr_fbf['Unit'] = 'kg'
-            store_inventory(dmr_fbf, f'DMR_{year}', 'flowbyfacility')
+            for f, df in outputs.items():
+                store_inventory(df, f'DMR_{year}', f)
 
             # write metadata
             generate_metadata(year, datatype='inventory')
@@ -564,6 +936,9 @@ def main(**kwargs):
         if kwargs['Option'] == 'C':
             download_state_totals_validation(year)
 
+        if kwargs['Option'] == 'D':
+            refresh(year, kwargs['States'])
+
 
 if __name__ == '__main__':
     main(Option='B', Year = [2020])
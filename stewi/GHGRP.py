@@ -28,13 +28,17 @@ Envirofacts web services documentation can be found at:
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import time
 import argparse
+import os
+import shutil
+import threading
 import warnings
 import zipfile
 import io
-import urllib
-import urllib3
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from requests.exceptions import HTTPError
 from xml.dom import minidom
@@ -44,7 +48,7 @@ from esupy.processed_data_mgmt import read_source_metadata
 from esupy.remote import make_url_request
 from stewi.globals import write_metadata, compile_source_metadata, aggregate, \
     DATA_PATH, get_reliability_table_for_source, set_stewi_meta, config,\
-    store_inventory, paths, log
+    store_inventory, paths, log, retry_with_backoff, read_excel_cached
 from stewi.validate import update_validationsets_sources, validate_inventory,\
     write_validation_result
 from stewi.formats import StewiFormat
@@ -80,6 +84,10 @@ base_cols = list(ghgrp_cols[ghgrp_cols['base_columns'] == 1]['column_name'])
 info_cols = name_cols + quantity_cols + method_cols
 group_cols = co2_cols + ch4_cols + n2o_cols
 ghg_cols = base_cols + info_cols + group_cols
+# fields of envirofacts tables parsed as numbers, all others are read as
+# strings so that pages and saved tables are parsed consistently
+numeric_cols = set(base_cols + quantity_cols + group_cols + subpart_c_cols +
+                   co2e_cols + ['YEAR', 'GHG_QUANTITY', 'CO2E_EMISSION'])
 
 # define filepaths for downloaded data
 data_summaries_path = OUTPUT_PATH.joinpath(
@@ -89,6 +97,21 @@ esbb_subparts_path = OUTPUT_PATH.joinpath(_config['esbb_subparts_url']
 lo_subparts_path = OUTPUT_PATH.joinpath(_config['lo_subparts_url']
                                         .rsplit('/', 1)[-1])
 
+# fields and types of the processed GHGRP data saved in Option A
+PROCESSED_SCHEMA = pa.schema([('FacilityID', pa.int64()),
+                              ('REPORTING_YEAR', pa.int64()),
+                              ('SUBPART_NAME', pa.string()),
+                              ('METHOD', pa.string()),
+                              ('FlowName', pa.string()),
+                              ('FlowCode', pa.string()),
+                              ('FlowAmount', pa.float64()),
+                              ('AmountCO2e', pa.float64())])
+# processed fields used to generate and validate the inventory in Option B
+INVENTORY_FIELDS = ['FacilityID', 'SUBPART_NAME', 'METHOD', 'FlowName',
+                    'FlowCode', 'FlowAmount', 'AmountCO2e']
+
+_request_slots = threading.BoundedSemaphore(_config['max_concurrent_requests'])
+
 
 class MetaGHGRP:
     def __init__(self):
@@ -123,7 +146,7 @@ def get_row_count(table, report_year):
         count_url += f'/REPORTING_YEAR/=/{report_year}'
     count_url += '/COUNT'
     try:
-        count_request = make_url_request(count_url)
+        count_request = request_url(count_url)
         count_xml = minidom.parseString(count_request.text)
         table_count = count_xml.getElementsByTagName('REQUESTRECORDCOUNT')
         table_count = int(table_count[0].firstChild.nodeValue)
@@ -134,31 +157,94 @@ def get_row_count(table, report_year):
     return table_count
 
 
-def download_chunks(table, table_count, m, row_start=0, report_year='',
-                    filepath=''):
-    """Download data from envirofacts in chunks."""
-    # Generate URL for each 5,000 row grouping and add to DataFrame
-    output_table = pd.DataFrame()
-    output_list = []
-    while row_start <= table_count:
-        row_end = row_start + 4999
-        table_url = generate_url(table=table, report_year=report_year,
-                                 row_start=row_start, row_end=row_end,
-                                 output_ext='csv')
-        log.debug(f'url: {table_url}')
-        table_temp, temp_time = import_table(table_url, get_time=True)
-        output_list.append(table_temp)
-        row_start += 5000
+def request_url(url):
+    """Request url, retrying with backoff as set in config.yaml. At most
+    'max_concurrent_requests' requests are made at a time across threads."""
+    return retry_with_backoff(make_url_request, url,
+                              attempts=_config['retry_attempts'],
+                              backoff=_config['retry_backoff'],
+                              slots=_request_slots)
+
+
+def download_chunks(table, table_count, filepath, report_year=''):
+    """Download data from envirofacts in pages of 'page_size' rows and save
+    the table to filepath.
+
+    Pages are requested concurrently, at most 'max_concurrent_requests' at a
+    time across all tables. Each page is stored as it arrives in a directory
+    next to filepath, so that an interrupted download resumes with the pages
+    still missing. The directory is removed once the table is saved.
+    """
+    page_size = _config['page_size']
+    page_dir = filepath.with_name(f'{filepath.stem}_pages')
+    page_dir.mkdir(exist_ok=True)
+
+    def download_page(row_start):
+        row_end = row_start + page_size - 1
+        page_file = page_dir.joinpath(f'{row_start}-{row_end}.csv')
+        if not page_file.is_file():
+            table_url = generate_url(table=table, report_year=report_year,
+                                     row_start=row_start, row_end=row_end,
+                                     output_ext='csv')
+            log.debug(f'url: {table_url}')
+            r = request_url(table_url)
+            temp_file = page_file.with_suffix('.tmp')
+            temp_file.write_bytes(r.content)
+            os.replace(temp_file, page_file)
+        return read_page(page_file)
+
+    with ThreadPoolExecutor(
+            max_workers=_config['max_concurrent_requests']) as executor:
+        output_list = list(executor.map(
+            download_page, range(0, table_count + 1, page_size)))
     output_table = pd.concat(output_list)
-    output_table.columns=output_table.columns.str.upper()
-    m.add(time=temp_time, url=generate_url(table, report_year=report_year,
-                                           row_start='', output_ext='csv'),
-          filetype='Database', filename=filepath)
-    if filepath:
-        output_table.to_csv(filepath, index=False)
+    output_table.columns = output_table.columns.str.upper()
+    temp_file = filepath.with_suffix('.tmp')
+    output_table.to_csv(temp_file, index=False)
+    os.replace(temp_file, filepath)
+    shutil.rmtree(page_dir)
     return output_table
 
 
+def read_page(filepath):
+    """Return a page of an envirofacts table with all fields as strings."""
+    try:
+        return pd.read_csv(filepath, dtype=str)
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+
+
+def download_table_file(table, report_year, filepath):
+    """Download an envirofacts table to filepath if it is not yet saved."""
+    if filepath.is_file():
+        return
+    # determine number of rows in table
+    row_count = get_row_count(table, report_year=report_year)
+    log.info('Downloading %s (rows: %i)', table, row_count)
+    download_chunks(table=table, table_count=row_count, filepath=filepath,
+                    report_year=report_year)
+
+
+def download_table_files(tables, report_year, tables_dir):
+    """Download envirofacts tables concurrently, at most
+    'max_concurrent_tables' at a time, skipping those already saved.
+
+    :param tables: list of table names
+    :param report_year: str
+    :param tables_dir: Path of directory where tables are saved as csv
+    """
+    with ThreadPoolExecutor(
+            max_workers=_config['max_concurrent_tables']) as executor:
+        list(executor.map(lambda table: download_table_file(
+            table, report_year, tables_dir.joinpath(f'{table}.csv')), tables))
+
+
+def parse_numeric_columns(df):
+    """Convert the fields of df in numeric_cols to numbers."""
+    return df.assign(**{c: pd.to_numeric(df[c], errors='coerce')
+                        for c in df if c in numeric_cols})
+
+
 def get_facilities(year):
     """Load and parse GHGRP data by facility from the API.
 
@@ -171,8 +257,8 @@ def get_facilities(year):
         facilities_file = (data_summaries_path / data_summaries_path.name /
                            f'ghgp_data_{year}.xlsx')
     # load .xlsx file from filepath
-    facilities_dict = pd.read_excel(facilities_file, sheet_name=None,
-                                    skiprows=3)
+    facilities_dict = read_excel_cached(facilities_file, sheet_name=None,
+                                        skiprows=3)
     # drop excel worksheets that we do not need
     for s in ['Industry Type', 'FAQs about this Data']:
         facilities_dict.pop(s, None)
@@ -234,25 +320,13 @@ def download_excel_tables(m):
 
 
 def import_or_download_table(filepath, table, year, m):
-    # if data already exists on local network, import the data
-    if filepath.is_file():
-        log.info(f'Importing data from {table}')
-        table_df, creation_time = import_table(filepath, get_time=True)
-        m.add(time=creation_time, filename=filepath, filetype='Database',
-              url=generate_url(table, report_year=year, row_start='',
-                               output_ext='CSV'))
-
-    # otherwise, download the data and save to the network
-    else:
-        # determine number of rows in subpart emissions table
-        row_count = get_row_count(table, report_year=year)
-        log.info('Downloading %s (rows: %i)', table, row_count)
-        # download data in chunks
-        table_df = download_chunks(table=table, table_count=row_count, m=m,
-                                   report_year=year, filepath=filepath)
-
-    if table_df is None:
-        return None
+    # if data does not exist on local network, download and save the data
+    download_table_file(table, year, filepath)
+    log.info(f'Importing data from {table}')
+    table_df, creation_time = import_table(filepath, get_time=True)
+    m.add(time=creation_time, filename=filepath, filetype='Database',
+          url=generate_url(table, report_year=year, row_start='',
+                           output_ext='CSV'))
 
     # drop any unnamed columns
     table_df = table_df.drop(columns=table_df.columns[
@@ -264,7 +338,7 @@ def import_or_download_table(filepath, table, year, m):
                                 table_df.columns,
                                 cols)
 
-    return table_df
+    return parse_numeric_columns(table_df)
 
 
 def download_table(filepath: Path, url: str, get_time=False):
@@ -290,21 +364,12 @@ def download_table(filepath: Path, url: str, get_time=False):
         return time.ctime(filepath.stat().st_ctime)
 
 
-def import_table(path_or_reference, get_time=False):
-    """Read and return time of csv from url or Path."""
-    try:
-        df = pd.read_csv(path_or_reference, low_memory=False)
-    except (urllib.error.URLError, urllib3.exceptions.HTTPError) as exception:
-        log.warning(exception.reason)
-        log.info('retrying url...')
-        time.sleep(3) # at times increasing this for large tables can be useful
-        df = pd.read_csv(path_or_reference, low_memory=False)
-    if get_time and isinstance(path_or_reference, Path):
-        retrieval_time = path_or_reference.stat().st_ctime
-        return df, time.ctime(retrieval_time)
-    elif get_time:
-        retrieval_time = time.time()
-        return df, time.ctime(retrieval_time)
+def import_table(filepath: Path, get_time=False):
+    """Read csv of a saved table with all fields as strings, and return the
+    time it was saved if get_time."""
+    df = pd.read_csv(filepath, dtype=str)
+    if get_time:
+        return df, time.ctime(filepath.stat().st_ctime)
     return df
 
 
@@ -333,10 +398,12 @@ def download_and_parse_subpart_tables(year, m):
     tables_dir = OUTPUT_PATH.joinpath('tables', year)
     log.info(f'downloading and processing GHGRP data to {tables_dir}')
     tables_dir.mkdir(parents=True, exist_ok=True)
-    ghgrp1 = pd.DataFrame(columns=ghg_cols)
+    download_table_files(year_tables['TABLE'], year, tables_dir)
 
-    # for all subpart emissions tables listed...
-    table_list = []
+    # for all subpart emissions tables listed, reshape each table to long
+    # format as it is imported so that only the narrow results are retained
+    described = []
+    by_group = []
     for subpart_emissions_table in year_tables['TABLE']:
         # define filepath where subpart emissions table will be stored
         filepath = tables_dir.joinpath(f"{subpart_emissions_table}.csv")
@@ -350,57 +417,75 @@ def download_and_parse_subpart_tables(year, m):
         table_df = table_df.assign(SUBPART_NAME = abbv)
         # drop empty columns
         table_df = table_df.dropna(axis=1, how='all')
-        # concatenate temporary dataframe to master ghgrp1 dataframe
-        table_list.append(table_df)
-    ghgrp1 = pd.concat(table_list, ignore_index=True)
+        table_a, table_b = reshape_subpart_table(table_df)
+        described.append(table_a)
+        by_group.append(table_b)
 
-    ghgrp1 = ghgrp1.reset_index(drop=True)
     log.info('Parsing table data...')
-    if 'C' in ghgrp1.SUBPART_NAME.unique():
-        ghgrp1 = calculate_combustion_emissions(ghgrp1)
+    return combine_subpart_tables(described, by_group)
+
+
+def reshape_subpart_table(table_df):
+    """Reshape a single subpart emissions table to long format.
+
+    :param table_df: df of a subpart table, with SUBPART_NAME assigned
+    :return: tuple of dfs, the records with a flow description and the
+        records without one, unpivoted to one row per GHG group column
+    """
+    if (table_df['SUBPART_NAME'] == 'C').any():
+        table_df = calculate_combustion_emissions(table_df)
         # add these new columns to the list of 'group' columns
         expanded_group_cols = group_cols + ['c_co2', 'c_co2_b', 'c_ch4', 'c_n2o']
     else:
         expanded_group_cols = group_cols
 
-    # combine all GHG name columns from different tables into one
-    ghgrp1['Flow Description'] = ghgrp1[name_cols].fillna('').sum(axis=1)
+    def combine_columns(cols, empty):
+        # combine the columns of this table from a list into one
+        cols = [c for c in cols if c in table_df]
+        if not cols:
+            return pd.Series(empty, index=table_df.index)
+        return table_df[cols].fillna(empty).sum(axis=1)
 
+    # combine all GHG name columns into one
+    table_df = table_df.assign(**{'Flow Description':
+                                  combine_columns(name_cols, '')})
     # use alias if it exists and flow is Other
-    alias = [c for c in ghgrp1.columns if c in alias_cols]
+    alias = [c for c in table_df.columns if c in alias_cols]
     for col in alias:
-        mask = ((ghgrp1['Flow Description'] == 'Other') & ~(ghgrp1[col].isna()))
-        ghgrp1.loc[mask, 'Flow Description'] = ghgrp1[col]
-
-    # combine all GHG quantity columns from different tables into one
-    ghgrp1['FlowAmount'] = ghgrp1[quantity_cols].astype('float').fillna(0).sum(axis=1)
-    # combine all method equation columns from different tables into one
-    ghgrp1['METHOD'] = ghgrp1[method_cols].fillna('').sum(axis=1)
+        mask = ((table_df['Flow Description'] == 'Other') & ~(table_df[col].isna()))
+        table_df.loc[mask, 'Flow Description'] = table_df[col]
+    # combine all GHG quantity and method equation columns into one
+    table_df = table_df.assign(
+        FlowAmount=combine_columns(quantity_cols, 0.0).astype('float'),
+        METHOD=combine_columns(method_cols, ''))
 
     # split dataframe into two separate dataframes based on flow description
-    # if flow description has been populated:
-    ghgrp1a = ghgrp1.loc[ghgrp1['Flow Description'] != ''].reset_index(drop=True)
-    # if flow description is blank:
-    ghgrp1b = ghgrp1.loc[ghgrp1['Flow Description'] == ''].reset_index(drop=True)
-
-    # parse data where flow description has been populated (ghgrp1a)
-    # keep only the necessary columns; drop all others
-    ghgrp1a = ghgrp1a.drop(columns=ghgrp1a.columns.difference(
-        base_cols + ['Flow Description',
-                     'FlowAmount',
-                     'METHOD',
-                     'SUBPART_NAME']))
-
-    # parse data where flow description is blank (ghgrp1b)
-    # keep only the necessary columns; drop all others
-    ghgrp1b = ghgrp1b.drop(columns=ghgrp1b.columns.difference(
-        base_cols + expanded_group_cols +
-        ['METHOD', 'SUBPART_NAME', 'UNIT_NAME', 'FUEL_TYPE']))
-    # 'unpivot' data to create separate line items for each group column
-    ghgrp1b = ghgrp1b.melt(id_vars=base_cols + ['METHOD', 'SUBPART_NAME',
-                                                'UNIT_NAME', 'FUEL_TYPE'],
-                           var_name='Flow Description',
-                           value_name='FlowAmount')
+    blank = table_df['Flow Description'] == ''
+    # if flow description has been populated, keep only the necessary columns
+    table_a = table_df.loc[~blank, [
+        c for c in table_df if c in base_cols + ['SUBPART_NAME']] +
+        ['Flow Description', 'FlowAmount', 'METHOD']]
+    # if flow description is blank, 'unpivot' data to create separate
+    # line items for each group column
+    id_cols = base_cols + ['METHOD', 'SUBPART_NAME', 'UNIT_NAME', 'FUEL_TYPE']
+    table_b = (table_df.loc[blank]
+               .reindex(columns=id_cols + [c for c in table_df
+                                           if c in expanded_group_cols])
+               .melt(id_vars=id_cols,
+                     var_name='Flow Description',
+                     value_name='FlowAmount'))
+    return table_a, table_b
+
+
+def combine_subpart_tables(described, by_group):
+    """Concatenate the reshaped subpart tables and combine the unpivoted
+    data for the same generating unit and fuel type.
+
+    :param described: list of dfs with a flow description
+    :param by_group: list of unpivoted dfs
+    """
+    ghgrp1a = pd.concat(described, ignore_index=True)
+    ghgrp1b = pd.concat(by_group, ignore_index=True)
 
     # combine data for same generating unit and fuel type
     ghgrp1b['UNIT_NAME'] = ghgrp1b['UNIT_NAME'].fillna('tmp')
@@ -418,9 +503,6 @@ def download_and_parse_subpart_tables(year, m):
     # re-join split dataframes
     ghgrp1 = pd.concat([ghgrp1a, ghgrp1b]).reset_index(drop=True)
 
-    # drop those rows where flow amount is confidential
-    ghgrp1 = ghgrp1[ghgrp1['FlowAmount'] != 'confidential']
-
     return ghgrp1
 
 
@@ -430,6 +512,9 @@ def calculate_combustion_emissions(df):
     calculating emissions from combustion (Tier 1-4), plus an alternative to any
     of the four tiers for units that report year-round heat input data to EPA (Part 75)
     """
+    # each subpart C table reports only some of the methodological alternatives
+    df = df.reindex(columns=list(df.columns) +
+                    [c for c in subpart_c_cols if c not in df])
     df[subpart_c_cols] = df[subpart_c_cols].replace(np.nan, 0.0)
     # nonbiogenic carbon:
     # NOTE: 'PART_75_CO2_EMISSIONS_METHOD' includes biogenic carbon emissions,
@@ -469,14 +554,21 @@ def calculate_combustion_emissions(df):
 
 
 def parse_additional_suparts_data(addtnl_subparts_path, subpart_cols_file, year):
+    """Parse emissions data of the subparts listed in subpart_cols_file from
+    a workbook covering all reporting years.
+
+    :param year: str year, or list of years to parse in a single pass
+    :return: df of emissions for the years, see split_by_year
+    """
     log.info(f'loading additional subpart data from {addtnl_subparts_path}')
+    years = [int(y) for y in (year if isinstance(year, list) else [year])]
 
     with warnings.catch_warnings():
         # Avoid the UserWarning for openpyxl "Unknown extension is not supported"
         warnings.filterwarnings("ignore", category=UserWarning)
         # load .xslx data for additional subparts from filepath
-        addtnl_subparts_dict = pd.read_excel(addtnl_subparts_path,
-                                             sheet_name=None)
+        addtnl_subparts_dict = read_excel_cached(addtnl_subparts_path,
+                                                 sheet_name=None)
     # import column headers data for additional subparts
     subpart_cols = pd.read_csv(GHGRP_DATA_PATH.joinpath(subpart_cols_file))
     # get list of tabs to process
@@ -505,8 +597,8 @@ def parse_additional_suparts_data(addtnl_subparts_path, subpart_cols_file, year)
         # create temporary dataframe from worksheet, using just the desired columns
         subpart_df = addtnl_subparts_dict[tab][
             addtnl_base_cols + list(set().union(*col_dict.values()))]
-        # keep only those data for the specified report year
-        subpart_df = subpart_df[subpart_df['Year'] == int(year)]
+        # keep only those data for the specified report years
+        subpart_df = subpart_df[subpart_df['Year'].isin(years)]
 
         if 'method' in col_dict.keys():
             # combine all method equation columns into one, drop old method columns
@@ -534,6 +626,8 @@ def parse_additional_suparts_data(addtnl_subparts_path, subpart_cols_file, year)
 
         # drop those rows where flow amount is confidential
         temp_df = temp_df[temp_df['FlowAmount'] != 'confidential']
+        temp_df = temp_df.assign(
+            FlowAmount=pd.to_numeric(temp_df['FlowAmount']))
 
         # add 1-2 letter subpart abbreviation
         temp_df['SUBPART_NAME'] = cols['subpart_abbr'][0]
@@ -561,8 +655,20 @@ def parse_additional_suparts_data(addtnl_subparts_path, subpart_cols_file, year)
     return ghgrp
 
 
+def split_by_year(df, years):
+    """Return a dictionary of the records of df for each year.
+
+    :param df: df with 'REPORTING_YEAR'
+    :param years: list of years, keys of the dictionary as str
+    """
+    # years are matched as int, REPORTING_YEAR may be read as float
+    groups = {int(y): group.reset_index(drop=True)
+              for y, group in df.groupby('REPORTING_YEAR')}
+    return {str(y): groups.get(int(y), df.iloc[:0]) for y in years}
+
+
 def parse_subpart_O(year):
-    """Parse emissions data for subpart O."""
+    """Parse emissions data for subpart O, for a year or list of years."""
     df = parse_additional_suparts_data(lo_subparts_path,
                                        'o_subparts_columns.csv', year)
     # convert subpart O data from CO2e to mass of HFC23 emitted,
@@ -576,7 +682,7 @@ def parse_subpart_O(year):
 
 
 def parse_subpart_L(year):
-    """Parse emissions data for subpart L."""
+    """Parse emissions data for subpart L, for a year or list of years."""
     df = parse_additional_suparts_data(lo_subparts_path,
                                        'l_subparts_columns.csv', year)
     subpart_L_GWPs = load_subpart_l_gwp()
@@ -656,7 +762,105 @@ def generate_national_totals_validation(
     update_validationsets_sources(validation_dict, date_acquired=True)
 
 
-def validate_national_totals_by_subpart(tab_df, year):
+def processed_file(year):
+    """Return the path of the processed GHGRP data for a year."""
+    return OUTPUT_PATH.joinpath(f'GHGRP_{year}.parquet')
+
+
+def store_processed_ghgrp(ghgrp, year):
+    """Save processed GHGRP data with the fields of PROCESSED_SCHEMA."""
+    filepath = processed_file(year)
+    log.info(f'saving processed GHGRP data to {filepath}')
+    ghgrp = ghgrp.reindex(columns=PROCESSED_SCHEMA.names)
+    # ids may be stored as object, e.g. in pickles of earlier versions
+    for field in PROCESSED_SCHEMA:
+        col = ghgrp[field.name]
+        if field.type == pa.int64():
+            ghgrp[field.name] = pd.to_numeric(col).astype('int64')
+        elif field.type == pa.float64():
+            ghgrp[field.name] = pd.to_numeric(col)
+        else:
+            ghgrp[field.name] = col.where(col.isna(), col.astype(str))
+    table = pa.Table.from_pandas(ghgrp, schema=PROCESSED_SCHEMA,
+                                 preserve_index=False)
+    temp_file = filepath.with_suffix('.tmp')
+    pq.write_table(table, temp_file, compression='zstd')
+    os.replace(temp_file, filepath)
+
+
+def migrate_pickle(year):
+    """Convert processed GHGRP data saved as a pickle by earlier versions of
+    stewi to parquet."""
+    pickle_file = OUTPUT_PATH.joinpath(f'GHGRP_{year}.pk')
+    filepath = processed_file(year)
+    if pickle_file.is_file() and not filepath.is_file():
+        log.info(f'migrating {pickle_file} to parquet')
+        ghgrp = pd.read_pickle(pickle_file)
+        store_processed_ghgrp(ghgrp, year)
+        # the pickle is removed only once the parquet reads back in full
+        if len(pd.read_parquet(filepath)) == len(ghgrp):
+            pickle_file.unlink()
+        else:
+            log.warning(f'{filepath} does not match {pickle_file}, the '
+                        'pickle is retained')
+
+
+def load_processed_ghgrp(year, columns=INVENTORY_FIELDS):
+    """Return the processed GHGRP data saved in Option A with reliability
+    scores assigned, amounts in kg, and columns renamed for StEWI.
+
+    :param year: str
+    :param columns: list of processed fields to read, see PROCESSED_SCHEMA
+    """
+    migrate_pickle(year)
+    filepath = processed_file(year)
+    log.info(f'extracting data from {filepath}')
+    ghgrp = pd.read_parquet(filepath, columns=columns)
+
+    # import data reliability scores
+    ghgrp_reliability_table = get_reliability_table_for_source('GHGRPa')
+
+    # add reliability scores
+    ghgrp = pd.merge(ghgrp, ghgrp_reliability_table,
+                     left_on='METHOD',
+                     right_on='Code', how='left')
+
+    # fill NAs with 5 for DQI reliability score
+    ghgrp['DQI Reliability Score'] = ghgrp['DQI Reliability Score'
+                                           ].fillna(value=5)
+
+    # convert metric tons to kilograms
+    ghgrp['FlowAmount'] = 1000 * ghgrp['FlowAmount']
+
+    # rename reliability score column for consistency
+    ghgrp = (ghgrp
+             .rename(columns={'DQI Reliability Score': 'DataReliability',
+                              'SUBPART_NAME': 'Process',
+                              'FlowCode': 'FlowID'})
+             .assign(ProcessType = 'Subpart')
+             )
+    return ghgrp
+
+
+def build_validation_totals(year):
+    """Generate the national totals for validation if they are not stored.
+
+    :return: path of the national totals file
+    """
+    totals_path = DATA_PATH / f'GHGRP_{year}_NationalTotals.csv'
+    if not totals_path.exists():
+        generate_national_totals_validation(year)
+    return totals_path
+
+
+def validate_national_totals_by_subpart(tab_df, year, write=True):
+    """Validate against national totals by subpart.
+
+    :param tab_df: df of processed GHGRP data, is modified
+    :param year: str
+    :param write: bool, True to write the validation result to local dir
+    :return: df of validation result
+    """
     log.info('validating flowbyfacility against national totals')
     # apply CO2e factors for some flows
     mask = (tab_df['AmountCO2e'].isna() & tab_df['FlowID'].isin(flows_CO2e))
@@ -680,9 +884,7 @@ def validate_national_totals_by_subpart(tab_df, year):
                            'FlowID': 'FlowName'}, inplace=True)
 
     # import and parse reference data
-    totals_path = DATA_PATH / f'GHGRP_{year}_NationalTotals.csv'
-    if not totals_path.exists():
-        generate_national_totals_validation(year)
+    totals_path = build_validation_totals(year)
     ref_df = (pd.read_csv(totals_path)
               .drop(columns=['FlowName'])
               .rename(columns={'SUBPART_NAME': 'SubpartName',
@@ -694,7 +896,16 @@ def validate_national_totals_by_subpart(tab_df, year):
     # Update flow names to indicate which are in CO2e
     validation_result.loc[validation_result['FlowName'].isin(flows_CO2e),
                           'FlowName'] = validation_result['FlowName'] + ' (CO2e)'
-    write_validation_result('GHGRP', year, validation_result)
+    if write:
+        write_validation_result('GHGRP', year, validation_result)
+    return validation_result
+
+
+def validate_stored_inventory(year):
+    """Validate the processed GHGRP data from Option A against national
+    totals by subpart."""
+    return validate_national_totals_by_subpart(load_processed_ghgrp(year),
+                                               year, write=False)
 
 
 def generate_metadata(year, m, datatype='inventory'):
@@ -719,15 +930,15 @@ def load_subpart_l_gwp():
     subpart_L_GWPs_url = _config['subpart_L_GWPs_url']
     filepath = OUTPUT_PATH.joinpath('Subpart L Calculation Spreadsheet.xls')
     download_table(filepath=filepath, url=subpart_L_GWPs_url)
-    table1 = pd.read_excel(filepath, sheet_name='Lookup Tables',
-                           usecols="A,D")
+    table1 = read_excel_cached(filepath, sheet_name='Lookup Tables',
+                               usecols="A,D")
     table1.rename(columns={'Global warming potential (100 yr.)': 'CO2e_factor',
                            'Name': 'Flow Name'},
                   inplace=True)
     # replace emdash with hyphen
     table1['Flow Name'] = table1['Flow Name'].str.replace('–', '-')
-    table2 = pd.read_excel(filepath, sheet_name='Lookup Tables',
-                           usecols="G,H", nrows=12)
+    table2 = read_excel_cached(filepath, sheet_name='Lookup Tables',
+                               usecols="G,H", nrows=12)
     table2.rename(columns={'Default Global Warming Potential': 'CO2e_factor',
                            'Fluorinated GHG Groupd': 'Flow Name'},
                   inplace=True)
@@ -754,6 +965,58 @@ def load_subpart_l_gwp():
     return subpart_L_GWPs
 
 
+def generate_processed_ghgrp(years):
+    """Download and parse GHGRP data for a list of years and save the
+    processed data of each year.
+
+    Subpart tables are downloaded by year. The workbooks of subparts E, S,
+    BB, CC, LL, O and L, which cover all reporting years, are parsed once and
+    their records split by year.
+    :param years: list of str years
+    """
+    # the workbooks must be downloaded before parsing
+    download_excel_tables(MetaGHGRP())
+    # parse emissions data for subparts E, BB, CC, LL (S already accounted for)
+    ghgrp2 = split_by_year(parse_additional_suparts_data(
+        esbb_subparts_path, 'esbb_subparts_columns.csv', years), years)
+    # parse emissions data for subpart O
+    ghgrp3 = split_by_year(parse_subpart_O(years), years)
+    # parse emissions data for subpart L
+    ghgrp4 = split_by_year(parse_subpart_L(years), years)
+
+    for year in years:
+        m = MetaGHGRP()
+        download_excel_tables(m)
+
+        # download subpart emissions tables for report year and save locally
+        # parse subpart emissions data to match standardized EPA format
+        ghgrp1 = download_and_parse_subpart_tables(year, m)
+
+        # concatenate ghgrp1, ghgrp2, ghgrp3, and ghgrp4
+        ghgrp = pd.concat([ghgrp1, ghgrp2[year],
+                           ghgrp3[year], ghgrp4[year]]).reset_index(drop=True)
+
+        # map flow descriptions to standard gas names from GHGRP
+        ghg_mapping = pd.read_csv(GHGRP_DATA_PATH.joinpath('ghg_mapping.csv'),
+                                  usecols=['Flow Description', 'FlowName',
+                                           'GAS_CODE'])
+        ghgrp = pd.merge(ghgrp, ghg_mapping, on='Flow Description',
+                         how='left', validate='m:1')
+        missing = ghgrp[ghgrp['FlowName'].isna()]
+        if len(missing) > 0:
+            log.warning('some flows are unmapped')
+        ghgrp = (ghgrp
+                 .drop(columns=['Flow Description'])
+                 .rename(columns={'FACILITY_ID': 'FacilityID',
+                                  'NAICS_CODE': 'NAICS',
+                                  'GAS_CODE': 'FlowCode'})
+                 )
+
+        store_processed_ghgrp(ghgrp, year)
+
+        generate_metadata(year, m, datatype='source')
+
+
 def main(**kwargs):
 
     parser = argparse.ArgumentParser(argument_default = argparse.SUPPRESS)
@@ -772,80 +1035,13 @@ def main(**kwargs):
     if len(kwargs) == 0:
         kwargs = vars(parser.parse_args())
 
+    if kwargs['Option'] == 'A':
+        generate_processed_ghgrp([str(year) for year in kwargs['Year']])
+
     for year in kwargs['Year']:
         year = str(year)
-        pickle_file = OUTPUT_PATH.joinpath(f'GHGRP_{year}.pk')
-        if kwargs['Option'] == 'A':
-
-            m = MetaGHGRP()
-            download_excel_tables(m)
-
-            # download subpart emissions tables for report year and save locally
-            # parse subpart emissions data to match standardized EPA format
-            ghgrp1 = download_and_parse_subpart_tables(year, m)
-
-            # parse emissions data for subparts E, BB, CC, LL (S already accounted for)
-            ghgrp2 = parse_additional_suparts_data(esbb_subparts_path,
-                                                   'esbb_subparts_columns.csv', year)
-
-            # parse emissions data for subpart O
-            ghgrp3 = parse_subpart_O(year)
-
-            # parse emissions data for subpart L
-            ghgrp4 = parse_subpart_L(year)
-
-            # concatenate ghgrp1, ghgrp2, ghgrp3, and ghgrp4
-            ghgrp = pd.concat([ghgrp1, ghgrp2,
-                               ghgrp3, ghgrp4]).reset_index(drop=True)
-
-            # map flow descriptions to standard gas names from GHGRP
-            ghg_mapping = pd.read_csv(GHGRP_DATA_PATH.joinpath('ghg_mapping.csv'),
-                                      usecols=['Flow Description', 'FlowName',
-                                               'GAS_CODE'])
-            ghgrp = pd.merge(ghgrp, ghg_mapping, on='Flow Description',
-                             how='left', validate='m:1')
-            missing = ghgrp[ghgrp['FlowName'].isna()]
-            if len(missing) > 0:
-                log.warning('some flows are unmapped')
-            ghgrp = (ghgrp
-                     .drop(columns=['Flow Description'])
-                     .rename(columns={'FACILITY_ID': 'FacilityID',
-                                      'NAICS_CODE': 'NAICS',
-                                      'GAS_CODE': 'FlowCode'})
-                     )
-
-            # pickle data and save to network
-            log.info(f'saving processed GHGRP data to {pickle_file}')
-            ghgrp.to_pickle(pickle_file)
-
-            generate_metadata(year, m, datatype='source')
-
         if kwargs['Option'] == 'B':
-            log.info(f'extracting data from {pickle_file}')
-            ghgrp = pd.read_pickle(pickle_file)
-
-            # import data reliability scores
-            ghgrp_reliability_table = get_reliability_table_for_source('GHGRPa')
-
-            # add reliability scores
-            ghgrp = pd.merge(ghgrp, ghgrp_reliability_table,
-                             left_on='METHOD',
-                             right_on='Code', how='left')
-
-            # fill NAs with 5 for DQI reliability score
-            ghgrp['DQI Reliability Score'] = ghgrp['DQI Reliability Score'
-                                                   ].fillna(value=5)
-
-            # convert metric tons to kilograms
-            ghgrp['FlowAmount'] = 1000 * ghgrp['FlowAmount'].astype('float')
-
-            # rename reliability score column for consistency
-            ghgrp = (ghgrp
-                     .rename(columns={'DQI Reliability Score': 'DataReliability',
-                                      'SUBPART_NAME': 'Process',
-                                      'FlowCode': 'FlowID'})
-                     .assign(ProcessType = 'Subpart')
-                     )
+            ghgrp = load_processed_ghgrp(year)
             log.info('generating flowbysubpart output')
 
             # generate flowbysubpart
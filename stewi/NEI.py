@@ -6,7 +6,7 @@ Imports NEI data and processes to Standardized EPA output format.
 Uses the NEI data exports from EIS. Must contain locally downloaded data for
 options A:C.
 This file requires parameters be passed like:
-    Option -Y Year
+    Option -Y Year [-S States]
 
 Option:
     A - for downloading NEI Point data and
@@ -19,25 +19,36 @@ Option:
 
 Year:
     2011-2022
+
+States:
+    optional two letter state abbreviations for Option A, to generate outputs
+    for those states only and merge them into the stored national outputs
 """
 
 import argparse
 import io
 import zipfile
+from functools import lru_cache
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
 from esupy.processed_data_mgmt import download_from_remote,\
-    read_source_metadata
+    read_source_metadata, load_preprocessed_output
 from esupy.remote import make_url_request
 from esupy.util import strip_file_extension
 from stewi.globals import DATA_PATH, write_metadata, USton_kg, lb_kg,\
     log, store_inventory, config, assign_secondary_context,\
-    paths, aggregate, get_reliability_table_for_source, set_stewi_meta
+    paths, aggregate_rollup, get_reliability_table_for_source, set_stewi_meta,\
+    read_stored_inventory
 from stewi.validate import update_validationsets_sources, validate_inventory,\
     write_validation_result
-from stewi.formats import facility_fields
+from stewi.filter import remove_filtered_inventories
+from stewi.formats import facility_fields, StewiFormat
 
 
 _config = config()['databases']['NEI']
@@ -46,35 +57,57 @@ OUTPUT_PATH = paths.local_path / EXT_DIR
 NEI_DATA_PATH = DATA_PATH / 'NEI'
 
 
-def read_data(year, file):
-    """Read NEI data and return a dataframe based on identified columns.
-
-    :param year : str, Year of NEI dataset for identifying field names
-    :param file : str, File path containing NEI data (parquet).
-    :returns df : DataFrame of NEI data from a single file
-        with standardized column names.
-    """
+@lru_cache(maxsize=None)
+def read_required_fields(year):
+    """Return a dictionary of NEI field names (key) and Standardized EPA
+    names for a year of NEI data. The dictionary must not be modified."""
     nei_required_fields = pd.read_table(NEI_DATA_PATH
                                         .joinpath('NEI_required_fields.csv'),
                                         sep=',')
-    nei_required_fields = nei_required_fields[[year, 'StandardizedEPA']]
-    usecols = list(nei_required_fields[year].dropna())
-    df = pd.read_parquet(file, columns=usecols)
-    # change column names to Standardized EPA names
-    df = df.rename(columns=pd.Series(list(nei_required_fields['StandardizedEPA']),
-                                     index=list(nei_required_fields[year])).to_dict())
-    return df
+    nei_required_fields = (nei_required_fields[[year, 'StandardizedEPA']]
+                           .dropna(subset=[year]))
+    return dict(zip(nei_required_fields[year],
+                    nei_required_fields['StandardizedEPA']))
 
 
-def standardize_output(year, source='Point'):
+def read_data(year, files, states=None):
+    """Read NEI data and return a table based on identified columns.
+
+    All files are scanned as a single dataset, reading only the identified
+    columns and assigning Standardized EPA names within the scan. When states
+    are passed, records are filtered by state within the scan so that row
+    groups without those states are skipped.
+
+    :param year : str, Year of NEI dataset for identifying field names
+    :param files : list of file paths containing NEI data (parquet).
+    :param states : optional list of two letter state abbreviations
+    :returns : pyarrow Table of NEI data from all files
+        with standardized column names.
+    """
+    fields = read_required_fields(year)
+    schema = pa.unify_schemas([pq.read_schema(f) for f in files],
+                              promote_options='permissive')
+    dataset = ds.dataset([str(f) for f in files], schema=schema,
+                         format='parquet')
+    state_filter = None
+    if states:
+        state_field = {v: k for k, v in fields.items()}['State']
+        state_filter = ds.field(state_field).isin(list(states))
+    return dataset.to_table(columns={v: ds.field(k) for k, v in fields.items()},
+                            filter=state_filter, use_threads=True)
+
+
+def standardize_output(year, source='Point', states=None):
     """Read and parses NEI data.
 
     :param year : str, Year of NEI dataset
+    :param states : optional list of state abbreviations to which records
+        are limited
     :returns nei: DataFrame of parsed NEI data.
     """
-    nei = pd.DataFrame()
-    # read in nei files and concatenate all nei files into one dataframe
+    # read in nei files as one dataset
     nei_file_path = _config[year]['file_name']
+    filenames = []
     for file in nei_file_path:
         filename = OUTPUT_PATH.joinpath(file)
         if not filename.is_file():
@@ -85,34 +118,159 @@ def standardize_output(year, source='Point'):
             file_meta.category = EXT_DIR
             file_meta.tool = file_meta.tool.lower()
             download_from_remote(file_meta, paths)
-        # concatenate all other files
-        log.info(f'reading NEI data from {filename}')
-        nei = pd.concat([nei, read_data(year, filename)])
-        log.debug(f'{str(len(nei))} records')
+        filenames.append(filename)
+    log.info(f'reading NEI data from {", ".join(nei_file_path)}'
+             + (f' for {", ".join(states)}' if states else ''))
+    nei = read_data(year, filenames, states)
+    log.debug(f'{str(nei.num_rows)} records')
     # convert TON to KG
-    nei['FlowAmount'] = nei['FlowAmount'] * USton_kg
+    nei = nei.set_column(nei.schema.get_field_index('FlowAmount'),
+                         'FlowAmount',
+                         pc.multiply(nei['FlowAmount'], USton_kg))
 
     log.info('adding Data Quality information')
     if source == 'Point':
         nei_reliability_table = get_reliability_table_for_source('NEI')
-        nei_reliability_table['Code'] = nei_reliability_table['Code'].astype(float)
-        nei['ReliabilityScore'] = nei['ReliabilityScore'].astype(float)
-        nei = nei.merge(nei_reliability_table, left_on='ReliabilityScore',
-                        right_on='Code', how='left')
-        nei['DataReliability'] = nei['DQI Reliability Score']
-        # drop Code and DQI Reliability Score columns
-        nei = nei.drop(columns=['Code', 'DQI Reliability Score',
-                                'ReliabilityScore'])
-
+        codes = pa.array(nei_reliability_table['Code'].astype(float))
+        scores = pa.array(nei_reliability_table['DQI Reliability Score'])
+        code_index = pc.index_in(pc.cast(nei['ReliabilityScore'], pa.float64()),
+                                 value_set=codes)
+        nei = (nei.drop(['ReliabilityScore'])
+                  .append_column('DataReliability',
+                                 pc.take(scores, code_index)))
+        nei = nei.to_pandas()
         nei['Compartment'] = 'air'
     else:
+        nei = nei.to_pandas()
         nei['DataReliability'] = 3
     # add Source column
     nei['Source'] = source
-    nei = nei.reset_index(drop=True)
     return nei
 
 
+def generate_NEI_outputs(year, states=None):
+    """Generate NEI point source inventory outputs.
+
+    :param year: str, year of NEI data
+    :param states: optional list of state abbreviations to which source
+        records are limited
+    :return: dictionary of output dataframes by format, list of secondary
+        context parameters
+    """
+    nei_point = standardize_output(year, states=states)
+
+    log.info('generating facility output')
+    facility = nei_point[[f for f in facility_fields
+                          if f in nei_point.columns]]
+    facility = facility.drop_duplicates('FacilityID')
+    facility = facility.astype({'Zip': 'str'})
+    facility, p = assign_secondary_context(facility, int(year), 'urb')
+    log.debug(len(facility))
+    #2017: 87162
+    #2016: 85802
+    #2014: 85125
+    #2011: 95565
+
+    # reassign urban/rural back to full dataframe if available
+    if p:
+        nei_point = (nei_point.merge(
+            facility[['FacilityID', 'UrbanRural']],
+            how='left', on='FacilityID',
+            validate='m:1')
+            )
+
+    nei_point, parameters = (assign_secondary_context(
+        nei_point, int(year), 'rh', 'concat'))
+
+    log.info('generating flow by SCC and flow by facility outputs')
+    # flow by facility is rolled up from the flow by SCC groups
+    nei_flowbyprocess, nei_flowbyfacility = aggregate_rollup(
+        nei_point, ['FacilityID', 'Compartment', 'FlowName', 'Process'],
+        [['FacilityID', 'FlowName', 'Compartment']])
+    log.debug(len(nei_flowbyfacility))
+    #2017: 2184786
+    #2016: 1965918
+    #2014: 2057249
+    #2011: 1840866
+
+    nei_flowbyprocess['ProcessType'] = 'SCC'
+    log.debug(len(nei_flowbyprocess))
+    #2017: 4055707
+
+    log.info('generating flows output')
+    nei_flows = nei_point[['FlowName', 'FlowID', 'Compartment']]
+    nei_flows = nei_flows.drop_duplicates()
+    nei_flows['Unit'] = 'kg'
+    nei_flows = nei_flows.sort_values(by='FlowName', axis=0)
+    log.debug(len(nei_flows))
+    #2017: 293
+    #2016: 282
+    #2014: 279
+    #2011: 277
+
+    outputs = {'facility': facility,
+               'flowbyfacility': nei_flowbyfacility,
+               'flowbyprocess': nei_flowbyprocess,
+               'flow': nei_flows}
+    return outputs, parameters
+
+
+def partition_name(year, states):
+    """Return the file name of NEI outputs limited to a set of states."""
+    return f'NEI_{year}_{"-".join(sorted(states))}'
+
+
+def store_NEI_outputs(outputs, year, states=None):
+    """Store NEI outputs. Outputs limited to states are stored as partitions
+    in a 'partitions' subdirectory of each format directory."""
+    for f, df in outputs.items():
+        if states:
+            store_inventory(df, partition_name(year, states), f'{f}/partitions')
+        else:
+            store_inventory(df, f'NEI_{year}', f)
+
+
+def merge_NEI_partition(outputs, year, states):
+    """Merge NEI outputs generated for a set of states into the stored
+    national outputs, replacing all records of facilities in those states.
+
+    Flows of the stored national outputs are retained and combined with
+    those of the partition.
+    :param outputs: dictionary of output dataframes by format, as returned
+        by generate_NEI_outputs for the states
+    :param year: str, year of NEI data
+    :param states: list of state abbreviations
+    :return: dictionary of merged national dataframes by format, or None if
+        national outputs are not available
+    """
+    national = {}
+    for f in outputs:
+        national[f] = load_preprocessed_output(
+            set_stewi_meta(f'NEI_{year}', f), paths)
+        if national[f] is None:
+            log.warning(f'national NEI_{year} {f} not found, generate '
+                        'national outputs before merging partitions for '
+                        f'{", ".join(states)}')
+            return None
+    log.info(f'merging NEI_{year} outputs for {", ".join(states)} into '
+             'national outputs')
+    facility = national['facility']
+    replaced = pd.concat([facility.loc[facility['State'].isin(states),
+                                       'FacilityID'],
+                          outputs['facility']['FacilityID']])
+    merged = {}
+    for f in ['facility', 'flowbyfacility', 'flowbyprocess']:
+        df = national[f]
+        merged[f] = pd.concat([df[~df['FacilityID'].isin(replaced)],
+                               outputs[f]], ignore_index=True)
+    merged['flow'] = (pd.concat([national['flow'], outputs['flow']])
+                      .drop_duplicates(ignore_index=True)
+                      .sort_values(by='FlowName', axis=0))
+    store_NEI_outputs(merged, year)
+    remove_filtered_inventories('NEI', year)
+    return merged
+
+
 def generate_national_totals(year):
     """Download and parse pollutant national totals from 'Facility-level by
     Pollutant' data downloaded from EPA website. Used for validation.
@@ -179,13 +337,14 @@ def generate_national_totals(year):
     update_validationsets_sources(validation_dict)
 
 
-def validate_national_totals(nei_flowbyfacility, year):
-    """Validate against national flow totals."""
+def validate_national_totals(nei_flowbyfacility, year, write=True):
+    """Validate against national flow totals.
+
+    :param write: bool, True to write the validation result to local dir
+    :return: df of validation result
+    """
     log.info('validating flow by facility against national totals')
-    if not DATA_PATH.joinpath(f'NEI_{year}_NationalTotals.csv').is_file():
-        generate_national_totals(year)
-    else:
-        log.info('using already processed national totals validation file')
+    build_validation_totals(year)
     nei_national_totals = (
         pd.read_csv(DATA_PATH.joinpath(f'NEI_{year}_NationalTotals.csv'),
                     header=0, dtype={"FlowAmount[kg]": float})
@@ -194,7 +353,31 @@ def validate_national_totals(nei_flowbyfacility, year):
                                            nei_national_totals,
                                            group_by=['FlowName'],
                                            tolerance=5.0)
-    write_validation_result('NEI', year, validation_result)
+    if write:
+        write_validation_result('NEI', year, validation_result)
+    return validation_result
+
+
+def build_validation_totals(year):
+    """Generate the national totals for validation if they are not stored."""
+    if int(year) >= 2022:
+        # national totals do not exist
+        return
+    if not DATA_PATH.joinpath(f'NEI_{year}_NationalTotals.csv').is_file():
+        generate_national_totals(year)
+    else:
+        log.info('using already processed national totals validation file')
+
+
+def validate_stored_inventory(year):
+    """Validate the stored NEI flowbyfacility against national totals."""
+    if int(year) >= 2022:
+        log.info(f'national totals do not exist for year {year}. '
+                 'No validation available.')
+        return None
+    nei_flowbyfacility = read_stored_inventory('NEI', year,
+                                               StewiFormat.FLOWBYFACILITY)
+    return validate_national_totals(nei_flowbyfacility, year, write=False)
 
 
 def generate_metadata(year, parameters):
@@ -224,68 +407,27 @@ def main(**kwargs):
                         help = 'What NEI year(s) you want to retrieve',
                         type = str)
 
+    parser.add_argument('-S', '--States', nargs = '+',
+                        help = 'Optional two letter state abbreviations for \
+                        Option A. Outputs are generated for these states only \
+                        and merged into the stored national outputs',
+                        type = str)
+
     if len(kwargs) == 0:
         kwargs = vars(parser.parse_args())
 
     for year in kwargs['Year']:
         year = str(year)
         if kwargs['Option'] == 'A':
-            nei_point = standardize_output(year)
-
-            log.info('generating facility output')
-            facility = nei_point[[f for f in facility_fields
-                                  if f in nei_point.columns]]
-            facility = facility.drop_duplicates('FacilityID')
-            facility = facility.astype({'Zip': 'str'})
-            facility, p = assign_secondary_context(facility, int(year), 'urb')
-            store_inventory(facility, f'NEI_{year}', 'facility')
-            log.debug(len(facility))
-            #2017: 87162
-            #2016: 85802
-            #2014: 85125
-            #2011: 95565
-
-            # reassign urban/rural back to full dataframe if available
-            if p:
-                nei_point = (nei_point.merge(
-                    facility.rename(columns={'UrbanRural': 'cmpt_urb'})
-                        [['FacilityID', 'cmpt_urb']],
-                    how='left', on='FacilityID',
-                    validate='m:1')
-                    )
-
-            nei_point, parameters = (assign_secondary_context(
-                nei_point, int(year), 'rh', 'concat'))
-
-            log.info('generating flow by facility output')
-            nei_flowbyfacility = aggregate(nei_point, ['FacilityID', 'FlowName',
-                                                       'Compartment'])
-            store_inventory(nei_flowbyfacility, f'NEI_{year}', 'flowbyfacility')
-            log.debug(len(nei_flowbyfacility))
-            #2017: 2184786
-            #2016: 1965918
-            #2014: 2057249
-            #2011: 1840866
-
-            log.info('generating flow by SCC output')
-            nei_flowbyprocess = aggregate(nei_point, ['FacilityID', 'Compartment',
-                                                      'FlowName', 'Process'])
-            nei_flowbyprocess['ProcessType'] = 'SCC'
-            store_inventory(nei_flowbyprocess, f'NEI_{year}', 'flowbyprocess')
-            log.debug(len(nei_flowbyprocess))
-            #2017: 4055707
-
-            log.info('generating flows output')
-            nei_flows = nei_point[['FlowName', 'FlowID', 'Compartment']]
-            nei_flows = nei_flows.drop_duplicates()
-            nei_flows['Unit'] = 'kg'
-            nei_flows = nei_flows.sort_values(by='FlowName', axis=0)
-            store_inventory(nei_flows, f'NEI_{year}', 'flow')
-            log.debug(len(nei_flows))
-            #2017: 293
-            #2016: 282
-            #2014: 279
-            #2011: 277
+            states = kwargs.get('States')
+            outputs, parameters = generate_NEI_outputs(year, states)
+            if states:
+                store_NEI_outputs(outputs, year, states)
+                outputs = merge_NEI_partition(outputs, year, states)
+                if outputs is None:
+                    continue
+            else:
+                store_NEI_outputs(outputs, year)
 
             generate_metadata(year, parameters)
 
@@ -293,7 +435,7 @@ def main(**kwargs):
                 log.info(f'national totals do not exist for year {year}. '
                          'No validation available.')
             else:
-                validate_national_totals(nei_flowbyfacility, year)
+                validate_national_totals(outputs['flowbyfacility'], year)
 
         elif kwargs['Option'] == 'B':
             if int(year) >= 2022:
@@ -97,7 +97,11 @@ Year is like 2015 with coverage up for 2011, 2013, 2015
 See more documentation of files at https://rcrapublic.epa.gov/rcrainfoweb/
 """
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import zipfile
 import argparse
 import os
@@ -110,10 +114,11 @@ from esupy.remote import make_url_request
 from stewi.globals import write_metadata, DATA_PATH, config,\
     USton_kg, get_reliability_table_for_source, paths,\
     log, store_inventory, compile_source_metadata,\
-    aggregate, set_stewi_meta
+    aggregate, set_stewi_meta, read_stored_inventory
 from stewi.validate import update_validationsets_sources, validate_inventory,\
     write_validation_result
 from stewi.filter import apply_filters_to_inventory
+from stewi.formats import StewiFormat
 import stewi.exceptions
 
 
@@ -122,12 +127,16 @@ EXT_DIR = 'RCRAInfo Data Files'
 OUTPUT_PATH = paths.local_path / EXT_DIR
 RCRA_DATA_PATH = DATA_PATH / 'RCRAInfo'
 DIR_RCRA_BY_YEAR = OUTPUT_PATH / 'RCRAInfo_by_year'
+# records read at a time from BR_REPORTING files
+CHUNK_SIZE = 500000
+# BR_REPORTING fields read as categories for merges with code tables
+CODE_FIELDS = ['Waste Code Group', 'Form Code']
 
 
-def waste_description_cleaner(x):
-    if ('from br conversion' in x) or (x == 'From 1989 BR data'):
-        x = None
-    return x
+def waste_description_cleaner(s):
+    """Remove placeholder waste code descriptions from a series."""
+    return s.mask(s.str.contains('from br conversion', regex=False) |
+                  (s == 'From 1989 BR data'))
 
 
 def download_and_extract_zip(tables):
@@ -172,70 +181,124 @@ def download_and_extract_zip(tables):
 
 
 def organize_br_reporting_files_by_year(tables, year):
-    """Consolidate BR_REPORTING files to single csv."""
-    year = int(year)
+    """Consolidate BR_REPORTING files to single file."""
+    organize_br_reporting_files(tables, [year])
+
+
+def organize_br_reporting_files(tables, years):
+    """Consolidate BR_REPORTING files to a single parquet file per year.
+
+    Files for all years are scanned once in chunks of CHUNK_SIZE records,
+    read as strings. Records are routed to the file of their Report Cycle
+    where that year is among the years in the file name.
+    :param tables: list of tables, those other than BR_REPORTING are skipped
+    :param years: list of report years
+    """
+    years = sorted({int(y) for y in years})
     for table in tables:
-        if 'BR_REPORTING' in table:
-            log.info(f'organizing data for {table} from {year}...')
-            linewidthsdf = pd.read_csv(RCRA_DATA_PATH
-                                       .joinpath('RCRA_FlatFile_LineComponents.csv'))
-            fields = linewidthsdf['Data Element Name'].tolist()
-            files = sorted([file for file in OUTPUT_PATH
-                            .glob(f'{table}*{year}*.csv')])
-            df_full = pd.DataFrame()
-            for filepath in files:
+        if 'BR_REPORTING' not in table:
+            log.info(f'skipping {table}')
+            continue
+        log.info(f'organizing data for {table} from '
+                 f'{", ".join(str(y) for y in years)}...')
+        linewidthsdf = pd.read_csv(RCRA_DATA_PATH
+                                   .joinpath('RCRA_FlatFile_LineComponents.csv'))
+        fields = linewidthsdf['Data Element Name'].tolist()
+        schema = pa.schema([(f, pa.int64() if f == 'Report Cycle'
+                             else pa.string()) for f in fields])
+        file_years = {}
+        for year in years:
+            for filepath in OUTPUT_PATH.glob(f'{table}*{year}*.csv'):
+                file_years.setdefault(filepath, []).append(year)
+        DIR_RCRA_BY_YEAR.mkdir(exist_ok=True)
+        writers = {year: pq.ParquetWriter(br_reporting_file(year)
+                                          .with_suffix('.tmp'), schema)
+                   for year in years}
+        try:
+            for filepath in sorted(file_years):
                 log.info(f'extracting {filepath}')
-                df = pd.read_csv(filepath, header=0,
-                                 usecols=list(range(0, len(fields))),
-                                 names=fields,
-                                 low_memory=False,
-                                 encoding='utf-8')
-                df = df[df['Report Cycle'].apply(
-                    lambda x: str(x).replace('.0', '').isdigit())]
-                if df['Location Street Number'].dtype != 'str':
-                    df['Location Street Number'] = df['Location Street Number'].astype(str)
-                    df['Location Street Number'] = df['Location Street Number'].apply(
-                        lambda x: str(x).replace('.0', ''))
-                df['Report Cycle'] = df['Report Cycle'].astype(int)
-                df = df[df['Report Cycle'] == year]
-                df_full = pd.concat([df_full, df])
-            DIR_RCRA_BY_YEAR.mkdir(exist_ok=True)
-            filepath = DIR_RCRA_BY_YEAR.joinpath(f'br_reporting_{year}.csv')
+                reader = pd.read_csv(filepath, header=0,
+                                     usecols=list(range(0, len(fields))),
+                                     names=fields, dtype=str,
+                                     encoding='utf-8', chunksize=CHUNK_SIZE)
+                for df in reader:
+                    df = clean_br_reporting(df)
+                    df = df[df['Report Cycle'].isin(file_years[filepath])]
+                    for year, df_year in df.groupby('Report Cycle'):
+                        writers[year].write_table(pa.Table.from_pandas(
+                            df_year, schema=schema, preserve_index=False))
+        finally:
+            for writer in writers.values():
+                writer.close()
+        for year in years:
+            filepath = br_reporting_file(year)
             log.info(f'saving to {filepath}...')
-            df_full.to_csv(filepath, index=False)
-            generate_metadata(year, files, datatype='source')
-        else:
-            log.info(f'skipping {table}')
+            os.replace(filepath.with_suffix('.tmp'), filepath)
+            generate_metadata(year, sorted(f for f, y in file_years.items()
+                                           if year in y),
+                              datatype='source')
 
 
-def Generate_RCRAInfo_files_csv(report_year):
-    """Generate stewi inventory files from downloaded data files."""
-    log.info(f'generating inventory files for {report_year}')
-    filepath = DIR_RCRA_BY_YEAR.joinpath(f'br_reporting_{str(report_year)}.csv')
-    # Get columns to keep
-    fieldstokeep = pd.read_csv(RCRA_DATA_PATH.joinpath('RCRA_required_fields.txt'),
-                               header=None)
-    # on_bad_lines requires pandas >= 1.3
-    df = pd.read_csv(filepath, header=0, usecols=list(fieldstokeep[0]),
-                     low_memory=False, on_bad_lines='skip',
-                     encoding='ISO-8859-1')
+def clean_br_reporting(df):
+    """Keep BR_REPORTING records with a numeric Report Cycle, as int, and
+    remove '.0' from Location Street Number."""
+    cycle = df['Report Cycle'].str.replace('.0', '', regex=False)
+    df = df[cycle.str.isdigit().fillna(False).astype(bool)]
+    return df.assign(**{
+        'Report Cycle': cycle[df.index].astype(int),
+        'Location Street Number': (df['Location Street Number']
+                                   .str.replace('.0', '', regex=False))})
 
-    log.info(f'completed reading {filepath}')
-    # Checking the Waste Generation Data Health
-    df = df[pd.to_numeric(df['Generation Tons'], errors='coerce').notnull()]
-    df['Generation Tons'] = df['Generation Tons'].astype(float)
-    log.debug(f'number of records: {len(df)}')
-    # Reassign the NAICS to a string
-    df['NAICS'] = df['Primary NAICS'].astype('str')
-    df.drop(columns=['Primary NAICS'], inplace=True)
-    # Create field for DQI Reliability Score with fixed value from CSV
-    rcrainfo_reliability_table = get_reliability_table_for_source('RCRAInfo')
-    df['DataReliability'] = float(rcrainfo_reliability_table['DQI Reliability Score'])
-    # Create a new field to put converted amount in
-    df['Amount_kg'] = 0.0
-    # Convert amounts from tons. Note this could be replaced with a conversion utility
-    df['Amount_kg'] = USton_kg * df['Generation Tons']
-    # Read in waste descriptions
+
+def br_reporting_file(year):
+    """Return the path of BR_REPORTING records organized for a year."""
+    return DIR_RCRA_BY_YEAR.joinpath(f'br_reporting_{year}.parquet')
+
+
+def read_required_fields():
+    """Return the list of BR_REPORTING fields used to generate the inventory."""
+    return pd.read_csv(RCRA_DATA_PATH.joinpath('RCRA_required_fields.txt'),
+                       header=None)[0].tolist()
+
+
+def read_br_reporting(filepath, fields):
+    """Read BR_REPORTING records organized for a year as strings, with the
+    fields in CODE_FIELDS dictionary encoded as categories.
+
+    :param filepath: path to a parquet file, or a csv file organized by
+        earlier versions
+    :param fields: list of fields to read
+    """
+    if filepath.suffix == '.parquet':
+        table = pq.read_table(filepath, columns=fields,
+                              read_dictionary=CODE_FIELDS)
+    else:
+        column_types = {f: (pa.dictionary(pa.int32(), pa.string())
+                            if f in CODE_FIELDS else pa.string())
+                        for f in fields}
+        table = pacsv.read_csv(
+            filepath,
+            read_options=pacsv.ReadOptions(encoding='ISO-8859-1'),
+            parse_options=pacsv.ParseOptions(
+                invalid_row_handler=lambda row: 'skip'),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=fields, column_types=column_types,
+                strings_can_be_null=True))
+    return table.to_pandas()
+
+
+def join_fields(df, fields, sep=' '):
+    """Join the non-null values of fields for each record."""
+    joined = pd.Series(np.nan, index=df.index, dtype=object)
+    for field in fields:
+        values = df[field]
+        joined = joined.mask(values.notna(),
+                             (joined + sep + values).fillna(values))
+    return joined.fillna('')
+
+
+def read_waste_codes():
+    """Return waste code descriptions from the downloaded lookup file."""
     linewidthsdf = pd.read_csv(RCRA_DATA_PATH
                                .joinpath('RCRAInfo_LU_WasteCode_LineComponents.csv'))
     names = linewidthsdf['Data Element Name']
@@ -252,68 +315,94 @@ def Generate_RCRAInfo_files_csv(report_year):
     # Remove rows where any fields are na description is missing
     waste_codes = waste_codes[['Waste Code', 'Code Type',
                                'Waste Code Description']].dropna()
-    waste_codes['Waste Code Description'] = waste_codes[
-        'Waste Code Description'].apply(waste_description_cleaner)
+    waste_codes['Waste Code Description'] = waste_description_cleaner(
+        waste_codes['Waste Code Description'])
     waste_codes = waste_codes.drop_duplicates(ignore_index=True)
     waste_codes = waste_codes[~((waste_codes['Waste Code'].duplicated(False)) &
                                 ((waste_codes['Waste Code Description'].isna()) |
                                  (waste_codes['Waste Code Description'] == 'Unknown')))]
-    waste_codes.rename(columns={'Waste Code': 'Waste Code Group',
-                                'Code Type': 'Waste Code Type'}, inplace=True)
-    df = df.merge(waste_codes, on='Waste Code Group', how='left')
+    return waste_codes.rename(columns={'Waste Code': 'Waste Code Group',
+                                       'Code Type': 'Waste Code Type'})
+
 
+def Generate_RCRAInfo_files_csv(report_year):
+    """Generate stewi inventory files from downloaded data files."""
+    log.info(f'generating inventory files for {report_year}')
+    filepath = br_reporting_file(report_year)
+    if not filepath.is_file():
+        # files organized by earlier versions
+        filepath = filepath.with_suffix('.csv')
+    df = read_br_reporting(filepath, read_required_fields())
+    log.info(f'completed reading {filepath}')
+    # Checking the Waste Generation Data Health
+    tons = pd.to_numeric(df['Generation Tons'], errors='coerce')
+    df = df[tons.notnull()]
+    log.debug(f'number of records: {len(df)}')
+    # Create field for DQI Reliability Score with fixed value from CSV
+    rcrainfo_reliability_table = get_reliability_table_for_source('RCRAInfo')
+    # Convert amounts from tons. Note this could be replaced with a conversion utility
+    df = (df.assign(
+            # Reassign the NAICS to a string, missing as 'nan'
+            NAICS=df['Primary NAICS'].fillna('nan'),
+            DataReliability=float(rcrainfo_reliability_table['DQI Reliability Score']),
+            Amount_kg=USton_kg * tons[tons.notnull()])
+          .drop(columns=['Primary NAICS']))
+
+    # Code tables take the categories of the keys, codes not reported are
+    # dropped so that they are not matched to null keys
+    waste_codes = (read_waste_codes()
+                   .astype({'Waste Code Group': df['Waste Code Group'].dtype})
+                   .dropna(subset=['Waste Code Group']))
+    df = df.merge(waste_codes, how='left', on='Waste Code Group')
     # Replace form code with the code name
     form_code_name_file = RCRA_DATA_PATH.joinpath('RCRA_LU_FORM_CODE.csv')
-    form_code_name_df = pd.read_csv(form_code_name_file, header=0,
-                                    usecols=['FORM_CODE', 'FORM_CODE_NAME'])
-    form_code_name_df.rename(columns={'FORM_CODE': 'Form Code'}, inplace=True)
-    df = df.merge(form_code_name_df, on='Form Code', how='left')
-
-    df['FlowName'] = df['Waste Code Description']
+    form_code_name_df = (pd.read_csv(form_code_name_file, header=0,
+                                     usecols=['FORM_CODE', 'FORM_CODE_NAME'])
+                         .rename(columns={'FORM_CODE': 'Form Code'})
+                         .astype({'Form Code': df['Form Code'].dtype})
+                         .dropna(subset=['Form Code']))
+    df = df.merge(form_code_name_df, how='left', on='Form Code')
+    df[CODE_FIELDS] = df[CODE_FIELDS].astype(object)
 
     # If there is not useful waste code, fill it with the Form Code Name
-    # Find the NAs in FlowName and then give that source of Form Code
-    df.loc[df['FlowName'].isnull(), 'FlowNameSource'] = 'Form Code'
-    df.loc[df['FlowNameSource'].isnull(), 'FlowNameSource'] = 'Waste Code'
-    # Set FlowIDs to the appropriate code
-    df.loc[df['FlowName'].isnull(), 'FlowID'] = df['Form Code']
-    df.loc[df['FlowID'].isnull(), 'FlowID'] = df['Waste Code Group']
-    df['FlowName'].fillna(df['FORM_CODE_NAME'], inplace=True)
-    df = df.dropna(subset=['FlowID']).reset_index(drop=True)
+    # and give that source of Form Code, with the Form Code as FlowID
+    no_waste_code = df['Waste Code Description'].isnull()
+    df['FlowName'] = df['Waste Code Description'].fillna(df['FORM_CODE_NAME'])
+    df['FlowNameSource'] = np.where(no_waste_code, 'Form Code', 'Waste Code')
+    df['FlowID'] = (df['Form Code'].where(no_waste_code)
+                    .fillna(df['Waste Code Group']))
     drop_fields = ['Generation Tons',
                    'Management Method', 'Waste Description',
                    'Waste Code Description', 'FORM_CODE_NAME']
-    df.drop(columns=drop_fields, inplace=True)
     # Rename cols used by multiple tables
-    df.rename(columns={'Handler ID': 'FacilityID',
-                       'Amount_kg': 'FlowAmount'}, inplace=True)
-
-    # Prepare flows file
-    flows = df[['FlowName', 'FlowID', 'FlowNameSource']]
-    flows = flows.drop_duplicates(ignore_index=True)
-    # Sort them by the flow names
-    flows.sort_values(by='FlowName', axis=0, inplace=True)
+    df = (df.dropna(subset=['FlowID'])
+            .reset_index(drop=True)
+            .drop(columns=drop_fields)
+            .rename(columns={'Handler ID': 'FacilityID',
+                             'Amount_kg': 'FlowAmount'}))
+
+    # Prepare flows file, sorted by the flow names
+    flows = (df[['FlowName', 'FlowID', 'FlowNameSource']]
+             .drop_duplicates(ignore_index=True)
+             .sort_values(by='FlowName'))
     store_inventory(flows, 'RCRAInfo_' + report_year, 'flow')
 
     # Prepare facilities file
     facilities = df[['FacilityID', 'Handler Name', 'Location Street Number',
                      'Location Street 1', 'Location Street 2', 'Location City',
                      'Location State', 'Location Zip', 'County Name',
-                     'NAICS', 'Generator ID Included in NBR']].reset_index(drop=True)
-    facilities.drop_duplicates(inplace=True, ignore_index=True)
-    facilities['Address'] = facilities[['Location Street Number',
-                                        'Location Street 1',
-                                        'Location Street 2']].apply(
-                                            lambda x: ' '.join(x.dropna()),
-                                            axis=1)
-    facilities.drop(columns=['Location Street Number', 'Location Street 1',
-                             'Location Street 2'], inplace=True)
-    facilities.rename(columns={'Primary NAICS': 'NAICS',
-                               'Handler Name': 'FacilityName',
-                               'Location City': 'City',
-                               'Location State': 'State',
-                               'Location Zip': 'Zip',
-                               'County Name': 'County'}, inplace=True)
+                     'NAICS', 'Generator ID Included in NBR']]
+    facilities = facilities.drop_duplicates(ignore_index=True)
+    address_fields = ['Location Street Number', 'Location Street 1',
+                      'Location Street 2']
+    facilities = (facilities
+                  .assign(Address=join_fields(facilities, address_fields))
+                  .drop(columns=address_fields)
+                  .rename(columns={'Handler Name': 'FacilityName',
+                                   'Location City': 'City',
+                                   'Location State': 'State',
+                                   'Location Zip': 'Zip',
+                                   'County Name': 'County'}))
     store_inventory(facilities, 'RCRAInfo_' + report_year, 'facility')
     # Prepare flow by facility
     flowbyfacility = aggregate(df, ['FacilityID', 'FlowName', 'Source Code',
@@ -370,7 +459,14 @@ def generate_state_totals(year):
     update_validationsets_sources(validation_dict, date_acquired=True)
 
 
-def validate_state_totals(report_year, flowbyfacility):
+def validate_state_totals(report_year, flowbyfacility, write=True):
+    """Validate waste generated against state totals.
+
+    :param report_year: str
+    :param flowbyfacility: df of RCRAInfo flowbyfacility
+    :param write: bool, True to write the validation result to local dir
+    :return: df of validation result, or None if no reference exists
+    """
     log.info('validating data against state totals')
     file_path = DATA_PATH.joinpath(f'RCRAInfo_{report_year}_StateTotals.csv')
     if file_path.is_file():
@@ -386,11 +482,20 @@ def validate_state_totals(report_year, flowbyfacility):
                                                      'US_States_only'])
         validation_df = validate_inventory(flowbyfacility,
                                            totals, group_by=['State'])
-        write_validation_result('RCRAInfo', report_year, validation_df)
+        if write:
+            write_validation_result('RCRAInfo', report_year, validation_df)
+        return validation_df
     else:
         log.warning(f'validation file for RCRAInfo_{report_year} does not exist.')
 
 
+def validate_stored_inventory(report_year):
+    """Validate the stored RCRAInfo flowbyfacility against state totals."""
+    flowbyfacility = read_stored_inventory('RCRAInfo', report_year,
+                                           StewiFormat.FLOWBYFACILITY)
+    return validate_state_totals(str(report_year), flowbyfacility, write=False)
+
+
 def main(**kwargs):
 
     parser = argparse.ArgumentParser(argument_default = argparse.SUPPRESS)
@@ -420,6 +525,7 @@ def main(**kwargs):
     if len(kwargs) == 0:
         kwargs = vars(parser.parse_args())
 
+    organize_years = []
     for year in kwargs['Year']:
         if int(year) % 2 == 0:
             raise stewi.exceptions.InventoryNotAvailableError(
@@ -438,7 +544,8 @@ def main(**kwargs):
             download_and_extract_zip(tables)
 
         elif kwargs['Option'] == 'B':
-            organize_br_reporting_files_by_year(kwargs['Tables'], year)
+            # files for all years are organized together
+            organize_years.append(year)
 
         elif kwargs['Option'] == 'C':
             Generate_RCRAInfo_files_csv(year)
@@ -449,6 +556,9 @@ def main(**kwargs):
             available"""
             generate_state_totals(year)
 
+    if organize_years:
+        organize_br_reporting_files(kwargs['Tables'], organize_years)
+
 
 if __name__ == '__main__':
     main(Option='A', Year=[2021])
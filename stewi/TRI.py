@@ -12,6 +12,8 @@ Option:
     (this is expected to be download before and to be organized as it is
     described in TRI.py).
     C - for generating StEWI output files and validation from downloaded data
+    D - for generating StEWI output files and validation for multiple years
+    in a single batch
 Files:
     1a - Releases and Other Waste Mgmt
     3a - Off Site Transfers
@@ -23,21 +25,29 @@ Year:
 
 """
 
+import itertools
 import zipfile
+from functools import lru_cache
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import time
 import io
 import argparse
-import re
 
 from esupy.processed_data_mgmt import read_source_metadata
 from esupy.remote import url_is_alive, make_url_request
 from stewi.globals import unit_convert, DATA_PATH, set_stewi_meta,\
     get_reliability_table_for_source, write_metadata,\
     lb_kg, g_kg, config, store_inventory, log, paths, compile_source_metadata,\
-    aggregate, assign_secondary_context, concat_compartment
+    aggregate, assign_secondary_context, concat_compartment,\
+    read_stored_inventory, geography_vintage
 from stewi.validate import update_validationsets_sources, validate_inventory,\
     write_validation_result
+from stewi.formats import StewiFormat
 import stewi.exceptions
 
 
@@ -48,28 +58,135 @@ TRI_DATA_PATH = DATA_PATH / 'TRI'
 
 
 def extract_TRI_data_files(link_zip, files, year):
+    """Download the TRI zip file and save the requested files as parquet."""
     r_file = make_url_request(link_zip)
-    for file in files:
-        df_columns = pd.read_csv(TRI_DATA_PATH
-                                 .joinpath(f'TRI_File_{file}_columns.txt'),
-                                 header=0)
-        columns = list(df_columns['Names'])
-        filename = f'US_{file}_{year}'
-        dic = {}
-        i = 0
-        with zipfile.ZipFile(io.BytesIO(r_file.content)) as z:
-            with io.TextIOWrapper(z.open(filename + '.txt', mode='r'),
-                                  errors='replace') as txtfile:
-                for line in txtfile:
-                    dic[i] = pd.Series(re.split("\t", line)).truncate(after=len(columns)-1)
-                    i+=1
-        # remove the first row in the dictionary which is the original headers
-        del dic[0]
-        df = pd.DataFrame.from_dict(dic, orient='index')
-        df.columns = columns
-        OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
-        df.to_csv(OUTPUT_PATH.joinpath(f'{filename}.csv'), index=False)
-        log.info(f'{filename}.csv saved to {OUTPUT_PATH}')
+    OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(io.BytesIO(r_file.content)) as z:
+        for file in files:
+            filename = f'US_{file}_{year}'
+            write_TRI_file(z, f'{filename}.txt', file,
+                           OUTPUT_PATH.joinpath(f'{filename}.parquet'))
+            log.info(f'{filename}.parquet saved to {OUTPUT_PATH}')
+
+
+class _ChunkStream(io.RawIOBase):
+    """Read-only binary stream over an iterable of bytes chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b''
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def fit_field_counts(lines, n_fields, counts, chunk_size=1 << 20):
+    """Yield chunks of tab delimited lines, each with n_fields fields.
+
+    As when TRI files were parsed line by line, fields beyond n_fields are
+    dropped and missing fields are left empty. Invalid utf-8 is replaced.
+
+    :param lines: iterable of bytes lines
+    :param counts: dict in which the number of lines fitted is recorded
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        if line.count(b'\t') != n_fields - 1:
+            fields = line.rstrip(b'\r\n').split(b'\t')[:n_fields]
+            fields += [b''] * (n_fields - len(fields))
+            line = b'\t'.join(fields) + b'\n'
+            counts['fitted'] = counts.get('fitted', 0) + 1
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield b''.join(chunk).decode('utf-8', errors='replace').encode()
+            chunk = []
+            size = 0
+    if chunk:
+        yield b''.join(chunk).decode('utf-8', errors='replace').encode()
+
+
+def write_TRI_file(z, member, file, filepath):
+    """Stream a tab delimited TRI file from an open zip file to parquet.
+
+    Columns are named from TRI_File_{file}_columns.txt and, if the file
+    contains any required fields, only those fields are retained. Amount
+    fields of each release type and coordinates are stored as floats, all
+    others as strings.
+    """
+    columns = list(pd.read_csv(TRI_DATA_PATH
+                               .joinpath(f'TRI_File_{file}_columns.txt'),
+                               header=0)['Names'])
+    tri_required_fields = imp_fields(TRI_DATA_PATH.joinpath('TRI_required_fields.txt'))
+    keep = [c for c in columns if c in tri_required_fields] or columns
+    import_dict = load_TRI_reference()[0]
+    # the amount field follows the four identifying fields of a release type
+    float_fields = [v[4] for v in import_dict.values()] + ['LATITUDE',
+                                                           'LONGITUDE']
+    schema = pa.schema([(c, pa.float64() if c in float_fields else pa.string())
+                        for c in keep])
+    counts = {}
+
+    with z.open(member) as f:
+        n_fields = f.readline().count(b'\t') + 1
+        # fields beyond those in the columns file are not retained
+        names = columns + [f'UNNAMED {i}' for i in range(len(columns), n_fields)]
+        stream = io.BufferedReader(_ChunkStream(
+            fit_field_counts(f, n_fields, counts)))
+        reader = pacsv.open_csv(
+            stream,
+            read_options=pacsv.ReadOptions(column_names=names[:n_fields]),
+            parse_options=pacsv.ParseOptions(delimiter='\t', quote_char=False),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=keep,
+                include_missing_columns=True,
+                column_types={c: pa.string() for c in keep},
+                strings_can_be_null=True))
+        with pq.ParquetWriter(filepath, schema) as writer:
+            for batch in reader:
+                arrays = [to_float(batch[c]) if c in float_fields
+                          else batch[c] for c in keep]
+                writer.write_batch(pa.record_batch(arrays, schema=schema))
+    if counts:
+        log.warning(f'{counts["fitted"]} rows with an unexpected number of '
+                    f'fields truncated or padded in {member}')
+
+
+def to_float(array):
+    """Cast an arrow string array to float, with blank strings as null."""
+    array = pc.utf8_trim_whitespace(array)
+    array = pc.if_else(pc.equal(array, ''), pa.scalar(None, pa.string()),
+                       array)
+    return pc.cast(array, pa.float64())
+
+
+def read_TRI_file(file, year, columns, dtype=None):
+    """Return the selected columns of an extracted TRI file, in file order.
+
+    Files extracted by earlier versions as csv are read if no parquet file
+    is found.
+    """
+    filepath = OUTPUT_PATH.joinpath(f'US_{file}_{year}.parquet')
+    if filepath.is_file():
+        columns = [c for c in pq.read_schema(filepath).names if c in columns]
+        df = pd.read_parquet(filepath, columns=columns)
+        # string fields are already stored as strings
+        return df.astype({k: v for k, v in (dtype or {}).items()
+                          if v not in ('str', str)})
+    return pd.read_csv(OUTPUT_PATH.joinpath(f'US_{file}_{year}.csv'),
+                       usecols=columns, low_memory=False, dtype=dtype)
 
 
 def generate_national_totals(year):
@@ -155,49 +272,98 @@ def concat_req_field(list):
     return source_name
 
 
-# Cycle through file importing by release type, the dictionary key
-def import_TRI_by_release_type(d, year):
-    # Import TRI file
-    tri_release_output_fieldnames = ['FacilityID', 'CAS', 'FlowName',
-                                     'Unit', 'FlowAmount', 'Basis of Estimate',
-                                     'ReleaseType']
-    df_list = []
+def release_type_file(release_type):
+    """Return the TRI file that contains a release type."""
+    if release_type == 'offsiteland' or release_type == 'offsiteother':
+        return '3a'
+    return '1a'
+
+
+def read_TRI_files(d, year, facility_fields=None):
+    """Read each TRI file once with the fields needed for all release types.
+
+    :param d: dictionary of release types and their fields
+    :param year: str
+    :param facility_fields: optional dictionary of additional fields and
+        dtypes to read from file 1a
+    :return: dictionary of file and DataFrame for each file found
+    """
+    fields = {}
     for k, v in d.items():
-        dtype_dict = {'TRIFID': "str",
-                      'CHEMICAL NAME': "str",
-                      'CAS NUMBER': "str",
-                      'UNIT OF MEASURE': "str",
-                      }
+        dtype_dict = fields.setdefault(release_type_file(k), {})
+        dtype_dict.update({'TRIFID': "str",
+                           'CHEMICAL NAME': "str",
+                           'CAS NUMBER': "str",
+                           'UNIT OF MEASURE': "str",
+                           })
         dtype_dict[v[4]] = "float64" # FlowAmount field
         if len(v) > 5:
             dtype_dict[v[5]] = "str" # Basis of Estimate field
-        if k == 'offsiteland' or k == 'offsiteother':
-            file = '3a'
-        else:
-            file = '1a'
-        tri_csv = OUTPUT_PATH.joinpath(f'US_{file}_{year}.csv')
+    if facility_fields:
+        fields.setdefault('1a', {}).update(facility_fields)
+    tri_files = {}
+    for file, dtype_dict in fields.items():
         try:
-            tri_part = pd.read_csv(tri_csv, usecols=v,
-                                   low_memory=False,
-                                   dtype=dtype_dict)
-            tri_part['ReleaseType'] = k
-            tri_part.columns = tri_release_output_fieldnames
-            tri_part = (
-                tri_part
-                .dropna(subset=['FlowAmount'])
-                .assign(**{"Basis of Estimate": lambda x: 
-                           x['Basis of Estimate'].str.strip()})
-                .query('FlowAmount != 0')
-            )
-            df_list.append(tri_part)
+            tri_files[file] = read_TRI_file(file, year, list(dtype_dict),
+                                            dtype_dict)
         except FileNotFoundError:
-            log.error(f'{file}.csv file not found in {tri_csv}')
+            log.error(f'US_{file}_{year} file not found in {OUTPUT_PATH}')
+    return tri_files
+
+
+def reshape_release_types(df, d):
+    """Reshape the amount and basis of estimate fields of several release
+    types from a TRI file to one record per release type, ordered by release
+    type, excluding missing and zero amounts."""
+    n = len(df)
+    amounts = np.column_stack([df[v[4]].to_numpy(dtype='float64')
+                               for v in d.values()]).ravel(order='F')
+    basis = np.column_stack([df[v[5]].to_numpy(dtype=object) if len(v) > 5
+                             else np.full(n, np.nan, dtype=object)
+                             for v in d.values()]).ravel(order='F')
+    idx = np.flatnonzero(~np.isnan(amounts) & (amounts != 0))
+    rows = idx % n
+    tri_part = pd.DataFrame(
+        {'FacilityID': df['TRIFID'].to_numpy(dtype=object)[rows],
+         'CAS': df['CAS NUMBER'].to_numpy(dtype=object)[rows],
+         'FlowName': df['CHEMICAL NAME'].to_numpy(dtype=object)[rows],
+         'Unit': df['UNIT OF MEASURE'].to_numpy(dtype=object)[rows],
+         'FlowAmount': amounts[idx],
+         'Basis of Estimate': pd.Series(basis[idx], dtype=object).str.strip(),
+         'ReleaseType': np.array(list(d), dtype=object)[idx // n],
+         })
+    return tri_part
+
+
+def import_TRI_by_release_type(d, year, tri_files=None):
+    """Return TRI amounts by release type.
+
+    :param d: dictionary of release types and their fields
+    :param year: str
+    :param tri_files: optional dictionary of file and DataFrame as returned
+        by read_TRI_files
+    """
+    if tri_files is None:
+        tri_files = read_TRI_files(d, year)
+    df_list = []
+    # release types are grouped by file, preserving their order
+    for file, items in itertools.groupby(d.items(),
+                                         key=lambda x: release_type_file(x[0])):
+        if file in tri_files:
+            df_list.append(reshape_release_types(tri_files[file], dict(items)))
     if len(df_list) == 0:
         raise stewi.exceptions.DataNotFoundError
     return pd.concat(df_list, ignore_index=True)
 
 
-def validate_national_totals(inv, TRIyear):
+def validate_national_totals(inv, TRIyear, write=True):
+    """Validate against national flow totals by CAS and compartment.
+
+    :param inv: df of TRI inventory including CAS
+    :param TRIyear: str
+    :param write: bool, True to write the validation result to local dir
+    :return: df of validation result, or None if no reference exists
+    """
     log.info('validating data against national totals')
     filename = DATA_PATH.joinpath(f'TRI_{TRIyear}_NationalTotals.csv')
     if filename.is_file():
@@ -221,17 +387,49 @@ def validate_national_totals(inv, TRIyear):
                 on='CAS', how='left', validate='m:1')
             col = validation_result.pop('FlowName').fillna('')
             validation_result.insert(0, 'FlowName', col)
-            write_validation_result('TRI', TRIyear, validation_result)
+            if write:
+                write_validation_result('TRI', TRIyear, validation_result)
+            return validation_result
     else:
         log.warning(f'validation file for TRI_{TRIyear} does not exist. '
                     'Please run option B')
 
 
-def generate_TRI_files_csv(TRIyear):
-    """
-    Generate TRI inventories from downloaded files.
+def validate_stored_inventory(TRIyear):
+    """Validate the stored TRI flowbyfacility against national totals.
+
     :param TRIyear: str
+    :return: df of validation result
     """
+    fbf = read_stored_inventory('TRI', TRIyear,
+                                StewiFormat.FLOWBYFACILITY)
+    flows = read_stored_inventory('TRI', TRIyear, StewiFormat.FLOW)
+    # CAS is not retained in flowbyfacility
+    inv = fbf.merge(flows[['FlowName', 'CAS']]
+                    .drop_duplicates(subset='FlowName'),
+                    on='FlowName', how='left')
+    return validate_national_totals(inv, TRIyear, write=False)
+
+
+TRI_facility_name_crosswalk = {
+    'TRIFID': ['FacilityID', 'str'],
+    'FACILITY NAME': ['FacilityName', 'str'],
+    'FACILITY STREET': ['Address', 'str'],
+    'FACILITY CITY': ['City', 'str'],
+    'FACILITY COUNTY': ['County', 'str'],
+    'FACILITY STATE': ['State', 'str'],
+    'FACILITY ZIP CODE': ['Zip', 'str'],
+    'PRIMARY NAICS CODE': ['NAICS', 'str'],
+    'LATITUDE': ['Latitude', 'float64'],
+    'LONGITUDE': ['Longitude', 'float64'],
+    }
+
+
+@lru_cache(maxsize=None)
+def load_TRI_reference():
+    """Return reference data used for all years: the dictionary of required
+    fields for each release type, the reliability table, and the compartment
+    for each release type. Returned objects must not be modified."""
     tri_required_fields = imp_fields(TRI_DATA_PATH.joinpath('TRI_required_fields.txt'))
     keys = imp_fields(TRI_DATA_PATH.joinpath('TRI_keys.txt'))
     values = list()
@@ -241,18 +439,33 @@ def generate_TRI_files_csv(TRIyear):
         values.append(concat_req_field(tri_required_fields[start: end + 1]))
     # Create dict of required fields on import for each release type
     import_dict = dict(zip(keys, values))
+    reliability_table = get_reliability_table_for_source('TRI')
+    compartments = pd.read_csv(
+        TRI_DATA_PATH.joinpath('TRI_ReleaseType_to_Compartment.csv'))
+    return import_dict, reliability_table, compartments
+
+
+def parse_TRI_files(TRIyear):
+    """Return TRI releases and facilities for a year from downloaded files,
+    prior to the assignment of secondary contexts.
+
+    :param TRIyear: str
+    """
+    import_dict, reliability_table, compartments = load_TRI_reference()
+    # Read each file once for all release types and facility data
+    tri_files = read_TRI_files(import_dict, TRIyear,
+                               facility_fields={k: v[1] for k, v in
+                                                TRI_facility_name_crosswalk.items()})
     # Build the TRI DataFrame
-    tri = import_TRI_by_release_type(import_dict, TRIyear)
+    tri = import_TRI_by_release_type(import_dict, TRIyear, tri_files)
     # Import reliability scores for TRI
-    tri = (pd.merge(tri, get_reliability_table_for_source('TRI'),
+    tri = (pd.merge(tri, reliability_table,
                     left_on='Basis of Estimate',
                     right_on='Code', how='left')
              .drop(columns=['Basis of Estimate', 'Code']))
     tri['DQI Reliability Score'] = tri['DQI Reliability Score'].fillna(value=5)
     # Replace source info with Context
-    tri = pd.merge(tri, pd.read_csv(
-        TRI_DATA_PATH.joinpath('TRI_ReleaseType_to_Compartment.csv')),
-                   how='left')
+    tri = pd.merge(tri, compartments, how='left')
     # Convert units to ref mass unit of kg
     tri['Amount_kg'] = 0.0
     tri = unit_convert(tri, 'Amount_kg', 'Unit', 'Pounds', lb_kg, 'FlowAmount')
@@ -262,31 +475,26 @@ def generate_TRI_files_csv(TRIyear):
                                'DQI Reliability Score': 'DataReliability'}))
 
     # FACILITY - import and handle TRI facility data
-    TRI_facility_name_crosswalk = {
-        'TRIFID': ['FacilityID', 'str'],
-        'FACILITY NAME': ['FacilityName', 'str'],
-        'FACILITY STREET': ['Address', 'str'],
-        'FACILITY CITY': ['City', 'str'],
-        'FACILITY COUNTY': ['County', 'str'],
-        'FACILITY STATE': ['State', 'str'],
-        'FACILITY ZIP CODE': ['Zip', 'str'],
-        'PRIMARY NAICS CODE': ['NAICS', 'str'],
-        'LATITUDE': ['Latitude', 'float64'],
-        'LONGITUDE': ['Longitude', 'float64'],
-        }
-    tri_facility = (pd.read_csv(OUTPUT_PATH.joinpath(f'US_1a_{TRIyear}.csv'),
-                                usecols=TRI_facility_name_crosswalk.keys(),
-                                low_memory=False,
-                                dtype={k:v[1] for k, v in 
-                                       TRI_facility_name_crosswalk.items()})
-                      .drop_duplicates(ignore_index=True)
-                      .rename(columns={k:v[0] for k, v in 
-                                       TRI_facility_name_crosswalk.items()})
-                      )
-    tri_facility, parameters = assign_secondary_context(
-        tri_facility, int(TRIyear), 'urb')
-    store_inventory(tri_facility, f'TRI_{TRIyear}', 'facility')
-
+    if '1a' not in tri_files:
+        raise stewi.exceptions.DataNotFoundError
+    tri_1a = tri_files.pop('1a')
+    tri_facility = (tri_1a[[c for c in tri_1a
+                            if c in TRI_facility_name_crosswalk]]
+                    .drop_duplicates(ignore_index=True)
+                    .rename(columns={k:v[0] for k, v in
+                                     TRI_facility_name_crosswalk.items()})
+                    )
+    return tri, tri_facility
+
+
+def compile_TRI_outputs(tri, tri_facility, parameters, TRIyear):
+    """Return the TRI outputs by format and the validation result for a year.
+
+    :param tri: df of releases from parse_TRI_files
+    :param tri_facility: df of facilities with secondary contexts assigned
+    :param parameters: list of secondary context parameters assigned
+    :param TRIyear: str
+    """
     if 'urban_rural' in parameters:  # given urban/rural assignment success
         # merge & concat urban/rural into tri.Compartment before aggregation
         tri = tri.merge(tri_facility[['FacilityID', 'UrbanRural']].drop_duplicates(),
@@ -294,25 +502,86 @@ def generate_TRI_files_csv(TRIyear):
         tri = concat_compartment(tri)
 
     tri = aggregate(tri, ['FacilityID', 'FlowName', 'CAS', 'Compartment'])
-    validate_national_totals(tri, TRIyear)
+    validation_result = validate_national_totals(tri, TRIyear, write=False)
 
     # FLOWS
     flows = (tri[['FlowName', 'CAS', 'Compartment']]
                 .drop_duplicates()
                 .reset_index(drop=True)
                 .assign(FlowID=lambda x: x['CAS']))
-    store_inventory(flows, f'TRI_{TRIyear}', 'flow')
 
     # FLOW BY FACILITY
     fbf = tri.drop(columns=['CAS'])
-    store_inventory(fbf, f'TRI_{TRIyear}', 'flowbyfacility')
+    outputs = {'facility': tri_facility,
+               'flow': flows,
+               'flowbyfacility': fbf}
+    return outputs, validation_result
+
+
+def store_TRI_outputs(outputs, validation_result, TRIyear):
+    """Store TRI outputs and validation result for a year."""
+    for f, df in outputs.items():
+        store_inventory(df, f'TRI_{TRIyear}', f)
+    if validation_result is not None:
+        write_validation_result('TRI', TRIyear, validation_result)
+
+
+def generate_TRI_files_csv(TRIyear):
+    """
+    Generate TRI inventories from downloaded files.
+    :param TRIyear: str
+    """
+    tri, tri_facility = parse_TRI_files(TRIyear)
+    tri_facility, parameters = assign_secondary_context(
+        tri_facility, int(TRIyear), 'urb')
+    outputs, validation_result = compile_TRI_outputs(tri, tri_facility,
+                                                     parameters, TRIyear)
+    store_TRI_outputs(outputs, validation_result, TRIyear)
     return parameters
 
 
+def generate_TRI_files_batch(years):
+    """
+    Generate TRI inventories for several years from downloaded files.
+
+    Reference data are loaded once, and urban/rural contexts are assigned
+    once for each unique facility location among years of the same
+    geography vintage. Outputs for all years are stored once all years are
+    generated.
+    :param years: list of years
+    :return: dictionary of year and secondary context parameters
+    """
+    years = sorted(str(y) for y in years)
+    results = {}
+    for vintage, group in itertools.groupby(years, key=geography_vintage):
+        group = list(group)
+        log.info(f'generating TRI inventories for {", ".join(group)}')
+        parsed = {year: parse_TRI_files(year) for year in group}
+        locations = (pd.concat([tri_facility[['Latitude', 'Longitude']]
+                                for _, tri_facility in parsed.values()])
+                     .drop_duplicates(ignore_index=True))
+        locations, parameters = assign_secondary_context(
+            locations, int(group[0]), 'urb')
+        if 'urban_rural' in parameters:
+            locations = (locations[['Latitude', 'Longitude', 'UrbanRural']]
+                         .drop_duplicates(subset=['Latitude', 'Longitude']))
+        for year in group:
+            tri, tri_facility = parsed.pop(year)
+            if 'urban_rural' in parameters:
+                tri_facility = tri_facility.merge(
+                    locations, how='left', on=['Latitude', 'Longitude'])
+            results[year] = (compile_TRI_outputs(tri, tri_facility,
+                                                 parameters, year),
+                             parameters)
+    for year, ((outputs, validation_result), _) in results.items():
+        store_TRI_outputs(outputs, validation_result, year)
+    return {year: parameters for year, (_, parameters) in results.items()}
+
+
 def generate_metadata(year, files, parameters=None, datatype='inventory'):
     """Get metadata and writes to .json."""
     if datatype == 'source':
-        source_path = [str(OUTPUT_PATH.joinpath(f'US_{p}_{year}.csv')) for p in files]
+        source_path = [str(OUTPUT_PATH.joinpath(f'US_{p}_{year}.parquet')) for p in files]
         source_meta = compile_source_metadata(source_path, _config, year)
         source_meta['SourceType'] = 'Zip file'
         tri_version = 'last'
@@ -336,7 +605,9 @@ def main(**kwargs):
                         [A] Download and TRI flat files from TRI Data Plus.\
                         [B] Format national totals for TRI from download \
                         national files.\
-                        [C] Generate StEWI inventory files from downloaded files',
+                        [C] Generate StEWI inventory files from downloaded files\
+                        [D] Generate StEWI inventory files for all years in \
+                        one batch from downloaded files',
                         type = str)
 
     parser.add_argument('-Y', '--Year', nargs = '+',
@@ -356,6 +627,12 @@ def main(**kwargs):
 
     files = kwargs.get('Files', ['1a', '3a'])
 
+    if kwargs['Option'] == 'D':
+        parameters = generate_TRI_files_batch(kwargs['Year'])
+        for year, p in parameters.items():
+            generate_metadata(year, files, p, datatype='inventory')
+        return
+
     for year in kwargs['Year']:
         year = str(year)
         if kwargs['Option'] == 'A':
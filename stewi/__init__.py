@@ -13,7 +13,8 @@ from stewi.globals import log, add_missing_fields,\
     set_stewi_meta, aggregate
 from stewi.globals import STEWI_DATA_VINTAGES
 from stewi.globals import linear_search
-from stewi.filter import apply_filters_to_inventory, filter_config
+from stewi.filter import apply_filters_to_inventory, filter_config,\
+    read_filtered_inventory
 from stewi.formats import StewiFormat, ensure_format
 
 
@@ -111,16 +112,8 @@ def getInventory(inventory_acronym, year, stewiformat='flowbyfacility',
     :return: dataframe with standard fields depending on output format
     """
     f = ensure_format(stewiformat)
-    inventory = read_inventory(inventory_acronym, year, f,
-                               download_if_missing)
-
-    if (not keep_sec_cntx) and ('Compartment' in inventory):
-        inventory['Compartment'] = (inventory['Compartment']
-                                    .str.partition('/')[0])
-        inventory = aggregate(inventory)
-
-    if not filters:
-        filters = []
+    # copy so that the caller's list is not modified
+    filters = list(filters) if filters else []
     if f.value > 2:  # exclude FLOW and FACILITY
         # for backwards compatability, maintain these optional parameters in getInventory
         if filter_for_LCI:
@@ -136,8 +129,25 @@ def getInventory(inventory_acronym, year, stewiformat='flowbyfacility',
             if 'US_States_only' not in filters:
                 filters.append('US_States_only')
 
-        inventory = apply_filters_to_inventory(inventory, inventory_acronym, year,
-                                               filters, download_if_missing)
+    # serve a stored filtered inventory if one exists for these filters
+    inventory = None
+    if f.value > 2 and filters:
+        inventory = read_filtered_inventory(inventory_acronym, year, filters, f)
+    filtered = inventory is not None
+    if not filtered:
+        inventory = read_inventory(inventory_acronym, year, f,
+                                   download_if_missing)
+
+    if (not keep_sec_cntx) and ('Compartment' in inventory):
+        inventory['Compartment'] = (inventory['Compartment']
+                                    .str.partition('/')[0])
+        inventory = aggregate(inventory)
+
+    if f.value > 2:
+        if not filtered:
+            inventory = apply_filters_to_inventory(inventory, inventory_acronym,
+                                                   year, filters,
+                                                   download_if_missing)
         # After filting, may be necessary to reaggregate inventory again
         inventory = aggregate(inventory)
 
@@ -0,0 +1,54 @@
+# __main__.py (stewi)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Command line interface for stewi, e.g.
+    stewi validate --all
+    stewi validate -I TRI NEI -Y 2019 2020
+"""
+
+import argparse
+
+from stewi.globals import log
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='stewi')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    validate = subparsers.add_parser(
+        'validate', help='Validate stored inventories against reference '
+        'totals and write a single report to the validation directory')
+    validate.add_argument('--all', action='store_true',
+                          help='Validate all stored inventories and years')
+    validate.add_argument('-I', '--Inventory', nargs='+',
+                          help='Inventory acronyms to validate e.g. TRI')
+    validate.add_argument('-Y', '--Year', nargs='+',
+                          help='Years to validate, defaults to all stored '
+                          'years for each inventory')
+    validate.add_argument('-W', '--Workers', type=int, default=None,
+                          help='Maximum number of processes')
+
+    args = parser.parse_args(args)
+
+    if args.command == 'validate':
+        from stewi import getAvailableInventoriesandYears
+        from stewi.validate import validate_stored_inventories
+        if not (args.all or args.Inventory):
+            parser.error('validate requires --all or --Inventory')
+        stored = getAvailableInventoriesandYears() or {}
+        inventory_dict = {}
+        for inventory_acronym in (stored if args.all else args.Inventory):
+            years = stored.get(inventory_acronym, [])
+            if args.Year:
+                years = [y for y in years if y in args.Year]
+            if not years:
+                log.warning(f'no stored {inventory_acronym} inventories to '
+                            'validate')
+                continue
+            inventory_dict[inventory_acronym] = years
+        validate_stored_inventories(inventory_dict, max_workers=args.Workers)
+
+
+if __name__ == '__main__':
+    main()
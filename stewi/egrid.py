@@ -27,7 +27,7 @@ from esupy.processed_data_mgmt import read_source_metadata
 from stewi.globals import DATA_PATH, write_metadata,\
     unit_convert, log, MMBtu_MJ, MWh_MJ, config, USton_kg, lb_kg,\
     compile_source_metadata, remove_line_breaks, paths, store_inventory,\
-    set_stewi_meta, aggregate
+    set_stewi_meta, aggregate, read_stored_inventory, read_excel_cached
 from stewi.validate import update_validationsets_sources, validate_inventory,\
     write_validation_result
 from stewi.formats import StewiFormat
@@ -123,8 +123,8 @@ def extract_eGRID_excel(year, sheetname, index='field'):
     eGRIDfile = OUTPUT_PATH.joinpath(_config[year]['file_name'])
     if index != 'field': header = 1
     else: header = 0
-    df = pd.read_excel(eGRIDfile, sheet_name=sheetname + year[2:],
-                       header=header, engine='openpyxl')
+    df = read_excel_cached(eGRIDfile, sheet_name=sheetname + year[2:],
+                           header=header, engine='openpyxl')
     df = remove_line_breaks(df)
     if index == 'field':
         # drop first row which are column name abbreviations
@@ -276,11 +276,13 @@ def generate_eGRID_files(year):
     validate_eGRID(year, flowbyfac)
 
 
-def validate_eGRID(year, flowbyfac):
-    """Validate eGRID flowbyfacility data against national totals."""
-    validation_file = DATA_PATH.joinpath(f"eGRID_{year}_NationalTotals.csv")
-    if not validation_file.is_file():
-        generate_national_totals(year)
+def validate_eGRID(year, flowbyfac, write=True):
+    """Validate eGRID flowbyfacility data against national totals.
+
+    :param write: bool, True to write the validation result to local dir
+    :return: df of validation result
+    """
+    validation_file = build_validation_totals(year)
     log.info('validating data against national totals')
     egrid_national_totals = pd.read_csv(validation_file, header=0,
                                         dtype={"FlowAmount": float})
@@ -301,7 +303,27 @@ def validate_eGRID(year, flowbyfac):
     validation_result = validate_inventory(flowbyfac, egrid_national_totals,
                                            group_by=['FlowName', 'Compartment'],
                                            tolerance=5.0)
-    write_validation_result('eGRID', year, validation_result)
+    if write:
+        write_validation_result('eGRID', year, validation_result)
+    return validation_result
+
+
+def build_validation_totals(year):
+    """Generate the national totals for validation if they are not stored.
+
+    :return: path of the national totals file
+    """
+    validation_file = DATA_PATH.joinpath(f"eGRID_{year}_NationalTotals.csv")
+    if not validation_file.is_file():
+        generate_national_totals(year)
+    return validation_file
+
+
+def validate_stored_inventory(year):
+    """Validate the stored eGRID flowbyfacility against national totals."""
+    flowbyfac = read_stored_inventory('eGRID', year,
+                                      StewiFormat.FLOWBYFACILITY)
+    return validate_eGRID(year, flowbyfac, write=False)
 
 
 def generate_national_totals(year):
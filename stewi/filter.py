@@ -5,13 +5,75 @@
 Functions to support filtering of processed inventories
 """
 
+import hashlib
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
-from stewi.globals import DATA_PATH, config, read_inventory, log
-from stewi.formats import StewiFormat
+from esupy.processed_data_mgmt import load_preprocessed_output
+from stewi.globals import DATA_PATH, MODULEPATH, config, read_inventory,\
+    store_inventory, set_stewi_meta, paths, log,\
+    inventory_file_stamp
+from stewi.formats import StewiFormat, ensure_format
 
 filter_config = config(file='filter.yaml')
 
 
+class FilterPlan:
+    """A set of named filters compiled for a single inventory and year.
+
+    Facility attributes required by any of the filters are read at most once
+    and each filter is expressed as a row predicate, so that all filters are
+    combined into a single mask when the plan is applied.
+    """
+
+    def __init__(self, inventory_acronym, year, filters,
+                 download_if_missing=False):
+        self.inventory_acronym = inventory_acronym
+        self.year = year
+        self.filters = filters
+        self.download_if_missing = download_if_missing
+        self.facility_fields = []
+        self.predicates = []
+        self._facility = None
+
+    def add_predicate(self, message, predicate, facility_fields=None):
+        """Add a function returning a boolean mask of records to keep."""
+        self.predicates.append((message, predicate))
+        for field in facility_fields or []:
+            if field not in self.facility_fields:
+                self.facility_fields.append(field)
+
+    def facility(self):
+        """Return the facility attributes used by the plan, read once."""
+        if self._facility is None:
+            fac_list = read_inventory(self.inventory_acronym, self.year,
+                                      StewiFormat.FACILITY,
+                                      self.download_if_missing)
+            self._facility = fac_list[['FacilityID'] + self.facility_fields]
+        return self._facility
+
+    def apply(self, inventory):
+        """Apply the compiled filters to an inventory dataframe.
+
+        :param inventory: df of stewi inventory of type flowbyfacility or
+            flowbyprocess
+        :return: DataFrame of filtered inventory
+        """
+        missing = [f for f in self.facility_fields if f not in inventory]
+        if missing:
+            fac_list = (self.facility()[['FacilityID'] + missing]
+                        .drop_duplicates(ignore_index=True))
+            inventory = inventory.merge(fac_list, how='left', on='FacilityID')
+        if not self.predicates:
+            return inventory
+        mask = np.ones(len(inventory), dtype=bool)
+        for message, predicate in self.predicates:
+            log.info(message)
+            mask &= np.asarray(predicate(inventory), dtype=bool)
+        return inventory[mask]
+
+
 def apply_filters_to_inventory(inventory, inventory_acronym, year, filters,
                                download_if_missing=False):
     """Apply one or more filters from a passed list to an inventory dataframe.
@@ -24,48 +86,202 @@ def apply_filters_to_inventory(inventory, inventory_acronym, year, filters,
         remote server prior to generating if file not found locally
     :return: DataFrame of filtered inventory
     """
-    if 'filter_for_LCI' in filters:
-        for name in filter_config['filter_for_LCI']['filters']:
-            if name not in filters:
-                filters.append(name)
+    plan = compile_filter_plan(inventory_acronym, year, filters,
+                               download_if_missing)
+    return plan.apply(inventory)
+
+
+def expand_filters(filters):
+    """Return a new list of filters with any filter sets expanded."""
+    expanded = []
+    for name in filters:
+        names = [name]
+        if filter_config.get(name, {}).get('type') == 'set':
+            names += filter_config[name]['filters']
+        expanded.extend(n for n in names if n not in expanded)
+    return expanded
+
+
+def compile_filter_plan(inventory_acronym, year, filters,
+                        download_if_missing=False):
+    """Return the FilterPlan for a set of filters, memoized per inventory,
+    year and filter set, and recompiled when the stored facility inventory
+    changes.
+
+    :param inventory_acronym: str of inventory e.g. 'NEI'
+    :param year: year as number like 2010
+    :param filters: a list of named filters, the list is not modified
+    :param download_if_missing: bool, passed to read_inventory when facility
+        attributes are required
+    :return: FilterPlan
+    """
+    filters = expand_filters(filters)
     compare_to_available_filters(filters)
+    facility_stamp = inventory_file_stamp(inventory_acronym, year,
+                                          StewiFormat.FACILITY)
+    return _compile_filter_plan(inventory_acronym, str(year),
+                                frozenset(filters), download_if_missing,
+                                facility_stamp)
+
+
+@lru_cache(maxsize=32)
+def _compile_filter_plan(inventory_acronym, year, filters,
+                         download_if_missing, facility_stamp):
+    plan = FilterPlan(inventory_acronym, year, filters, download_if_missing)
 
     if 'US_States_only' in filters:
-        log.info('filtering for US states')
-        inventory = filter_states(inventory, inventory_acronym=inventory_acronym,
-                                  year=year,
-                                  download_if_missing=download_if_missing)
+        states_list = get_states_list()
+        plan.add_predicate('filtering for US states',
+                           lambda df: df['State'].isin(states_list),
+                           facility_fields=['State'])
 
     if inventory_acronym == 'DMR' and 'remove_duplicate_organic_enrichment' in filters:
-        from stewi.DMR import remove_duplicate_organic_enrichment
-        inventory = remove_duplicate_organic_enrichment(inventory)
+        from stewi.DMR import organic_enrichment_mask
+        plan.add_predicate('removing duplicate organic enrichment flows',
+                           organic_enrichment_mask)
 
     if inventory_acronym == 'RCRAInfo' and 'National_Biennial_Report' in filters:
-        log.info('filtering for National Biennial Report')
-        fac_list = read_inventory('RCRAInfo', year, StewiFormat.FACILITY,
-                                  download_if_missing)
-        fac_list = fac_list[['FacilityID',
-                             'Generator ID Included in NBR']
-                            ].drop_duplicates(ignore_index=True)
-        inventory = inventory.merge(fac_list, how='left')
-        inventory = inventory[inventory['Generator ID Included in NBR'] == 'Y']
-        inventory = inventory[inventory['Source Code'] != 'G61']
-        inventory = inventory[inventory['Generator Waste Stream Included in NBR'] == 'Y']
+        plan.add_predicate('filtering for National Biennial Report',
+                           lambda df: (
+                               (df['Generator ID Included in NBR'] == 'Y') &
+                               (df['Source Code'] != 'G61') &
+                               (df['Generator Waste Stream Included in NBR'] == 'Y')),
+                           facility_fields=['Generator ID Included in NBR'])
 
     if inventory_acronym == 'RCRAInfo' and 'imported_wastes' in filters:
-        log.info('removing imported wastes')
         imp_source_codes = filter_config['imported_wastes']['parameters']['source_codes']
-        inventory = inventory[~inventory['Source Code'].isin(imp_source_codes)]
+        plan.add_predicate('removing imported wastes',
+                           lambda df: ~df['Source Code'].isin(imp_source_codes))
 
     if 'flows_for_LCI' in filters:
         flow_filter_list = filter_config['flows_for_LCI']['parameters'].get(inventory_acronym)
         if flow_filter_list is not None:
-            log.info('removing flows not relevant for LCI')
-            inventory = inventory[~inventory['FlowName'].isin(flow_filter_list)]
+            plan.add_predicate('removing flows not relevant for LCI',
+                               lambda df: ~df['FlowName'].isin(flow_filter_list))
+
+    return plan
+
+
+def filter_set_hash(filters, source=()):
+    """Return a short hash identifying a set of filters.
+
+    The hash reflects the expanded filter names, the contents of
+    filter.yaml and the stored files of the source inventories so that
+    stored filtered inventories are not reused after a filter definition
+    changes or the inventory is written again.
+
+    :param filters: a list of named filters
+    :param source: tuple identifying the stored source inventories, see
+        inventory_file_stamp
+    """
+    h = hashlib.sha1()
+    h.update(','.join(sorted(expand_filters(filters))).encode('utf-8'))
+    h.update(MODULEPATH.joinpath('filter.yaml').read_bytes())
+    h.update(repr(source).encode('utf-8'))
+    return h.hexdigest()[:10]
+
+
+def filtered_inventory_meta(inventory_acronym, year, filters, f):
+    """Return the esupy FileMeta for a stored filtered inventory."""
+    f = ensure_format(f)
+    source = (inventory_file_stamp(inventory_acronym, year, f),
+              inventory_file_stamp(inventory_acronym, year,
+                                   StewiFormat.FACILITY))
+    return set_stewi_meta(f'{inventory_acronym}_{year}_'
+                          f'{filter_set_hash(filters, source)}',
+                          f'{f}/filtered')
+
+
+def store_filtered_inventory(inventory_acronym, year, filters,
+                             stewiformat='flowbyfacility',
+                             download_if_missing=False):
+    """Apply a set of filters to an inventory and store the result so that
+    getInventory can serve it without filtering at read time.
+
+    The filtered inventory retains secondary contexts and is stored as
+    returned by apply_filters_to_inventory, in a 'filtered' subdirectory
+    of the format directory.
+
+    :param inventory_acronym: str of inventory e.g. 'NEI'
+    :param year: year as number like 2010
+    :param filters: a list of named filters to apply to inventory
+    :param stewiformat: str e.g. 'flowbyfacility' or 'flowbyprocess'
+    :param download_if_missing: bool, if True will attempt to load from
+        remote server prior to generating if file not found locally
+    """
+    f = ensure_format(stewiformat)
+    if f.value < 3:
+        log.warning(f'filters do not apply to {f} format')
+        return
+    inventory = read_inventory(inventory_acronym, year, f,
+                               download_if_missing)
+    if inventory is None:
+        return
+    inventory = apply_filters_to_inventory(inventory, inventory_acronym, year,
+                                           filters, download_if_missing)
+    meta = filtered_inventory_meta(inventory_acronym, year, filters, f)
+    store_inventory(inventory, meta.name_data, meta.category)
+
+
+def remove_filtered_inventories(inventory_acronym, year):
+    """Delete the stored filtered inventories of an inventory and year.
+
+    Stored filtered inventories are not served once the inventory is
+    written again (see filtered_inventory_meta); removing them when an
+    inventory is patched in place avoids retaining stale files.
+
+    :param inventory_acronym: str of inventory e.g. 'NEI'
+    :param year: year as number like 2010
+    """
+    for f in [StewiFormat.FLOWBYFACILITY, StewiFormat.FLOWBYPROCESS]:
+        for file in f.path().joinpath('filtered').glob(
+                f'{inventory_acronym}_{year}_*'):
+            log.info(f'removing filtered inventory {file.name}')
+            file.unlink(missing_ok=True)
+
+
+def read_filtered_inventory(inventory_acronym, year, filters,
+                            stewiformat='flowbyfacility'):
+    """Return a stored filtered inventory, or None if one has not been
+    stored for this filter set, the current filter.yaml and the current
+    stored inventory.
 
+    :param inventory_acronym: str of inventory e.g. 'NEI'
+    :param year: year as number like 2010
+    :param filters: a list of named filters
+    :param stewiformat: str e.g. 'flowbyfacility' or 'flowbyprocess'
+    """
+    f = ensure_format(stewiformat)
+    meta = filtered_inventory_meta(inventory_acronym, year, filters, f)
+    inventory = load_preprocessed_output(meta, paths)
+    if inventory is not None:
+        log.info(f'loaded {meta.name_data} from '
+                 f'{paths.local_path / meta.category}')
+        fields = {key: value for key, value in f.field_types().items()
+                  if key in inventory}
+        inventory = inventory.astype(fields)
     return inventory
 
 
+def get_states_list(include_states=True, include_dc=True,
+                    include_territories=False):
+    """Return a list of 2 digit state codes.
+
+    :param include_states: bool, True to include the 50 U.S. states
+    :param include_dc: bool, True to include D.C.
+    :param include_territories: bool, True to include U.S. territories
+    """
+    states_df = pd.read_csv(DATA_PATH.joinpath('state_codes.csv'))
+    states_list = []
+    if include_states:
+        states_list += list(states_df['states'].dropna())
+    if include_dc:
+        states_list += list(states_df['dc'].dropna())
+    if include_territories:
+        states_list += list(states_df['territories'].dropna())
+    return states_list
+
+
 def filter_states(inventory_df, inventory_acronym=None, year=None,
                   include_states=True, include_dc=True, include_territories=False,
                   download_if_missing=False):
@@ -81,8 +297,6 @@ def filter_states(inventory_df, inventory_acronym=None, year=None,
         remote server prior to generating if file not found locally
     :return: DataFrame
     """
-    states_df = pd.read_csv(DATA_PATH.joinpath('state_codes.csv'))
-    states_list = []
     if 'State' not in inventory_df:
         if all(p is not None for p in [inventory_acronym, year]):
             fac_list = read_inventory(inventory_acronym, year, StewiFormat.FACILITY,
@@ -92,12 +306,8 @@ def filter_states(inventory_df, inventory_acronym=None, year=None,
         else:
             log.warning('states cannot be assessed, no data removed')
             return inventory_df
-    if include_states:
-        states_list += list(states_df['states'].dropna())
-    if include_dc:
-        states_list += list(states_df['dc'].dropna())
-    if include_territories:
-        states_list += list(states_df['territories'].dropna())
+    states_list = get_states_list(include_states, include_dc,
+                                  include_territories)
     output_inventory = inventory_df[inventory_df['State'].isin(states_list)]
     return output_inventory
 
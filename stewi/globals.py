@@ -5,16 +5,22 @@
 Supporting variables and functions used in stewi.
 """
 
+import hashlib
+import importlib.util
 import json
 import logging as log
 import os
+import re
 import time
 import copy
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import yaml
 
 from esupy.processed_data_mgmt import Paths, FileMeta,\
@@ -50,6 +56,17 @@ paths.local_path = paths.local_path / 'stewi'
 # global variable to replace stored inventory files when saving
 REPLACE_FILES = False
 
+# decimal places of Latitude and Longitude for cached urban/rural contexts
+COORDINATE_PRECISION = 5
+# facility, release point and process fields on which release height
+# secondary contexts are assigned, excluding per flow measures
+RELEASE_HEIGHT_FIELDS = ['FacilityID', 'Process', 'UnitID', 'UnitType',
+                         'StackHeight', 'Compartment']
+
+# modules required by pandas Excel engines that are not stewi requirements
+EXCEL_ENGINE_MODULES = {'calamine': 'python_calamine', 'pyxlsb': 'pyxlsb',
+                        'odf': 'odf', 'xlrd': 'xlrd'}
+
 GIT_HASH_LONG = os.environ.get('GITHUB_SHA') or get_git_hash('long')
 if GIT_HASH_LONG:
     GIT_HASH = GIT_HASH_LONG[0:7]
@@ -124,6 +141,116 @@ def aggregate(df, grouping_vars=None):
     return df_agg
 
 
+def aggregate_rollup(df, grouping_vars, rollups):
+    """Aggregate as in aggregate() by grouping_vars and by each list of
+    grouping vars in rollups, scanning df once.
+
+    Keys are factorized and FlowAmount and the FlowAmount weighted
+    DataReliability are summed at the level of grouping_vars. Each rollup,
+    which must be a subset of grouping_vars, is then summed from those groups.
+
+    :param df: dataframe to aggregate
+    :param grouping_vars: list of df column headers on which to groupby
+    :param rollups: list of lists of column headers in grouping_vars
+    :return: list of aggregated dataframes for grouping_vars followed by
+        each rollup
+    """
+    amount = df['FlowAmount'].to_numpy(dtype='float64', copy=True)
+    reliability = df['DataReliability'].to_numpy(dtype='float64')
+    # sums as in esupy get_weighted_average, where nulls are skipped
+    np.nan_to_num(amount, copy=False, nan=0.0, posinf=np.inf, neginf=-np.inf)
+    weight = np.where(np.isnan(reliability), 0.0, amount)
+    weighted = np.nan_to_num(reliability * amount, nan=0.0, posinf=np.inf,
+                             neginf=-np.inf)
+
+    # factorize in sorted order, with null keys as a separate last code so
+    # that they are retained for rollups
+    codes = {}
+    uniques = {}
+    for col in grouping_vars:
+        c, uniques[col] = pd.factorize(df[col], sort=True)
+        c[c < 0] = len(uniques[col])
+        codes[col] = c.astype('int32') if len(uniques[col]) < 2**31 - 1 else c
+    first, inverse = _group_codes([codes[c] for c in grouping_vars])
+    sums = [np.bincount(inverse, weights=x, minlength=len(first))
+            for x in (amount, weighted, weight)]
+    del amount, weighted, weight, inverse
+    codes = {col: c[first] for col, c in codes.items()}
+
+    results = [_aggregated_frame(codes, uniques, grouping_vars, sums)]
+    for rollup in rollups:
+        r_first, r_inverse = _group_codes([codes[c] for c in rollup])
+        r_sums = [np.bincount(r_inverse, weights=x, minlength=len(r_first))
+                  for x in sums]
+        r_codes = {col: codes[col][r_first] for col in rollup}
+        results.append(_aggregated_frame(r_codes, uniques, rollup, r_sums))
+    return results
+
+
+def _group_codes(code_list):
+    """Return the index of the first record of each group and the group of
+    each record for combined codes, with groups sorted in order of the codes.
+    """
+    gid = np.zeros(len(code_list[0]), dtype='int64')
+    for c in code_list:
+        n = int(c.max()) + 1 if len(c) else 1
+        if gid.max(initial=0) > (np.iinfo('int64').max - n) // n:
+            # renumber to avoid overflow
+            gid = np.unique(gid, return_inverse=True)[1].reshape(-1)
+        gid *= n
+        gid += c
+    _, first, inverse = np.unique(gid, return_index=True, return_inverse=True)
+    return first, inverse.reshape(-1)
+
+
+def _aggregated_frame(codes, uniques, grouping_vars, sums):
+    """Return the aggregated dataframe of summed groups, excluding groups
+    with null keys as in aggregate()."""
+    amount, weighted, weight = sums
+    notnull = np.ones(len(amount), dtype=bool)
+    for col in grouping_vars:
+        notnull &= codes[col] < len(uniques[col])
+    # drop those rows where flow amount is negative, zero, or NaN
+    keep = notnull & (amount > 0)
+    df_agg = pd.DataFrame(
+        {col: uniques[col].take(codes[col][keep]) for col in grouping_vars},
+        index=(np.cumsum(notnull) - 1)[keep])
+    df_agg['FlowAmount'] = amount[keep]
+    # as in esupy get_weighted_average, groups without weight score zero
+    df_agg['DataReliability'] = np.divide(
+        weighted[keep], weight[keep], out=np.zeros(int(keep.sum())),
+        where=weight[keep] != 0)
+    return df_agg
+
+
+def retry_with_backoff(func, *args, attempts=3, backoff=2.0,
+                       exceptions=(OSError,), slots=None, **kwargs):
+    """Call func and return its result, retrying on failure with
+    exponentially increasing waits.
+
+    :param func: function to call with args and kwargs
+    :param attempts: int, maximum number of calls
+    :param backoff: float, seconds to wait before the first retry, doubled
+        for each subsequent retry
+    :param exceptions: tuple of exception types to retry on, by default
+        OSError which includes connection and http errors from requests
+    :param slots: optional semaphore held during each call, and released
+        while waiting to retry
+    """
+    for attempt in range(attempts):
+        try:
+            if slots is None:
+                return func(*args, **kwargs)
+            with slots:
+                return func(*args, **kwargs)
+        except exceptions as err:
+            if attempt == attempts - 1:
+                raise
+            wait = backoff * 2 ** attempt
+            log.warning(f'{err}; retrying in {wait:.0f} seconds')
+            time.sleep(wait)
+
+
 def linear_search(lst, target):
     """Backwards search a list for index less than or equal to a given value.
 
@@ -319,6 +446,41 @@ def read_inventory(inventory_acronym, year, f, download_if_missing=False):
     return inventory
 
 
+def read_stored_inventory(inventory_acronym, year, f):
+    """Return an inventory from local directory without downloading or
+    generating it.
+
+    :param inventory_acronym: like 'TRI'
+    :param year: year as number like 2010
+    :param f: object of class StewiFormat
+    :return: dataframe of stored inventory
+    :raises FileNotFoundError: if the inventory is not stored locally
+    """
+    meta = set_stewi_meta(f'{inventory_acronym}_{year}', str(f))
+    inventory = load_preprocessed_output(meta, paths)
+    if inventory is None:
+        raise FileNotFoundError(f'{meta.name_data} not found in '
+                                f'{paths.local_path / meta.category}')
+    fields = {key: value for key, value in f.field_types().items()
+              if key in inventory}
+    return inventory.astype(fields)
+
+
+def inventory_file_stamp(inventory_acronym, year, f):
+    """Return the name, size and modification time of each stored file of
+    an inventory, which changes whenever the inventory is written.
+
+    :param inventory_acronym: like 'TRI'
+    :param year: year as number like 2010
+    :param f: object of class StewiFormat
+    :return: tuple of (name, size, mtime) tuples, empty if not stored
+    """
+    files = sorted(paths.local_path.joinpath(str(f)).glob(
+        f'{inventory_acronym}_{year}_v*.{WRITE_FORMAT}'))
+    return tuple((file.name, file.stat().st_size, file.stat().st_mtime_ns)
+                 for file in files)
+
+
 def generate_inventory(inventory_acronym, year):
     """Generate inventory data by running the appropriate modules.
 
@@ -368,21 +530,35 @@ def get_reliability_table_for_source(source):
     return df
 
 
+def geography_vintage(year):
+    """Return the decennial census year of the geographic boundaries used to
+    assign secondary contexts (e.g., urban/rural) for a data year. Years of
+    the same vintage share secondary context assignments for a location."""
+    return int(year) // 10 * 10
+
+
 def assign_secondary_context(df, year, *args):
     """
     Wrapper for esupy.context_secondary.main(), which flexibly assigns
     urban/rural (pass 'urb' as positional arg) and/or release height ('rh')
     secondary compartments. Also choose whether to concatenate primary +
     secondary compartments by passing 'concat'.
+
+    Urban/rural assignments are cached by rounded location and geography
+    vintage (see assign_urban_rural), and release heights are assigned once
+    for each unique combination of RELEASE_HEIGHT_FIELDS.
     :param df: pd.DataFrame
     :param year: int, data year
     :param args: str, flag(s) for compartment assignment + skip_concat option
     """
-    from esupy import context_secondary as e_c_s
     parameters = []
-    df = e_c_s.main(df, year, *args)  # if e_c_s.has_geo_pkgs == False, returns unaltered df
+    if 'urb' in args:
+        df = assign_urban_rural(df, year)
+    if 'rh' in args:
+        df = assign_release_height(df, year)
     if 'cmpt_urb' in df.columns:  # rename before storage w/ facilities
         df = df.rename(columns={'cmpt_urb': 'UrbanRural'})
+    if 'UrbanRural' in df.columns:
         parameters.append('urban_rural')
     if 'cmpt_rh' in df.columns:
         parameters.append('release_height')
@@ -391,6 +567,253 @@ def assign_secondary_context(df, year, *args):
     return df, parameters
 
 
+def secondary_context_file(vintage):
+    """Return the path of the cached urban/rural assignments for a geography
+    vintage."""
+    return (paths.local_path / 'secondary_context' /
+            f'urban_rural_{vintage}.parquet')
+
+
+def read_urban_rural_cache(vintage):
+    """Return cached urban/rural assignments for a geography vintage, as a
+    df of rounded Latitude, Longitude and UrbanRural."""
+    file = secondary_context_file(vintage)
+    if file.exists():
+        return pd.read_parquet(file)
+    return pd.DataFrame({'Latitude': pd.Series(dtype='float64'),
+                         'Longitude': pd.Series(dtype='float64'),
+                         'UrbanRural': pd.Series(dtype='object')})
+
+
+def assign_urban_rural(df, year):
+    """Add an 'UrbanRural' column to a df with Latitude and Longitude.
+
+    Locations are rounded to COORDINATE_PRECISION decimals. Only unique
+    locations not yet cached for the geography vintage of the year are passed
+    to esupy.context_secondary, and their assignments are added to the cache.
+    :param df: pd.DataFrame
+    :param year: int, data year
+    """
+    from esupy import context_secondary as e_c_s
+    vintage = geography_vintage(year)
+    coords = pd.DataFrame(
+        {c: pd.to_numeric(df[c], errors='coerce').round(COORDINATE_PRECISION)
+         for c in ['Latitude', 'Longitude']})
+    locations = (coords.drop_duplicates(ignore_index=True)
+                 .merge(read_urban_rural_cache(vintage), how='left',
+                        on=['Latitude', 'Longitude'], indicator=True))
+    missing = locations['_merge'] == 'left_only'
+    locations = locations.drop(columns='_merge')
+    if missing.any():
+        log.info(f'assigning urban/rural context to {missing.sum()} '
+                 f'locations for {vintage} geography')
+        new = e_c_s.main(locations.loc[missing, ['Latitude', 'Longitude']]
+                         .reset_index(drop=True), year, 'urb')
+        if 'cmpt_urb' not in new.columns:
+            # if e_c_s.has_geo_pkgs == False, returns unaltered df
+            return df
+        new = (new[['Latitude', 'Longitude', 'cmpt_urb']]
+               .rename(columns={'cmpt_urb': 'UrbanRural'})
+               .drop_duplicates(subset=['Latitude', 'Longitude']))
+        store_urban_rural_cache(new, vintage)
+        locations = pd.concat([locations[~missing], new], ignore_index=True)
+    df = df.copy()
+    df['UrbanRural'] = coords.merge(locations, how='left',
+                                    on=['Latitude', 'Longitude']
+                                    )['UrbanRural'].to_numpy()
+    return df
+
+
+def store_urban_rural_cache(new, vintage):
+    """Add urban/rural assignments of located records to the cache."""
+    new = new.dropna(subset=['Latitude', 'Longitude'])
+    if new.empty:
+        return
+    file = secondary_context_file(vintage)
+    file.parent.mkdir(parents=True, exist_ok=True)
+    cache = pd.concat([read_urban_rural_cache(vintage), new],
+                      ignore_index=True)
+    cache = cache.drop_duplicates(subset=['Latitude', 'Longitude'],
+                                  keep='last', ignore_index=True)
+    temp = file.with_suffix(f'.{os.getpid()}.tmp')
+    try:
+        cache.to_parquet(temp, index=False)
+        os.replace(temp, file)
+    except OSError as err:
+        log.warning(f'unable to write {file}: {err}')
+        temp.unlink(missing_ok=True)
+
+
+def assign_release_height(df, year):
+    """Add a 'cmpt_rh' column via esupy.context_secondary, evaluated once
+    for each unique combination of RELEASE_HEIGHT_FIELDS in df.
+
+    The first record of each combination is passed to esupy with all fields,
+    so fields of the facility that are not in the key are still available.
+    :param df: pd.DataFrame
+    :param year: int, data year
+    """
+    from esupy import context_secondary as e_c_s
+    fields = [f for f in RELEASE_HEIGHT_FIELDS if f in df.columns]
+    if not fields:
+        return e_c_s.main(df, year, 'rh')
+    codes = df.groupby(fields, sort=False, dropna=False).ngroup().to_numpy()
+    first = np.unique(codes, return_index=True)[1]
+    unique = e_c_s.main(df.iloc[first].reset_index(drop=True), year, 'rh')
+    if 'cmpt_rh' not in unique.columns:
+        return df
+    df = df.copy()
+    df['cmpt_rh'] = unique['cmpt_rh'].to_numpy()[codes]
+    return df
+
+
+@lru_cache(maxsize=None)
+def excel_engine():
+    """Return the Excel engine set as 'excel_engine' in config.yaml, or None
+    for the pandas default if it is not set or its module is not installed."""
+    engine = config().get('excel_engine')
+    module = EXCEL_ENGINE_MODULES.get(engine)
+    if module and importlib.util.find_spec(module) is None:
+        log.warning(f'{module} is not installed, Excel workbooks are parsed '
+                    f'with the pandas default rather than {engine}')
+        return None
+    return engine
+
+
+def read_excel_cached(filepath, sheet_name=0, **kwargs):
+    """Return pd.read_excel(filepath, sheet_name, **kwargs), parsing each
+    sheet once.
+
+    Parsed sheets are stored as parquet, keyed by the hash of the workbook,
+    the sheet name and the read options, and later reads come from the cache.
+    Workbooks are parsed with the engine set in config.yaml unless an engine
+    is passed, see excel_engine.
+    :param filepath: Path of .xlsx or .xls workbook
+    :param sheet_name: str, int, list or None as for pd.read_excel
+    """
+    filepath = Path(filepath)
+    kwargs.setdefault('engine', excel_engine())
+    cache_dir = (paths.local_path / 'excel_cache' /
+                 f'{filepath.stem}_{file_hash(filepath)[:16]}')
+    sheets = sheet_name if isinstance(sheet_name, list) else [sheet_name]
+    if sheet_name is None:
+        sheets = excel_sheet_names(filepath, cache_dir, kwargs['engine'])
+    names = {s: (excel_sheet_names(filepath, cache_dir, kwargs['engine'])[s]
+                 if isinstance(s, int) else s) for s in sheets}
+    options = json.dumps(kwargs, sort_keys=True, default=str)
+    files = {s: excel_sheet_file(cache_dir, name, options)
+             for s, name in names.items()}
+    missing = [names[s] for s in sheets if not files[s].is_file()]
+    parsed = {}
+    if missing:
+        log.info(f'parsing {", ".join(missing)} from {filepath.name}')
+        parsed = pd.read_excel(filepath, sheet_name=missing, **kwargs)
+        for s in sheets:
+            if names[s] in parsed:
+                store_excel_sheet(parsed[names[s]], files[s])
+    dfs = {s: (parsed[names[s]] if names[s] in parsed
+               else read_excel_sheet(files[s])) for s in sheets}
+    if sheet_name is None or isinstance(sheet_name, list):
+        return dfs
+    return dfs[sheet_name]
+
+
+def excel_sheet_file(cache_dir, name, options):
+    """Return the path of a cached sheet parsed with the json options."""
+    key = hashlib.sha1((name + options).encode()).hexdigest()[:10]
+    safe_name = re.sub(r'[^\w.-]', '_', name)
+    return cache_dir / f'{safe_name}_{key}.parquet'
+
+
+@lru_cache(maxsize=None)
+def _file_hash(filepath, size, mtime):
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_hash(filepath):
+    """Return the sha256 hash of a file, computed once per file version."""
+    stat = Path(filepath).stat()
+    return _file_hash(str(filepath), stat.st_size, stat.st_mtime_ns)
+
+
+def excel_sheet_names(filepath, cache_dir, engine=None):
+    """Return the sheet names of a workbook, stored in cache_dir."""
+    names_file = cache_dir / 'sheet_names.json'
+    if names_file.is_file():
+        return json.loads(names_file.read_text())
+    with pd.ExcelFile(filepath, engine=engine) as xl:
+        names = xl.sheet_names
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    names_file.write_text(json.dumps(names))
+    return names
+
+
+def _value_kind(value):
+    if pd.isna(value):
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return 'bool'
+    if isinstance(value, (int, np.integer)):
+        return 'int'
+    if isinstance(value, (float, np.floating)):
+        return 'float'
+    if isinstance(value, datetime):
+        return 'datetime'
+    return 'str'
+
+
+def store_excel_sheet(df, file):
+    """Store a parsed sheet as parquet. Object columns mixing value types,
+    such as numbers and 'confidential', are stored as strings with a column
+    recording the type of each value, listed in the file metadata."""
+    if (not all(isinstance(c, str) for c in df.columns)
+            or df.columns.duplicated().any()):
+        log.debug('sheet not cached, column names are not unique strings')
+        return
+    mixed = [c for c in df if df[c].dtype == object and
+             pd.api.types.infer_dtype(df[c]) not in ('string', 'empty')]
+    df = df.assign(**{c: df[c].astype(str).where(df[c].notna(), None)
+                      for c in mixed},
+                   **{f'__type__{c}': df[c].map(_value_kind) for c in mixed})
+    file.parent.mkdir(parents=True, exist_ok=True)
+    temp = file.with_suffix(f'.{os.getpid()}.tmp')
+    try:
+        table = pa.Table.from_pandas(df)
+        table = table.replace_schema_metadata({
+            **table.schema.metadata,
+            b'stewi_mixed_columns': json.dumps(mixed).encode()})
+        pq.write_table(table, temp)
+        os.replace(temp, file)
+    except (pa.ArrowException, OSError) as err:
+        log.warning(f'unable to cache sheet to {file}: {err}')
+        temp.unlink(missing_ok=True)
+
+
+def read_excel_sheet(file):
+    """Return a sheet stored by store_excel_sheet."""
+    table = pq.read_table(file)
+    mixed = json.loads(table.schema.metadata[b'stewi_mixed_columns'])
+    df = table.to_pandas()
+    # missing strings are read as None, parsed sheets hold NaN
+    strings = [c for c in df if df[c].dtype == object and c not in mixed]
+    df[strings] = df[strings].fillna(np.nan)
+    for c in mixed:
+        kinds = df.pop(f'__type__{c}').to_numpy()
+        strings = df[c].to_numpy()
+        values = np.full(len(df), np.nan, dtype=object)
+        for kind, convert in [('str', str), ('int', int), ('float', float),
+                              ('bool', lambda v: v == 'True'),
+                              ('datetime', datetime.fromisoformat)]:
+            mask = kinds == kind
+            values[mask] = [convert(v) for v in strings[mask]]
+        df[c] = pd.Series(values, index=df.index, dtype=object)
+    return df
+
+
 def concat_compartment(df):
     """
     Concatenate primary & secondary compartment cols sequentially. If both
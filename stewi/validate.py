@@ -4,14 +4,23 @@
 """
 Functions to support validation of generated inventories
 """
+import hashlib
+import importlib
+import os
+import sqlite3
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
 from stewi.globals import log, DATA_PATH, paths, write_metadata,\
     source_metadata
 
+VALIDATION_SETS_CSV = DATA_PATH.joinpath('ValidationSets_Sources.csv')
+VALIDATION_SETS_FIELDS = ['Inventory', 'Version', 'Year', 'Name', 'URL',
+                          'Criteria', 'Date Acquired']
+
 
 def validate_inventory(inventory_df, reference_df, group_by=None,
                        tolerance=5.0, filepath=''):
@@ -29,15 +38,18 @@ def validate_inventory(inventory_df, reference_df, group_by=None,
     if not group_by:
         group_by_columns = ['FlowName']
     else:
-        group_by_columns = [group_by] if isinstance(group_by, str) else group_by
+        group_by_columns = [group_by] if isinstance(group_by, str) else list(group_by)
     if 'Compartment' in group_by_columns:
-        reference_df['PrimaryCompartment'] = reference_df['Compartment']
-        inventory_df['PrimaryCompartment'] = (inventory_df['Compartment']
-                                              .str.split('/').str[0])
+        reference_df = reference_df.assign(
+            PrimaryCompartment=reference_df['Compartment'])
+        inventory_df = inventory_df.assign(
+            PrimaryCompartment=inventory_df['Compartment'].str.split('/').str[0])
         group_by_columns.append('PrimaryCompartment')
         group_by_columns.remove('Compartment')
-    inventory_df['FlowAmount'] = inventory_df['FlowAmount'].fillna(0.0)
-    reference_df['FlowAmount'] = reference_df['FlowAmount'].fillna(0.0)
+    inventory_df = inventory_df.assign(
+        FlowAmount=inventory_df['FlowAmount'].fillna(0.0))
+    reference_df = reference_df.assign(
+        FlowAmount=reference_df['FlowAmount'].fillna(0.0))
     inventory_sums = inventory_df[group_by_columns + ['FlowAmount']].groupby(
         group_by_columns).sum().reset_index()
     reference_sums = reference_df[group_by_columns + ['FlowAmount']].groupby(
@@ -47,59 +59,39 @@ def validate_inventory(inventory_df, reference_df, group_by=None,
     validation_df = inventory_sums.merge(reference_sums, how='outer',
                                          on=group_by_columns).reset_index(drop=True)
     validation_df = validation_df.fillna(0.0)
-    amount_x_list = []
-    amount_y_list = []
-    pct_diff_list = []
-    conclusion = []
-    error_count = 0
-    for index, row in validation_df.iterrows():
-        amount_x = float(row['FlowAmount_x'])
-        amount_y = float(row['FlowAmount_y'])
-        if amount_x == 0.0:
-            amount_x_list.append(amount_x)
-            if amount_y == 0.0:
-                pct_diff_list.append(0.0)
-                amount_y_list.append(amount_y)
-                conclusion.append('Both inventory and reference are zero or null')
-            elif amount_y == np.inf:
-                amount_y_list.append(np.nan)
-                pct_diff_list.append(100.0)
-                conclusion.append('Reference contains infinity values. '
-                                  'Check prior calculations.')
-            else:
-                amount_y_list.append(amount_y)
-                pct_diff_list.append(100.0)
-                conclusion.append('Inventory value is zero or null')
-                error_count += 1
-        elif amount_y == 0.0:
-            amount_x_list.append(amount_x)
-            amount_y_list.append(amount_y)
-            pct_diff_list.append(100.0)
-            conclusion.append('Reference value is zero or null')
-            continue
-        elif amount_y == np.inf:
-            amount_x_list.append(amount_x)
-            amount_y_list.append(np.nan)
-            pct_diff_list.append(100.0)
-            conclusion.append('Reference contains infinity values. '
-                              'Check prior calculations.')
-        else:
-            pct_diff = 100.0 * abs(amount_y - amount_x) / amount_y
-            pct_diff_list.append(pct_diff)
-            amount_x_list.append(amount_x)
-            amount_y_list.append(amount_y)
-            if pct_diff == 0.0:
-                conclusion.append('Identical')
-            elif pct_diff <= tolerance:
-                conclusion.append('Statistically similar')
-            elif pct_diff > tolerance:
-                conclusion.append('Percent difference exceeds tolerance')
-                error_count += 1
-    validation_df['Inventory_Amount'] = amount_x_list
-    validation_df['Reference_Amount'] = amount_y_list
-    validation_df['Percent_Difference'] = pct_diff_list
-    validation_df['Conclusion'] = conclusion
+    amount_x = validation_df['FlowAmount_x'].to_numpy(dtype=float)
+    amount_y = validation_df['FlowAmount_y'].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_diff = 100.0 * np.abs(amount_y - amount_x) / amount_y
+    x_zero = amount_x == 0.0
+    y_zero = amount_y == 0.0
+    y_inf = amount_y == np.inf
+    # conditions are evaluated in order, the first match applies
+    conditions = [x_zero & y_zero,
+                  y_inf,
+                  x_zero,
+                  y_zero,
+                  pct_diff == 0.0,
+                  pct_diff <= tolerance,
+                  pct_diff > tolerance]
+    conclusions = ['Both inventory and reference are zero or null',
+                   'Reference contains infinity values. '
+                   'Check prior calculations.',
+                   'Inventory value is zero or null',
+                   'Reference value is zero or null',
+                   'Identical',
+                   'Statistically similar',
+                   'Percent difference exceeds tolerance']
+    validation_df['Inventory_Amount'] = amount_x
+    validation_df['Reference_Amount'] = np.where(y_inf, np.nan, amount_y)
+    validation_df['Percent_Difference'] = np.select(
+        conditions[:4], [0.0, 100.0, 100.0, 100.0], default=pct_diff)
+    validation_df['Conclusion'] = np.select(conditions, conclusions,
+                                            default=None)
     validation_df = validation_df.drop(['FlowAmount_x', 'FlowAmount_y'], axis=1)
+    error_count = validation_df['Conclusion'].isin(
+        ['Inventory value is zero or null',
+         'Percent difference exceeds tolerance']).sum()
     if error_count > 0:
         log.warning(f'{str(error_count)} potential issues in validation '
                     'exceeding tolerance')
@@ -107,13 +99,214 @@ def validate_inventory(inventory_df, reference_df, group_by=None,
     return validation_df
 
 
-def read_ValidationSets_Sources():
-    """Read and return ValidationSets_Sources.csv file."""
-    df = pd.read_csv(DATA_PATH.joinpath('ValidationSets_Sources.csv'),
-                     header=0, dtype={"Year": "str"})
+def _inventory_module(inventory_acronym):
+    return importlib.import_module(
+        'stewi.egrid' if inventory_acronym == 'eGRID'
+        else f'stewi.{inventory_acronym}')
+
+
+def validate_stored_inventory(inventory_acronym, year):
+    """Validate a stored inventory against its reference totals without
+    regenerating the inventory.
+
+    :param inventory_acronym: str for inventory e.g. 'TRI'
+    :param year: str for year e.g. '2016'
+    :return: df returned from validate_inventory, or None if no reference
+        data are available
+    :raises FileNotFoundError: if the inventory is not stored locally
+    """
+    module = _inventory_module(inventory_acronym)
+    return module.validate_stored_inventory(str(year))
+
+
+def build_validation_totals(inventory_acronym, year):
+    """Build the reference totals of an inventory that are generated on
+    demand, if they are not stored.
+
+    :param inventory_acronym: str for inventory e.g. 'TRI'
+    :param year: str for year e.g. '2016'
+    """
+    module = _inventory_module(inventory_acronym)
+    if hasattr(module, 'build_validation_totals'):
+        module.build_validation_totals(str(year))
+
+
+def validate_stored_inventories(inventory_dict=None, max_workers=None):
+    """Validate stored inventories in parallel and write a single report to
+    the local validation directory.
+
+    Reference totals are built before validations start so that parallel
+    processes do not build them concurrently. Inventories that are not
+    stored locally are skipped, they are not generated.
+
+    :param inventory_dict: dictionary of inventory acronyms (key) and list of
+        years, defaults to all stored flowbyfacility inventories
+    :param max_workers: int, maximum number of processes
+    :return: DataFrame of validation results for all inventories and years
+    """
+    if inventory_dict is None:
+        from stewi import getAvailableInventoriesandYears
+        inventory_dict = getAvailableInventoriesandYears() or {}
+    tasks = []
+    for inventory_acronym, years in inventory_dict.items():
+        for year in years:
+            try:
+                build_validation_totals(inventory_acronym, year)
+            except Exception as err:
+                log.error(f'reference totals for {inventory_acronym} {year} '
+                          f'could not be built: {err!r}')
+                continue
+            tasks.append((inventory_acronym, str(year)))
+    results = []
+    missing = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(validate_stored_inventory, *task)
+                   for task in tasks]
+        for (inventory_acronym, year), future in zip(tasks, futures):
+            try:
+                validation_df = future.result()
+            except FileNotFoundError as err:
+                log.warning(f'{inventory_acronym} {year} skipped: {err}')
+                missing.append(f'{inventory_acronym} {year}')
+                continue
+            except Exception as err:
+                log.error(f'validation of {inventory_acronym} {year} '
+                          f'failed: {err!r}')
+                continue
+            if validation_df is None:
+                log.warning(f'no validation available for {inventory_acronym} '
+                            f'{year}')
+                continue
+            validation_df.insert(0, 'Year', year)
+            validation_df.insert(0, 'Inventory', inventory_acronym)
+            results.append(validation_df)
+    if missing:
+        log.warning('inventories not stored locally were not validated: '
+                    f'{", ".join(missing)}')
+    if not results:
+        log.warning('no inventories validated')
+        return None
+    report = pd.concat(results, ignore_index=True)
+    directory = paths.local_path / 'validation'
+    directory.mkdir(parents=True, exist_ok=True)
+    filepath = directory / 'validation_report.parquet'
+    log.info(f'writing validation report to {filepath}')
+    report.to_parquet(filepath, index=False)
+    summary = (report.groupby(['Inventory', 'Year', 'Conclusion'])
+               .size().unstack(fill_value=0))
+    log.info(f'validation summary:\n{summary.to_string()}')
+    return report
+
+
+def connect_validation_sets():
+    """Return a connection to the local validation sets database.
+
+    The database holds the metadata of the validation reference datasets
+    and is synchronized with the packaged ValidationSets_Sources.csv when
+    that file changes. Transactions are managed explicitly so that
+    concurrent processes can safely update it.
+    """
+    directory = paths.local_path / 'validation'
+    directory.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(directory / 'ValidationSets_Sources.sqlite',
+                          timeout=60, isolation_level=None)
+    fields = ', '.join(f'"{f}" TEXT' for f in VALIDATION_SETS_FIELDS)
+    con.execute(f'CREATE TABLE IF NOT EXISTS validation_sets ({fields}, '
+                'position REAL NOT NULL, PRIMARY KEY (Inventory, Year))')
+    con.execute('CREATE TABLE IF NOT EXISTS meta '
+                '(key TEXT PRIMARY KEY, value TEXT)')
+    if _csv_hash() != _stored_csv_hash(con):
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            # check again once the write lock is held
+            if _csv_hash() != _stored_csv_hash(con):
+                _load_validation_sets_csv(con)
+            con.execute('COMMIT')
+        except BaseException:
+            con.execute('ROLLBACK')
+            con.close()
+            raise
+    return con
+
+
+def _csv_hash():
+    return hashlib.sha256(VALIDATION_SETS_CSV.read_bytes()).hexdigest()
+
+
+def _stored_csv_hash(con):
+    row = con.execute("SELECT value FROM meta WHERE key = 'csv_hash'").fetchone()
+    return row[0] if row else None
+
+
+def _load_validation_sets_csv(con):
+    """Replace the database records with those in the packaged csv."""
+    log.info(f'loading {VALIDATION_SETS_CSV.name} to validation sets database')
+    df = pd.read_csv(VALIDATION_SETS_CSV, header=0, dtype=str)
+    df = df.astype(object).where(df.notna(), None)
+    con.execute('DELETE FROM validation_sets')
+    con.executemany(
+        _insert_statement(),
+        [tuple(r[f] for f in VALIDATION_SETS_FIELDS) + (float(i),)
+         for i, r in enumerate(df.to_dict('records'))])
+    con.execute("INSERT OR REPLACE INTO meta VALUES ('csv_hash', ?)",
+                (_csv_hash(),))
+
+
+def _insert_statement():
+    fields = ', '.join(f'"{f}"' for f in VALIDATION_SETS_FIELDS)
+    values = ', '.join('?' for _ in VALIDATION_SETS_FIELDS)
+    updates = ', '.join(f'"{f}" = excluded."{f}"' for f in VALIDATION_SETS_FIELDS
+                        if f not in ('Inventory', 'Year'))
+    return (f'INSERT INTO validation_sets ({fields}, position) '
+            f'VALUES ({values}, ?) ON CONFLICT (Inventory, Year) '
+            f'DO UPDATE SET {updates}')
+
+
+def _export_validation_sets_csv(con):
+    """Write the database records to the packaged csv, replacing the file
+    only once it is fully written."""
+    df = read_ValidationSets_Sources(con)
+    temp = VALIDATION_SETS_CSV.with_suffix(f'.{os.getpid()}.tmp')
+    try:
+        df.to_csv(temp, index=False)
+        os.replace(temp, VALIDATION_SETS_CSV)
+    except OSError as err:
+        log.warning(f'unable to write {VALIDATION_SETS_CSV}: {err}')
+        temp.unlink(missing_ok=True)
+        return
+    con.execute("INSERT OR REPLACE INTO meta VALUES ('csv_hash', ?)",
+                (_csv_hash(),))
+
+
+def read_ValidationSets_Sources(con=None):
+    """Read and return the validation sets sources as a dataframe."""
+    close = con is None
+    if close:
+        con = connect_validation_sets()
+    try:
+        fields = ', '.join(f'"{f}"' for f in VALIDATION_SETS_FIELDS)
+        df = pd.read_sql_query(f'SELECT {fields} FROM validation_sets '
+                               'ORDER BY position', con)
+    finally:
+        if close:
+            con.close()
     return df
 
 
+def read_validation_set_info(inventory_acronym, year):
+    """Return a dictionary of metadata for the validation set of an
+    inventory and year, or None if not found."""
+    con = connect_validation_sets()
+    try:
+        con.row_factory = sqlite3.Row
+        row = con.execute('SELECT * FROM validation_sets '
+                          'WHERE Inventory = ? AND Year = ?',
+                          (inventory_acronym, str(year))).fetchone()
+    finally:
+        con.close()
+    return dict(row) if row else None
+
+
 def write_validation_result(inventory_acronym, year, validation_df):
     """Write the validation result and associated metadata to local dir.
 
@@ -127,16 +320,10 @@ def write_validation_result(inventory_acronym, year, validation_df):
     validation_df.to_csv(directory / f'{inventory_acronym}_{year}.csv',
                          index=False)
     # Get metadata on validation dataset
-    validation_set_info_table = read_ValidationSets_Sources()
-    # Get record for year and source
-    validation_set_info = validation_set_info_table[
-        (validation_set_info_table['Inventory'] == inventory_acronym) &
-        (validation_set_info_table['Year'] == year)]
-    if len(validation_set_info) != 1:
+    validation_set_info = read_validation_set_info(inventory_acronym, year)
+    if validation_set_info is None:
         log.error('no validation metadata found')
         return
-    # Convert to Series
-    validation_set_info = validation_set_info.iloc[0, ]
     # Use the same format an inventory metadata to described the validation set data
     validation_metadata = dict(source_metadata)
     validation_metadata['SourceFileName'] = validation_set_info['Name']
@@ -153,26 +340,47 @@ def update_validationsets_sources(validation_dict, date_acquired=False):
     """Add or replaces metadata dictionary of validation reference dataset to
     the validation sets sources file.
 
+    The record is updated in the local validation sets database and the
+    packaged csv is rewritten from the database within the same transaction,
+    so that concurrent updates are not lost.
+
     :param validation_dict: dictionary of validation metadata
     :param date_acquired:
     """
     if not date_acquired:
         date = datetime.today().strftime('%d-%b-%Y')
         validation_dict['Date Acquired'] = date
-    v_table = read_ValidationSets_Sources()
-    existing = v_table.loc[(v_table['Inventory'] == validation_dict['Inventory']) &
-                           (v_table['Year'] == validation_dict['Year'])]
-    if len(existing) > 0:
-        i = existing.index[0]
-        v_table = v_table.loc[~v_table.index.isin(existing.index)]
-        line = pd.DataFrame.from_records([validation_dict], index=[(i)])
-    else:
-        inventories = list(v_table['Inventory'])
-        i = max(loc for loc, val in enumerate(inventories)
-                if val == validation_dict['Inventory'])
-        line = pd.DataFrame.from_records([validation_dict], index=[(i+0.5)])
-    v_table = pd.concat([v_table, line], ignore_index=False)
-    v_table = v_table.sort_index().reset_index(drop=True)
-    log.info("updating ValidationSets_Sources.csv with "
-             f"{validation_dict['Inventory']} {validation_dict['Year']}")
-    v_table.to_csv(DATA_PATH.joinpath('ValidationSets_Sources.csv'), index=False)
+    record = {f: validation_dict.get(f) for f in VALIDATION_SETS_FIELDS}
+    record = {k: (None if v is None or v == '' else str(v))
+              for k, v in record.items()}
+    con = connect_validation_sets()
+    try:
+        con.execute('BEGIN IMMEDIATE')
+        # new records are placed after existing records of the same inventory
+        last = con.execute('SELECT MAX(position) FROM validation_sets '
+                           'WHERE Inventory = ?',
+                           (record['Inventory'],)).fetchone()[0]
+        if last is None:
+            last = con.execute('SELECT MAX(position) FROM validation_sets'
+                               ).fetchone()[0]
+        following = None
+        if last is not None:
+            following = con.execute('SELECT MIN(position) FROM validation_sets '
+                                    'WHERE position > ?', (last,)).fetchone()[0]
+        if last is None:
+            position = 0.0
+        elif following is None:
+            position = last + 1
+        else:
+            position = (last + following) / 2
+        con.execute(_insert_statement(),
+                    tuple(record.values()) + (position,))
+        log.info("updating ValidationSets_Sources.csv with "
+                 f"{record['Inventory']} {record['Year']}")
+        _export_validation_sets_csv(con)
+        con.execute('COMMIT')
+    except BaseException:
+        con.execute('ROLLBACK')
+        raise
+    finally:
+        con.close()
@@ -0,0 +1,84 @@
+"""Test the assignment of secondary contexts to inventory records."""
+
+import numpy as np
+import pandas as pd
+from esupy import context_secondary
+
+import stewi.globals
+import stewi.NEI
+
+
+def fake_context_main(df, year, *args):
+    """Assign secondary contexts as esupy.context_secondary.main would,
+    from Latitude and StackHeight."""
+    df = df.copy()
+    if 'urb' in args:
+        df['cmpt_urb'] = np.where(df['Latitude'] > 40, 'urban', 'rural')
+    if 'rh' in args:
+        df['cmpt_rh'] = np.where(df['StackHeight'] > 50, 'high', 'low')
+    return df
+
+
+def nei_point_records():
+    return pd.DataFrame(
+        {'FacilityID': ['1', '1', '2'],
+         'FacilityName': ['a', 'a', 'b'],
+         'State': ['NC', 'NC', 'TX'],
+         'Zip': [27701, 27701, 77001],
+         'Latitude': [45.0, 45.0, 30.0],
+         'Longitude': [-80.0, -80.0, -95.0],
+         'FlowName': ['Lead', 'Lead', 'Benzene'],
+         'FlowID': ['7439921', '7439921', '71432'],
+         'FlowAmount': [1.0, 2.0, 3.0],
+         'DataReliability': [1, 1, 2],
+         'Process': ['10100101', '10100101', '20200101'],
+         'UnitID': ['u1', 'u2', 'u3'],
+         'UnitType': ['Boiler', 'Boiler', 'Other'],
+         'StackHeight': [100.0, 10.0, 10.0],
+         'Compartment': 'air',
+         'Source': 'NEI'})
+
+
+def test_NEI_compartments(monkeypatch, tmp_path):
+    monkeypatch.setattr(context_secondary, 'main', fake_context_main)
+    monkeypatch.setattr(stewi.globals, 'secondary_context_file',
+                        lambda vintage: tmp_path / f'urban_rural_{vintage}.parquet')
+    monkeypatch.setattr(stewi.NEI, 'standardize_output',
+                        lambda year, states=None: nei_point_records())
+
+    outputs, parameters = stewi.NEI.generate_NEI_outputs('2020')
+
+    assert set(parameters) == {'urban_rural', 'release_height'}
+    df = outputs['flowbyprocess']
+    assert sorted(zip(df['FacilityID'], df['Compartment'])) == [
+        ('1', 'air/urban/high'), ('1', 'air/urban/low'), ('2', 'air/rural/low')]
+    assert outputs['facility'].set_index('FacilityID')['UrbanRural'].to_dict() == {
+        '1': 'urban', '2': 'rural'}
+
+
+def test_release_height_by_release_point(monkeypatch):
+    calls = []
+
+    def counting_context_main(df, year, *args):
+        calls.append(len(df))
+        return fake_context_main(df, year, *args)
+
+    monkeypatch.setattr(context_secondary, 'main', counting_context_main)
+    rng = np.random.default_rng(0)
+    points = nei_point_records().drop(columns=['FlowName', 'FlowID',
+                                               'FlowAmount', 'DataReliability'])
+    points = pd.concat([points.assign(UnitID=points['UnitID'] + str(i),
+                                      StackHeight=rng.uniform(0, 100, 3))
+                        for i in range(100)], ignore_index=True)
+    # each release point reports 40 flows
+    flows = pd.DataFrame({'FlowName': [f'flow {i}' for i in range(40)],
+                          'FlowID': [str(i) for i in range(40)]})
+    df = points.merge(flows, how='cross')
+    df['FlowAmount'] = rng.exponential(size=len(df))
+    df['DataReliability'] = rng.integers(1, 5, len(df))
+
+    result = stewi.globals.assign_release_height(df, 2020)
+
+    assert calls == [len(points)]
+    assert len(points) * 40 == len(df)
+    pd.testing.assert_frame_equal(result, fake_context_main(df, 2020, 'rh'))
@@ -0,0 +1,47 @@
+"""Test the comparison of inventories against reference data."""
+
+import numpy as np
+import pandas as pd
+
+from stewi.validate import validate_inventory
+
+
+def test_validate_inventory_conclusions():
+    inventory_df = pd.DataFrame(
+        {'FlowName': ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h'],
+         'Compartment': ['air', 'air/urban', 'water', 'air', 'air',
+                         'soil', 'air', 'air'],
+         'FlowAmount': [1.0, 1.02, 2.0, 0.0, np.nan, 5.0, 0.0, 3.0]})
+    reference_df = pd.DataFrame(
+        {'FlowName': ['a', 'b', 'c', 'd', 'e', 'f', 'g'],
+         'Compartment': ['air', 'air', 'water', 'air', 'air', 'soil', 'air'],
+         'FlowAmount': [1.0, 1.0, 1.0, 0.0, 4.0, np.inf, np.inf]})
+    inventory_copy = inventory_df.copy()
+    reference_copy = reference_df.copy()
+    group_by = ['FlowName', 'Compartment']
+
+    df = validate_inventory(inventory_df, reference_df, group_by=group_by)
+
+    # inputs are not modified
+    pd.testing.assert_frame_equal(inventory_df, inventory_copy)
+    pd.testing.assert_frame_equal(reference_df, reference_copy)
+    assert group_by == ['FlowName', 'Compartment']
+
+    assert list(df.columns) == ['FlowName', 'PrimaryCompartment',
+                                'Inventory_Amount', 'Reference_Amount',
+                                'Percent_Difference', 'Conclusion']
+    df = df.set_index('FlowName')
+    assert df['Conclusion'].to_dict() == {
+        'a': 'Identical',
+        'b': 'Statistically similar',
+        'c': 'Percent difference exceeds tolerance',
+        'd': 'Both inventory and reference are zero or null',
+        'e': 'Inventory value is zero or null',
+        'f': 'Reference contains infinity values. Check prior calculations.',
+        'g': 'Reference contains infinity values. Check prior calculations.',
+        'h': 'Reference value is zero or null'}
+    assert df.loc['b', 'Percent_Difference'] == 100.0 * abs(1.0 - 1.02) / 1.0
+    assert df.loc['c', 'Percent_Difference'] == 100.0
+    assert df.loc['d', 'Percent_Difference'] == 0.0
+    assert np.isnan(df.loc['f', 'Reference_Amount'])
+    assert df.loc['e', 'Inventory_Amount'] == 0.0